@@ -1,17 +1,56 @@
+import asyncio
+import bisect
+import codecs
+import contextvars
+import csv
+import fnmatch
+import functools
+import hashlib
 import json
+import heapq
+import inspect
+import io
+import itertools
+import os
+import queue
 import re
-from typing import Any, Dict, List, Optional
+import sqlite3
+import threading
+import time
+from array import array
+from collections import Counter, OrderedDict, deque, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional, Union
 
 import requests
 import snowflake.connector
-import sqlparse
 import yaml
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 try:
-    from openai import OpenAI
+    from openai import APIConnectionError, AsyncOpenAI, OpenAI
 except Exception:  # pragma: no cover
+    APIConnectionError = None  # type: ignore
+    AsyncOpenAI = None  # type: ignore
     OpenAI = None  # type: ignore
 
+try:
+    import graphviz
+except Exception:  # pragma: no cover
+    graphviz = None  # type: ignore
+
+try:
+    import pyarrow
+except Exception:  # pragma: no cover
+    pyarrow = None  # type: ignore
+
+try:
+    import tiktoken
+except Exception:  # pragma: no cover
+    tiktoken = None  # type: ignore
+
 
 class SnowflakeConnectionError(Exception):
     pass
@@ -21,6 +60,204 @@ class OpenAIClientNotConfigured(Exception):
     pass
 
 
+# Application name recorded in every Snowflake QUERY_TAG.
+QUERY_TAG_APP = 'snfl_data_nxt'
+_MISSING = object()
+
+_current_span = contextvars.ContextVar('snfl_current_span', default=None)
+# Caller-chosen id (e.g. one per Streamlit session) recorded on every span so
+# a shared tracer can be filtered per session.
+_trace_session = contextvars.ContextVar('snfl_trace_session', default=None)
+
+
+def set_trace_session(session_id):
+    """Tag spans opened from the current context with ``session_id``."""
+    _trace_session.set(session_id)
+
+
+class Tracer:
+    """Bounded in-memory record of timing spans for backend calls.
+
+    A span is a dict with ``id``, ``parent``, ``name``, ``op`` (the
+    outermost entry point it belongs to), ``start`` (epoch seconds),
+    ``duration_ms``, ``status`` and whatever the call adds, such as
+    ``rows``, ``bytes``, ``query_id``, ``prompt_tokens``,
+    ``completion_tokens``, ``cache_hits`` and ``cache_misses``. Spans
+    opened inside another span on the same thread or asyncio task record
+    it as their parent, and every span carries the ``session`` set with
+    ``set_trace_session``. Set ``SNFL_TRACING=0`` to turn recording off.
+    """
+
+    def __init__(self, max_spans=5000, enabled=True):
+        self.enabled = enabled
+        self._spans = deque(maxlen=max_spans)
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+
+    @contextmanager
+    def span(self, name, current=True, **attrs):
+        if not self.enabled:
+            yield {}
+            return
+        parent = _current_span.get()
+        span = {
+            'id': next(self._ids),
+            'parent': parent['id'] if parent else None,
+            'name': name,
+            'op': parent['op'] if parent else name,
+            'session': parent['session'] if parent else _trace_session.get(),
+            'start': time.time(),
+            'thread': threading.current_thread().name,
+            **attrs,
+        }
+        token = _current_span.set(span) if current else None
+        started = time.perf_counter()
+        span['status'] = 'ok'
+        try:
+            yield span
+        except GeneratorExit:
+            span['status'] = 'closed'
+            raise
+        except BaseException as e:
+            span['status'] = 'error'
+            span['error'] = str(e)[:500]
+            raise
+        finally:
+            span['duration_ms'] = round((time.perf_counter() - started) * 1000, 3)
+            if token is not None:
+                try:
+                    _current_span.reset(token)
+                except ValueError:
+                    # Closed from another context (e.g. a generator finalised elsewhere).
+                    pass
+            with self._lock:
+                self._spans.append(span)
+
+    def spans(self, session=_MISSING):
+        """Recorded spans, only those of ``session`` when it is given."""
+        with self._lock:
+            if session is _MISSING:
+                return list(self._spans)
+            return [span for span in self._spans if span.get('session') == session]
+
+    def clear(self, session=_MISSING):
+        with self._lock:
+            if session is _MISSING:
+                self._spans.clear()
+            else:
+                kept = [span for span in self._spans if span.get('session') != session]
+                self._spans.clear()
+                self._spans.extend(kept)
+
+    def summary(self, spans=None):
+        """Aggregate spans per name: calls, errors, latency and summed counters."""
+        groups = {}
+        for span in self.spans() if spans is None else spans:
+            groups.setdefault(span['name'], []).append(span)
+        rows = []
+        for name, spans in sorted(groups.items()):
+            durations = sorted(s.get('duration_ms', 0) for s in spans)
+            row = {
+                'name': name,
+                'calls': len(spans),
+                'errors': sum(1 for s in spans if s.get('status') == 'error'),
+                'total_ms': round(sum(durations), 1),
+                'p50_ms': durations[len(durations) // 2],
+                'p95_ms': durations[min(len(durations) - 1, int(len(durations) * 0.95))],
+            }
+            for counter in ('rows', 'bytes', 'prompt_tokens', 'completion_tokens', 'cache_hits', 'cache_misses'):
+                row[counter] = sum(s.get(counter) or 0 for s in spans)
+            rows.append(row)
+        return rows
+
+    def to_jsonl(self, spans=None):
+        spans = self.spans() if spans is None else spans
+        return ''.join(json.dumps(span, default=str) + '\n' for span in spans)
+
+    def export_jsonl(self, path):
+        """Append all recorded spans to ``path`` as JSON Lines; returns the number written."""
+        spans = self.spans()
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(self.to_jsonl(spans))
+        return len(spans)
+
+
+_tracer = None
+_tracer_lock = threading.Lock()
+
+
+def get_tracer():
+    global _tracer
+    with _tracer_lock:
+        if _tracer is None:
+            _tracer = Tracer(enabled=os.environ.get('SNFL_TRACING', '1') != '0')
+        return _tracer
+
+
+def _annotate(**counters):
+    """Add numeric counters to (or set other attributes on) the current span."""
+    span = _current_span.get()
+    if span is None:
+        return
+    for key, value in counters.items():
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            span[key] = span.get(key, 0) + value
+        else:
+            span[key] = value
+
+
+def _propagate(fn):
+    """Wrap ``fn`` so that, run on a worker thread, its spans nest under the
+    span current at wrapping time."""
+    span = _current_span.get()
+
+    def run(*args, **kwargs):
+        token = _current_span.set(span)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _current_span.reset(token)
+    return run
+
+
+def traced(name=None):
+    """Record each call of the decorated function as a span. Generator
+    functions are timed until they are exhausted or closed and count the
+    ``items`` they yield."""
+    def decorate(fn):
+        span_name = name or fn.__name__
+        if inspect.isgeneratorfunction(fn):
+            @functools.wraps(fn)
+            def generator_wrapper(*args, **kwargs):
+                tracer = get_tracer()
+                with tracer.span(span_name, current=False) as span:
+                    iterator = fn(*args, **kwargs)
+                    try:
+                        while True:
+                            token = _current_span.set(span) if span else None
+                            try:
+                                item = next(iterator)
+                            except StopIteration:
+                                return
+                            finally:
+                                if token is not None:
+                                    _current_span.reset(token)
+                            if span:
+                                span['items'] = span.get('items', 0) + 1
+                            yield item
+                    finally:
+                        iterator.close()
+            return generator_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with get_tracer().span(span_name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+@traced()
 def connect_to_snowflake(user, password, account, role=None, warehouse=None, database=None, schema=None):
     try:
         conn_params = {
@@ -36,390 +273,3844 @@ def connect_to_snowflake(user, password, account, role=None, warehouse=None, dat
             conn_params['database'] = database
         if schema:
             conn_params['schema'] = schema
+        # One stable tag per session, independent of tracing and without extra round trips.
+        conn_params['session_parameters'] = {'QUERY_TAG': _query_tag()}
         conn = snowflake.connector.connect(**conn_params)
         return conn
     except Exception as e:
         raise SnowflakeConnectionError(str(e))
 
 
-def list_data_objects(conn):
-    try:
+class SnowflakeConnectionPool:
+    """Thread-safe pool of Snowflake connections sharing one set of credentials.
+
+    Connections are validated on checkout: closed sessions, sessions older
+    than ``max_lifetime`` and sessions idle for longer than ``idle_timeout``
+    are replaced, and sessions idle for longer than ``validate_after`` must
+    answer ``SELECT 1`` before they are handed out.
+    """
+
+    def __init__(self, conn_params, min_size=1, max_size=8, idle_timeout=900, max_lifetime=3600,
+                 validate_after=60, checkout_timeout=30):
+        if max_size < 1 or min_size < 0 or min_size > max_size:
+            raise ValueError("pool sizes must satisfy 0 <= min_size <= max_size and max_size >= 1")
+        self.conn_params = dict(conn_params)
+        self.account = self.conn_params.get('account')
+        self.role = self.conn_params.get('role')
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.max_lifetime = max_lifetime
+        self.validate_after = validate_after
+        self.checkout_timeout = checkout_timeout
+        self._idle = deque()  # (conn, created_at, last_used_at)
+        self._created_at = {}
+        self._size = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self.created = 0
+        self.recycled = 0
+        for _ in range(min_size):
+            conn = self._connect()
+            self._size += 1
+            self._idle.append((conn, time.monotonic(), time.monotonic()))
+
+    def _connect(self):
+        conn = connect_to_snowflake(**self.conn_params)
+        with self._cond:
+            self.created += 1
+            self._created_at[id(conn)] = time.monotonic()
+        return conn
+
+    def _discard(self, conn):
+        with self._cond:
+            self._size -= 1
+            self.recycled += 1
+            self._created_at.pop(id(conn), None)
+            self._cond.notify()
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _usable(self, conn, created_at, last_used_at):
+        now = time.monotonic()
+        if now - created_at > self.max_lifetime or now - last_used_at > self.idle_timeout:
+            return False
+        try:
+            if conn.is_closed():
+                return False
+            if now - last_used_at > self.validate_after:
+                cur = conn.cursor()
+                try:
+                    cur.execute("SELECT 1")
+                    cur.fetchall()
+                finally:
+                    cur.close()
+            return True
+        except Exception:
+            return False
+
+    def acquire(self):
+        deadline = time.monotonic() + self.checkout_timeout
+        while True:
+            entry = None
+            with self._cond:
+                if self._closed:
+                    raise SnowflakeConnectionError("connection pool is closed")
+                if self._idle:
+                    entry = self._idle.pop()
+                elif self._size < self.max_size:
+                    self._size += 1
+                else:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise SnowflakeConnectionError(
+                            f"Timed out waiting for a pooled connection (max_size={self.max_size})"
+                        )
+                    self._cond.wait(remaining)
+                    continue
+            if entry is None:
+                try:
+                    return self._connect()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+            conn, created_at, last_used_at = entry
+            if self._usable(conn, created_at, last_used_at):
+                return conn
+            self._discard(conn)
+
+    def release(self, conn, discard=False):
+        try:
+            broken = discard or conn.is_closed()
+        except Exception:
+            broken = True
+        if broken or self._closed:
+            self._discard(conn)
+            return
+        now = time.monotonic()
+        expired = []
+        with self._cond:
+            created_at = self._created_at.get(id(conn), now)
+            self._idle.append((conn, created_at, now))
+            while len(self._idle) > self.min_size and now - self._idle[0][2] > self.idle_timeout:
+                expired.append(self._idle.popleft()[0])
+            self._cond.notify()
+        for stale in expired:
+            self._discard(stale)
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        except Exception:
+            self.release(conn)
+            raise
+        else:
+            self.release(conn)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            idle = [entry[0] for entry in self._idle]
+            self._idle.clear()
+        for conn in idle:
+            self._discard(conn)
+
+    def stats(self):
+        with self._cond:
+            return {
+                'size': self._size,
+                'idle': len(self._idle),
+                'in_use': self._size - len(self._idle),
+                'created': self.created,
+                'recycled': self.recycled,
+            }
+
+
+_connection_pools = {}
+_connection_pools_lock = threading.Lock()
+
+
+@traced()
+def get_connection_pool(user, password, account, role=None, warehouse=None, database=None, schema=None, **pool_options):
+    conn_params = {
+        'user': user,
+        'password': password,
+        'account': account,
+        'role': role,
+        'warehouse': warehouse,
+        'database': database,
+        'schema': schema,
+    }
+    key = hashlib.sha256(json.dumps(conn_params, sort_keys=True).encode('utf-8')).hexdigest()
+    with _connection_pools_lock:
+        pool = _connection_pools.get(key)
+        if pool is None or pool._closed:
+            pool = SnowflakeConnectionPool(conn_params, **pool_options)
+            _connection_pools[key] = pool
+        return pool
+
+
+@contextmanager
+def _borrow(conn):
+    if isinstance(conn, SnowflakeConnectionPool):
+        with conn.connection() as pooled:
+            yield pooled
+    else:
+        yield conn
+
+
+_DEFAULT_CACHE_DIR = os.environ.get(
+    'SNFL_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'snfl_data_nxt')
+)
+
+
+# Seconds a cache connection waits for another process's lock on the file.
+SQLITE_BUSY_TIMEOUT_S = 30.0
+
+
+class PersistentCache:
+    """LRU cache held in memory and mirrored to a local SQLite file.
+
+    Keys are tuples of strings so whole subtrees can be dropped with
+    ``invalidate(prefix)``; values must be JSON serializable. Pass
+    ``path=None`` to keep the cache in memory only. ``max_bytes`` and
+    ``max_disk_bytes`` bound the JSON size of the entries kept, evicting the
+    least recently used first.
+    """
+
+    _SEP = '\x1f'
+
+    def __init__(self, path=None, namespace='default', max_entries=2048, max_disk_entries=50000, default_ttl=None,
+                 max_bytes=None, max_disk_bytes=None):
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries
+        self.max_bytes = max_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.default_ttl = default_ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.RLock()
+        self._memory = OrderedDict()
+        self._sizes = {}
+        self._memory_bytes = 0
+        self._db = None
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            # Batch workers share these files: WAL lets readers run alongside a
+            # writer, and the busy timeout waits out another process's write lock.
+            self._db = sqlite3.connect(path, timeout=SQLITE_BUSY_TIMEOUT_S, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode = WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS cache_entries ("
+                "namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, "
+                "stored_at REAL NOT NULL, accessed_at REAL NOT NULL, "
+                "PRIMARY KEY (namespace, key))"
+            )
+            self._db.commit()
+
+    def _encode_key(self, key):
+        return self._SEP.join(str(part) for part in key)
+
+    def _remember(self, skey, stored_at, value, size=0):
+        self._memory_bytes += size - self._sizes.get(skey, 0)
+        self._sizes[skey] = size
+        self._memory[skey] = (stored_at, value)
+        self._memory.move_to_end(skey)
+        while len(self._memory) > self.max_entries or (
+            self.max_bytes is not None and self._memory_bytes > self.max_bytes and len(self._memory) > 1
+        ):
+            self._forget(next(iter(self._memory)))
+
+    def _forget(self, skey):
+        del self._memory[skey]
+        self._memory_bytes -= self._sizes.pop(skey, 0)
+
+    def _entry(self, skey, now):
+        entry = self._memory.get(skey)
+        if entry is not None:
+            self._memory.move_to_end(skey)
+        elif self._db is not None:
+            row = self._db.execute(
+                "SELECT stored_at, value FROM cache_entries WHERE namespace = ? AND key = ?",
+                (self.namespace, skey),
+            ).fetchone()
+            if row is not None:
+                entry = (row[0], json.loads(row[1]))
+                self._db.execute(
+                    "UPDATE cache_entries SET accessed_at = ? WHERE namespace = ? AND key = ?",
+                    (now, self.namespace, skey),
+                )
+                self._db.commit()
+                self._remember(skey, *entry, size=len(row[1]))
+        return entry
+
+    def get(self, key, ttl=_MISSING, default=None):
+        ttl = self.default_ttl if ttl is _MISSING else ttl
+        now = time.time()
+        with self._lock:
+            entry = self._entry(self._encode_key(key), now)
+            if entry is None or (ttl is not None and now - entry[0] > ttl):
+                self.misses += 1
+                _annotate(cache_misses=1)
+                return default
+            self.hits += 1
+            _annotate(cache_hits=1)
+            return entry[1]
+
+    def peek(self, key):
+        """Return ``(age, value)`` for ``key`` regardless of TTL, or ``None``,
+        without counting a hit or a miss."""
+        now = time.time()
+        with self._lock:
+            entry = self._entry(self._encode_key(key), now)
+        return None if entry is None else (now - entry[0], entry[1])
+
+    def set(self, key, value, size=None):
+        """Store ``value``; ``size`` overrides the JSON length counted against
+        ``max_bytes``, so memory-only caches can hold values that are not JSON."""
+        skey = self._encode_key(key)
+        now = time.time()
+        encoded = json.dumps(value) if self._db is not None or (self.max_bytes is not None and size is None) else None
+        with self._lock:
+            self._remember(skey, now, value, size if size is not None else len(encoded) if encoded is not None else 0)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO cache_entries (namespace, key, value, stored_at, accessed_at) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (self.namespace, skey, encoded, now, now),
+                )
+                self._db.execute(
+                    "DELETE FROM cache_entries WHERE namespace = ? AND key IN ("
+                    "SELECT key FROM cache_entries WHERE namespace = ? "
+                    "ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                    (self.namespace, self.namespace, self.max_disk_entries),
+                )
+                if self.max_disk_bytes is not None:
+                    # Keep the most recently used entries whose running size fits.
+                    self._db.execute(
+                        "DELETE FROM cache_entries WHERE namespace = ? AND key IN ("
+                        "SELECT key FROM (SELECT key, SUM(length(value)) OVER "
+                        "(ORDER BY accessed_at DESC, key ROWS UNBOUNDED PRECEDING) AS total "
+                        "FROM cache_entries WHERE namespace = ?) WHERE total > ? AND key != ?)",
+                        (self.namespace, self.namespace, self.max_disk_bytes, skey),
+                    )
+                self._db.commit()
+
+    def invalidate(self, prefix=()):
+        skey = self._encode_key(prefix)
+        with self._lock:
+            if not prefix:
+                self._memory.clear()
+                self._sizes.clear()
+                self._memory_bytes = 0
+            else:
+                for k in [k for k in self._memory if k == skey or k.startswith(skey + self._SEP)]:
+                    self._forget(k)
+            if self._db is not None:
+                if not prefix:
+                    self._db.execute("DELETE FROM cache_entries WHERE namespace = ?", (self.namespace,))
+                else:
+                    self._db.execute(
+                        "DELETE FROM cache_entries WHERE namespace = ? AND (key = ? OR substr(key, 1, ?) = ?)",
+                        (self.namespace, skey, len(skey) + 1, skey + self._SEP),
+                    )
+                self._db.commit()
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._memory), 'bytes': self._memory_bytes}
+
+
+# Seconds before a cached explorer result is considered stale, per level
+# (None never expires).
+METADATA_CACHE_TTLS = {
+    'catalog': 900,
+    'schema': 300,
+    'columns': 1800,
+    'column_catalog': 1800,
+    'last_altered': 60,
+    'stage_listing': None,
+}
+
+
+class MetadataCache:
+    """Cache for explorer metadata keyed by account, role and object path.
+
+    With ``check_last_altered`` enabled, an expired table, view or column
+    entry is kept when ``INFORMATION_SCHEMA.TABLES.LAST_ALTERED`` shows the
+    schema's tables have not changed since the entry was stored. Other
+    object listings (stages, procedures, tasks, ...) do not move that
+    timestamp and always expire by TTL.
+    """
+
+    # Levels, and schema-level categories, that LAST_ALTERED tracks.
+    _LAST_ALTERED_LEVELS = ('columns', 'column_catalog')
+    _LAST_ALTERED_CATEGORIES = ('tables', 'views')
+
+    def __init__(self, path=None, ttls=None, max_entries=4096, check_last_altered=False):
+        self.ttls = dict(METADATA_CACHE_TTLS, **(ttls or {}))
+        self.check_last_altered = check_last_altered
+        self._store = PersistentCache(path, namespace='metadata', max_entries=max_entries)
+
+    def _scope(self, conn):
+        return (getattr(conn, 'account', None) or '', getattr(conn, 'role', None) or '')
+
+    def get(self, conn, level, path):
+        key = self._scope(conn) + tuple(path) + (level,)
+        value = self._store.get(key, ttl=self.ttls.get(level))
+        if value is not None:
+            return value
+        if self.check_last_altered and self._tracks_last_altered(level, path):
+            # The expired entry already counted as a miss above.
+            entry = self._store.peek(key)
+            if entry is not None and not self._schema_changed(conn, path[0], path[1], entry[0]):
+                self._store.set(key, entry[1])
+                return entry[1]
+        return None
+
+    def set(self, conn, level, path, value):
+        self._store.set(self._scope(conn) + tuple(path) + (level,), value)
+
+    def _tracks_last_altered(self, level, path):
+        if len(path) < 2 or not path[1]:
+            return False
+        if level == 'schema':
+            return len(path) >= 3 and path[2] in self._LAST_ALTERED_CATEGORIES
+        return level in self._LAST_ALTERED_LEVELS
+
+    def get_or_load(self, conn, level, path, loader):
+        value = self.get(conn, level, path)
+        if value is None:
+            value = loader()
+            self.set(conn, level, path, value)
+        return value
+
+    def _schema_changed(self, conn, database, schema, age):
+        try:
+            stamps = self.get_or_load(conn, 'last_altered', (database,), lambda: _schema_last_altered(conn, database))
+        except Exception:
+            return True
+        altered = stamps.get(schema)
+        return altered is None or time.time() - altered < age
+
+    def invalidate(self, conn, *path):
+        self._store.invalidate(self._scope(conn) + tuple(path))
+
+    def stats(self):
+        return self._store.stats()
+
+
+def _schema_last_altered(conn, database):
+    with _borrow(conn) as conn:
         cur = conn.cursor()
-        cur.execute("SHOW DATABASES")
-        dbs = cur.fetchall()
-        db_names = [db[1] for db in dbs]
-        data = {}
-        for db in db_names:
-            cur.execute(f"SHOW SCHEMAS IN DATABASE {db}")
-            schemas = cur.fetchall()
-            schema_names = [s[1] for s in schemas]
-            data[db] = {}
-            for schema in schema_names:
-                cur.execute(f"SHOW TABLES IN {db}.{schema}")
-                tables = cur.fetchall()
-                table_names = [t[1] for t in tables]
-                cur.execute(f"SHOW VIEWS IN {db}.{schema}")
-                views = cur.fetchall()
-                view_names = [v[1] for v in views]
-                data[db][schema] = {
-                    'tables': table_names,
-                    'views': view_names
-                }
-        cur.close()
-        return data
+        try:
+            _execute(
+                cur,
+                f"SELECT table_schema, DATE_PART(EPOCH_SECOND, MAX(last_altered)) "
+                f"FROM {database}.INFORMATION_SCHEMA.TABLES GROUP BY table_schema",
+            )
+            return {row[0]: float(row[1]) for row in cur.fetchall() if row[1] is not None}
+        finally:
+            cur.close()
+
+
+_metadata_cache = None
+_metadata_cache_lock = threading.Lock()
+
+
+def get_metadata_cache(path=None, **kwargs):
+    global _metadata_cache
+    with _metadata_cache_lock:
+        if _metadata_cache is None:
+            _metadata_cache = MetadataCache(path or os.path.join(_DEFAULT_CACHE_DIR, 'metadata.sqlite'), **kwargs)
+        return _metadata_cache
+
+
+# SHOW commands return at most this many rows; a full page means the listing
+# may be truncated and has to be re-fetched at a narrower scope.
+_SHOW_ROW_LIMIT = 10000
+
+
+class _RoundTripCounter:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.count = 0
+
+    def add(self, n=1):
+        with self._lock:
+            self.count += n
+
+
+def _query_tag():
+    return json.dumps({'app': QUERY_TAG_APP}, separators=(',', ':'))
+
+
+def _execute(cur, sql, params=None, counter=None):
+    # QUERY_TAG is set once per session in connect_to_snowflake.
+    with get_tracer().span('snowflake.execute', sql=' '.join(sql.split())[:200]) as span:
+        if params is None:
+            cur.execute(sql)
+        else:
+            cur.execute(sql, params)
+        if span:
+            span['query_id'] = getattr(cur, 'sfqid', None)
+            span['rows'] = getattr(cur, 'rowcount', None) or 0
+    if counter is not None:
+        counter.add()
+    return cur
+
+
+def _fetch_named_rows(cur):
+    names = [d[0].lower() for d in (cur.description or [])]
+    return [dict(zip(names, row)) for row in cur.fetchall()]
+
+
+def _show(conn, sql, counter=None):
+    with _borrow(conn) as conn:
+        cur = conn.cursor()
+        try:
+            _execute(cur, sql, counter=counter)
+            return _fetch_named_rows(cur)
+        finally:
+            cur.close()
+
+
+def _add_catalog_rows(data, rows, kind):
+    for row in rows:
+        db_schema = data.setdefault(row['database_name'], {})
+        entry = db_schema.setdefault(row['schema_name'], {'tables': [], 'views': []})
+        entry[kind].append(row['name'])
+
+
+def _harvest_database(conn, db, counter):
+    data = {db: {}}
+    for row in _show(conn, f"SHOW SCHEMAS IN DATABASE {db}", counter):
+        data[db][row['name']] = {'tables': [], 'views': []}
+    for kind, show in (('tables', 'TABLES'), ('views', 'VIEWS')):
+        rows = _show(conn, f"SHOW {show} IN DATABASE {db}", counter)
+        if len(rows) >= _SHOW_ROW_LIMIT:
+            rows = []
+            for schema in list(data[db]):
+                rows.extend(_show(conn, f"SHOW {show} IN {db}.{schema}", counter))
+        _add_catalog_rows(data, rows, kind)
+    return data[db]
+
+
+@traced()
+def harvest_catalog(conn, max_workers=8, scope='auto'):
+    """Return ``(data, stats)`` where ``data`` is the nested dict of
+    ``list_data_objects`` and ``stats`` holds the round trips and wall time.
+
+    ``scope='account'`` uses account-wide SHOW commands, ``scope='database'``
+    issues per-database SHOW commands concurrently (at most ``max_workers``
+    at a time) and ``scope='auto'`` tries the account scope first, falling
+    back to per-database listings when a result hits the SHOW row limit.
+    """
+    started = time.perf_counter()
+    counter = _RoundTripCounter()
+    try:
+        db_names = [row['name'] for row in _show(conn, "SHOW DATABASES", counter)]
+        data = {db: {} for db in db_names}
+        pending = list(db_names)
+        if scope in ('auto', 'account'):
+            try:
+                with ThreadPoolExecutor(max_workers=3) as pool:
+                    schemas, tables, views = pool.map(
+                        _propagate(lambda sql: _show(conn, sql, counter)),
+                        ["SHOW SCHEMAS IN ACCOUNT", "SHOW TABLES IN ACCOUNT", "SHOW VIEWS IN ACCOUNT"],
+                    )
+                truncated = any(len(rows) >= _SHOW_ROW_LIMIT for rows in (schemas, tables, views))
+            except Exception:
+                if scope == 'account':
+                    raise
+                truncated = True
+            if scope == 'account' or not truncated:
+                for row in schemas:
+                    if row['database_name'] in data:
+                        data[row['database_name']].setdefault(row['name'], {'tables': [], 'views': []})
+                _add_catalog_rows(data, tables, 'tables')
+                _add_catalog_rows(data, views, 'views')
+                pending = []
+        if pending:
+            with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(pending)))) as pool:
+                futures = {pool.submit(_propagate(_harvest_database), conn, db, counter): db for db in pending}
+                for future in as_completed(futures):
+                    data[futures[future]] = future.result()
+        stats = {
+            'round_trips': counter.count,
+            'wall_time_s': round(time.perf_counter() - started, 3),
+            'scope': 'database' if pending else 'account',
+            'databases': len(data),
+        }
+        return data, stats
     except Exception as e:
         raise Exception(f"Error fetching data objects: {e}")
 
 
-def get_schema_objects(conn, database, schema):
+@traced()
+def list_data_objects(conn, cache=None):
+    if cache is not None:
+        return cache.get_or_load(conn, 'catalog', (), lambda: harvest_catalog(conn)[0])
+    data, _ = harvest_catalog(conn)
+    return data
+
+
+# Object categories shown by the explorer, mapped to their SHOW command.
+SCHEMA_OBJECT_CATEGORIES = {
+    'tables': 'TABLES',
+    'views': 'VIEWS',
+    'stages': 'STAGES',
+    'file_formats': 'FILE FORMATS',
+    'sequences': 'SEQUENCES',
+    'user_functions': 'USER FUNCTIONS',
+    'functions': 'FUNCTIONS',
+    'procedures': 'PROCEDURES',
+    'tasks': 'TASKS',
+    'streams': 'STREAMS',
+    'pipes': 'PIPES',
+}
+
+
+@traced()
+def get_schemas_objects(conn, database, schemas, categories=None, cache=None, max_workers=8):
+    """Return ``{schema: {category: [names]}}`` for several schemas at once.
+
+    Every (schema, category) SHOW command runs on its own cursor in a
+    thread pool of at most ``max_workers``; ``categories`` limits the
+    fetch to the object kinds the caller will display.
+    """
+    categories = list(categories or SCHEMA_OBJECT_CATEGORIES)
+    unknown = [c for c in categories if c not in SCHEMA_OBJECT_CATEGORIES]
+    if unknown:
+        raise Exception(f"Unknown object categories: {', '.join(unknown)}")
     try:
-        cur = conn.cursor()
-        objects = {}
-        cur.execute(f"SHOW TABLES IN {database}.{schema}")
-        objects['tables'] = [row[1] for row in cur.fetchall()]
-        cur.execute(f"SHOW VIEWS IN {database}.{schema}")
-        objects['views'] = [row[1] for row in cur.fetchall()]
-        cur.execute(f"SHOW STAGES IN {database}.{schema}")
-        objects['stages'] = [row[1] for row in cur.fetchall()]
-        cur.execute(f"SHOW FILE FORMATS IN {database}.{schema}")
-        objects['file_formats'] = [row[1] for row in cur.fetchall()]
-        cur.execute(f"SHOW SEQUENCES IN {database}.{schema}")
-        objects['sequences'] = [row[1] for row in cur.fetchall()]
-        cur.execute(f"SHOW USER FUNCTIONS IN {database}.{schema}")
-        objects['user_functions'] = [row[1] for row in cur.fetchall()]
-        cur.execute(f"SHOW FUNCTIONS IN {database}.{schema}")
-        objects['functions'] = [row[1] for row in cur.fetchall()]
-        cur.execute(f"SHOW PROCEDURES IN {database}.{schema}")
-        objects['procedures'] = [row[1] for row in cur.fetchall()]
-        cur.execute(f"SHOW TASKS IN {database}.{schema}")
-        objects['tasks'] = [row[1] for row in cur.fetchall()]
-        cur.execute(f"SHOW STREAMS IN {database}.{schema}")
-        objects['streams'] = [row[1] for row in cur.fetchall()]
-        cur.execute(f"SHOW PIPES IN {database}.{schema}")
-        objects['pipes'] = [row[1] for row in cur.fetchall()]
-        cur.close()
-        return objects
+        results = {schema: {} for schema in schemas}
+        pending = []
+        for schema in schemas:
+            for category in categories:
+                cached = cache.get(conn, 'schema', (database, schema, category)) if cache is not None else None
+                if cached is not None:
+                    results[schema][category] = cached
+                else:
+                    pending.append((schema, category))
+        if pending:
+            def fetch(task):
+                schema, category = task
+                rows = _show(conn, f"SHOW {SCHEMA_OBJECT_CATEGORIES[category]} IN {database}.{schema}")
+                return [row['name'] for row in rows]
+
+            with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(pending)))) as pool:
+                for (schema, category), names in zip(pending, pool.map(_propagate(fetch), pending)):
+                    results[schema][category] = names
+                    if cache is not None:
+                        cache.set(conn, 'schema', (database, schema, category), names)
+        return {
+            schema: {c: objects[c] for c in categories}
+            for schema, objects in results.items()
+        }
     except Exception as e:
         raise Exception(f"Error fetching schema objects: {e}")
 
 
-def get_table_or_view_columns(conn, database, schema, object_name, object_type='table'):
+def get_schema_objects(conn, database, schema, categories=None, cache=None):
+    return get_schemas_objects(conn, database, [schema], categories=categories, cache=cache)[schema]
+
+
+EXPLORER_SORT_KEYS = ('name', 'category')
+
+
+@traced()
+def page_schema_objects(conn, database, schema, categories=None, filter_text='', sort_by='name',
+                        descending=False, page=1, page_size=50, cache=None):
+    """Return one page of a schema's objects, filtered and sorted in the backend.
+
+    ``filter_text`` matches names case-insensitively; ``*`` and ``?`` act as
+    wildcards, otherwise it is a substring match. The result holds the page
+    ``items`` (``{'name', 'category'}`` dicts), the filtered ``total``, the
+    clamped ``page`` and the number of ``pages``, plus per-category counts.
+    """
+    if sort_by not in EXPLORER_SORT_KEYS:
+        raise Exception(f"sort_by must be one of: {', '.join(EXPLORER_SORT_KEYS)}")
+    objects = get_schema_objects(conn, database, schema, categories=categories, cache=cache)
+    pattern = (filter_text or '').strip().upper()
+    if pattern and ('*' in pattern or '?' in pattern):
+        match = re.compile(fnmatch.translate(pattern)).match
+    elif pattern:
+        match = re.compile(re.escape(pattern)).search
+    else:
+        match = None
+    items = [
+        (name, category)
+        for category, names in objects.items()
+        for name in names
+        if match is None or match(name.upper())
+    ]
+    if sort_by == 'name':
+        items.sort(key=lambda item: (item[0].upper(), item[1]), reverse=descending)
+    else:
+        items.sort(key=lambda item: (item[1], item[0].upper()), reverse=descending)
+    page_size = max(1, int(page_size))
+    pages = max(1, -(-len(items) // page_size))
+    page = min(max(1, int(page)), pages)
+    start = (page - 1) * page_size
+    return {
+        'items': [{'name': name, 'category': category} for name, category in items[start:start + page_size]],
+        'total': len(items),
+        'page': page,
+        'pages': pages,
+        'counts': {category: len(names) for category, names in objects.items()},
+    }
+
+
+@traced()
+def get_table_or_view_columns(conn, database, schema, object_name, object_type='table', cache=None):
+    """Return the columns of one table or view.
+
+    With a ``cache`` the lookup is served from the schema's
+    ``ColumnCatalog`` (one query for the whole schema); objects missing from
+    it, such as ones created since it was harvested, fall back to
+    ``SHOW COLUMNS``.
+    """
+    if object_type not in ('table', 'view'):
+        raise Exception("object_type must be 'table' or 'view'")
+    if cache is not None:
+        try:
+            columns = get_column_catalog(conn, database, schema, cache).lookup(schema, object_name)
+        except Exception:
+            columns = None
+        if columns is not None:
+            return columns
+        return cache.get_or_load(
+            conn, 'columns', (database, schema, object_name),
+            lambda: get_table_or_view_columns(conn, database, schema, object_name, object_type),
+        )
     try:
-        cur = conn.cursor()
-        if object_type == 'table':
-            cur.execute(f"SHOW COLUMNS IN TABLE {database}.{schema}.{object_name}")
-        elif object_type == 'view':
-            cur.execute(f"SHOW COLUMNS IN VIEW {database}.{schema}.{object_name}")
-        else:
-            raise Exception("object_type must be 'table' or 'view'")
-        columns = [
+        with _borrow(conn) as conn:
+            cur = conn.cursor()
+            try:
+                _execute(cur, f"SHOW COLUMNS IN {object_type.upper()} {database}.{schema}.{object_name}")
+                rows = _fetch_named_rows(cur)
+            finally:
+                cur.close()
+        return [
             {
-                'name': row[2],
-                'type': row[3],
-                'nullable': row[6],
-                'default': row[7],
-                'kind': row[8]
+                'name': row.get('column_name'),
+                'type': _show_columns_type(row.get('data_type')),
+                'nullable': str(row.get('null?')).lower() == 'true',
+                'default': row.get('default') or None,
+                'kind': row.get('kind') or 'COLUMN',
+                'comment': row.get('comment') or None,
             }
-            for row in cur.fetchall()
+            for row in rows
         ]
-        cur.close()
-        return columns
     except Exception as e:
         raise Exception(f"Error fetching columns for {object_type} {object_name}: {e}")
 
 
-def list_stages(conn, database):
-    try:
-        cur = conn.cursor()
-        cur.execute(f"SHOW STAGES IN DATABASE {database}")
-        stages = [(row[3], row[1]) for row in cur.fetchall()]  # (schema_name, stage_name)
-        cur.close()
-        return stages
-    except Exception as e:
-        raise Exception(f"Error fetching stages: {e}")
+# SHOW COLUMNS reports the internal type names; map them to the SQL names
+# INFORMATION_SCHEMA uses so both column sources agree.
+_SHOW_COLUMNS_TYPE_NAMES = {'FIXED': 'NUMBER', 'REAL': 'FLOAT'}
 
 
-def list_files_in_stage(conn, stage_full_name, database=None):
-    try:
-        cur = conn.cursor()
-        if database:
-            cur.execute(f'USE DATABASE {database}')
-        cur.execute(f"LIST @{stage_full_name}")
-        files = [row[0] for row in cur.fetchall()]
-        cur.close()
-        return files
-    except Exception as e:
-        raise Exception(f"Error listing files in stage {stage_full_name}: {e}")
+def _format_column_type(data_type, length=None, precision=None, scale=None, datetime_precision=None):
+    """Render a column type with its length, precision and scale, e.g.
+    ``VARCHAR(100)``, ``NUMBER(38,0)`` or ``TIMESTAMP_NTZ(9)``."""
+    data_type = (data_type or '').upper()
+    if data_type in ('TEXT', 'VARCHAR', 'STRING') and length is not None:
+        return f'VARCHAR({int(length)})'
+    if data_type in ('BINARY', 'VARBINARY') and length is not None:
+        return f'BINARY({int(length)})'
+    if data_type == 'NUMBER' and precision is not None:
+        return f'NUMBER({int(precision)},{int(scale or 0)})'
+    if (data_type.startswith('TIMESTAMP') or data_type == 'TIME') and datetime_precision is not None:
+        return f'{data_type}({int(datetime_precision)})'
+    return data_type
 
 
-def get_presigned_url(conn, stage_full_name, file_name):
+def _show_columns_type(data_type):
+    """Format the JSON ``data_type`` of a ``SHOW COLUMNS`` row like ``_format_column_type``."""
     try:
-        cur = conn.cursor()
-        cur.execute("SELECT GET_PRESIGNED_URL(%s, %s)", (f"@{stage_full_name}", file_name))
-        url = cur.fetchone()[0]
-        cur.close()
-        return url
-    except Exception as e:
-        raise Exception(f"Error generating presigned URL for {file_name} in stage {stage_full_name}: {e}")
+        info = json.loads(data_type) if isinstance(data_type, str) else dict(data_type or {})
+    except ValueError:
+        return str(data_type)
+    name = str(info.get('type', '')).upper()
+    return _format_column_type(
+        _SHOW_COLUMNS_TYPE_NAMES.get(name, name), info.get('length'), info.get('precision'), info.get('scale'),
+        info.get('scale') if name.startswith('TIMESTAMP') or name == 'TIME' else None,
+    )
 
 
-def fetch_file_from_url(url):
-    try:
-        resp = requests.get(url)
-        resp.raise_for_status()
-        return resp.text
-    except Exception as e:
-        raise Exception(f"Error fetching file from presigned URL: {e}")
+class ColumnCatalog:
+    """Columns of many tables and views, held column-wise.
 
+    Each object owns a contiguous run of rows (``offsets``); schema names,
+    object types and data types are dictionary-encoded. ``data`` is plain
+    JSON so the catalog can live in a ``MetadataCache``, and object lookups
+    are a binary search over the sorted ``(schema, object)`` keys.
+    """
 
-def read_file_from_stage(conn, stage_full_name, file_name):
-    try:
-        url = get_presigned_url(conn, stage_full_name, file_name)
-        return fetch_file_from_url(url)
-    except Exception as e:
-        raise Exception(f"Error reading file {file_name} from stage {stage_full_name}: {e}")
+    # Same keys and formats as the SHOW COLUMNS path of ``get_table_or_view_columns``.
+    FIELDS = ('name', 'type', 'nullable', 'default', 'kind', 'comment')
+    _KEY_SEP = '\x1f'
 
+    def __init__(self, data):
+        self.data = data
 
-def split_sql_statements(sql_text):
-    return [stmt.strip() for stmt in sqlparse.split(sql_text) if stmt and stmt.strip()]
+    @classmethod
+    def from_columns(cls, columns):
+        """Build a catalog from a dict of equally long lists keyed by
+        ``table_schema``, ``table_name``, ``table_type``, ``column_name``,
+        ``data_type``, ``is_nullable``, ``column_default`` and ``comment``,
+        with each object's rows adjacent. Optional
+        ``character_maximum_length``, ``numeric_precision``,
+        ``numeric_scale`` and ``datetime_precision`` lists complete the type."""
+        schema_values, schema_ids = [], {}
+        type_values, type_ids = [], {}
+        objects, object_schemas, object_kinds, offsets = [], [], [], []
+        types = []
+        previous = None
+        schemas, tables, table_types = columns['table_schema'], columns['table_name'], columns['table_type']
+        none = itertools.repeat(None)
+        lengths = columns.get('character_maximum_length') or none
+        precisions = columns.get('numeric_precision') or none
+        scales = columns.get('numeric_scale') or none
+        datetime_precisions = columns.get('datetime_precision') or none
+        sizes = zip(lengths, precisions, scales, datetime_precisions)
+        for i, data_type in enumerate(columns['data_type']):
+            data_type = _format_column_type(data_type, *next(sizes))
+            key = (schemas[i], tables[i])
+            if key != previous:
+                previous = key
+                schema_id = schema_ids.get(key[0])
+                if schema_id is None:
+                    schema_id = schema_ids[key[0]] = len(schema_values)
+                    schema_values.append(key[0])
+                objects.append(key[1])
+                object_schemas.append(schema_id)
+                object_kinds.append('view' if 'VIEW' in (table_types[i] or '').upper() else 'table')
+                offsets.append(i)
+            type_id = type_ids.get(data_type)
+            if type_id is None:
+                type_id = type_ids[data_type] = len(type_values)
+                type_values.append(data_type)
+            types.append(type_id)
+        offsets.append(len(types))
+        # Sort by the exact string _object_index bisects with. The separator sorts
+        # below every identifier character, so '$' or '.' in a name cannot reorder keys.
+        keys = [schema_values[object_schemas[o]] + cls._KEY_SEP + objects[o] for o in range(len(objects))]
+        order = sorted(range(len(objects)), key=keys.__getitem__)
+        return cls({
+            'schemas': schema_values,
+            'objects': objects,
+            'object_schemas': object_schemas,
+            'object_kinds': object_kinds,
+            'offsets': offsets,
+            'sorted_keys': [keys[o] for o in order],
+            'sorted_objects': order,
+            'names': list(columns['column_name']),
+            'types': types,
+            'type_values': type_values,
+            'nullable': [value == 'YES' for value in columns['is_nullable']],
+            'defaults': list(columns['column_default']),
+            'comments': list(columns['comment']),
+        })
+
+    def __len__(self):
+        return len(self.data['names'])
+
+    def _object_index(self, schema, object_name):
+        keys = self.data['sorted_keys']
+        key = f'{schema}{self._KEY_SEP}{object_name}'
+        i = bisect.bisect_left(keys, key)
+        if i < len(keys) and keys[i] == key:
+            return self.data['sorted_objects'][i]
+        return None
 
+    def objects(self, schema=None):
+        """Yield ``(schema, object, kind)`` for every object, optionally of one schema."""
+        data = self.data
+        for o, name in enumerate(data['objects']):
+            schema_name = data['schemas'][data['object_schemas'][o]]
+            if schema is None or schema_name == schema:
+                yield schema_name, name, data['object_kinds'][o]
 
-def execute_sql_script(conn, sql_text):
-    results = []
-    statements = split_sql_statements(sql_text)
-    cur = conn.cursor()
-    for stmt in statements:
+    def object_type(self, schema, object_name):
+        o = self._object_index(schema, object_name)
+        return None if o is None else self.data['object_kinds'][o]
+
+    def lookup(self, schema, object_name):
+        """Return the columns of one object in ``get_table_or_view_columns``
+        form, or None when the object is not in the catalog."""
+        o = self._object_index(schema, object_name)
+        if o is None:
+            return None
+        data = self.data
+        return [
+            {
+                'name': data['names'][i],
+                'type': data['type_values'][data['types'][i]],
+                'nullable': data['nullable'][i],
+                'default': data['defaults'][i],
+                'kind': 'COLUMN',
+                'comment': data['comments'][i],
+            }
+            for i in range(data['offsets'][o], data['offsets'][o + 1])
+        ]
+
+    def name_types(self, schema, object_name):
+        """Return ``[(column, data_type)]`` for one object (empty when unknown)."""
+        o = self._object_index(schema, object_name)
+        if o is None:
+            return []
+        data = self.data
+        types, values = data['types'], data['type_values']
+        start, end = data['offsets'][o], data['offsets'][o + 1]
+        return [(name, values[types[start + j]]) for j, name in enumerate(data['names'][start:end])]
+
+
+_COLUMN_CATALOG_FIELDS = (
+    'table_schema', 'table_name', 'table_type', 'column_name', 'data_type', 'is_nullable', 'column_default', 'comment',
+    'character_maximum_length', 'numeric_precision', 'numeric_scale', 'datetime_precision',
+)
+
+
+def _fetch_columnar(cur, fields):
+    """Return ``{field: [values]}`` for the cursor's result, converting whole
+    Arrow batches at a time when pyarrow is available."""
+    columns = {field: [] for field in fields}
+    batches = None
+    if pyarrow is not None:
         try:
-            cur.execute(stmt)
-            try:
-                rows = cur.rowcount if cur.rowcount and cur.rowcount > 0 else 0
-            except Exception:
-                rows = 0
-            results.append({'statement': stmt[:2000], 'success': True, 'rows_affected': rows, 'error': ''})
-        except Exception as e:
-            results.append({'statement': stmt[:2000], 'success': False, 'rows_affected': 0, 'error': str(e)})
-    cur.close()
-    return results
+            batches = cur.fetch_arrow_batches()
+        except Exception:
+            # Results delivered as JSON (or an older connector) cannot be read as Arrow.
+            batches = None
+    if batches is not None:
+        for batch in batches:
+            names = [name.lower() for name in batch.column_names]
+            for field, column in zip(names, batch.columns):
+                if field in columns:
+                    columns[field].extend(column.to_pylist())
+        return columns
+    while True:
+        rows = cur.fetchmany(10000)
+        if not rows:
+            return columns
+        for field, values in zip(fields, zip(*rows)):
+            columns[field].extend(values)
 
 
-def execute_sql_file(conn, file_path):
+@traced()
+def harvest_columns(conn, database, schemas=None):
+    """Return a ``ColumnCatalog`` with the columns of every table and view in
+    ``database`` (or only in ``schemas``) from one ``INFORMATION_SCHEMA`` query."""
+    sql = (
+        "SELECT c.table_schema, c.table_name, t.table_type, c.column_name, c.data_type, "
+        "c.is_nullable, c.column_default, c.comment, "
+        "c.character_maximum_length, c.numeric_precision, c.numeric_scale, c.datetime_precision "
+        f"FROM {database}.INFORMATION_SCHEMA.COLUMNS c "
+        f"JOIN {database}.INFORMATION_SCHEMA.TABLES t "
+        "ON t.table_schema = c.table_schema AND t.table_name = c.table_name "
+        "WHERE c.table_schema <> 'INFORMATION_SCHEMA'"
+    )
+    params = None
+    if schemas:
+        sql += f" AND c.table_schema IN ({', '.join(['%s'] * len(schemas))})"
+        params = list(schemas)
+    sql += " ORDER BY c.table_schema, c.table_name, c.ordinal_position"
     try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            sql_text = f.read()
-        return execute_sql_script(conn, sql_text)
+        with _borrow(conn) as conn:
+            cur = conn.cursor()
+            try:
+                _execute(cur, sql, params)
+                return ColumnCatalog.from_columns(_fetch_columnar(cur, _COLUMN_CATALOG_FIELDS))
+            finally:
+                cur.close()
     except Exception as e:
-        raise Exception(f"Error executing SQL file {file_path}: {e}")
+        raise Exception(f"Error fetching columns for database {database}: {e}")
 
 
-def _get_client(openai_api_key: Optional[str]):
-    if not openai_api_key:
-        raise OpenAIClientNotConfigured("OpenAI API key is required")
-    if OpenAI is None:
-        raise OpenAIClientNotConfigured("openai package not installed")
-    return OpenAI(api_key=openai_api_key)
+@traced()
+def get_column_catalog(conn, database, schema=None, cache=None):
+    """Return the ``ColumnCatalog`` of one schema, or of the whole database
+    when ``schema`` is None, from ``cache`` when it holds a fresh copy."""
+    if cache is None:
+        return harvest_columns(conn, database, [schema] if schema else None)
+    data = cache.get_or_load(
+        conn, 'column_catalog', (database, schema or ''),
+        lambda: harvest_columns(conn, database, [schema] if schema else None).data,
+    )
+    return ColumnCatalog(data)
 
 
-def generate_business_glossary_from_yaml(openai_api_key: str, yaml_content: str) -> Dict[str, Any]:
-    client = _get_client(openai_api_key)
-    parsed = yaml.safe_load(yaml_content)
-    prompt = (
-        "You are a data governance expert. Given the following semantic YAML, produce a business glossary.\n"
-        "Requirements:\n"
-        "- Return JSON only (no prose).\n"
-        "- Include a per-column glossary with definitions and synonyms.\n"
-        "- JSON keys: columns (array of {table, column, definition, synonyms}), terms (optional array of {term, definition, related_columns, tables, dq_notes}).\n"
-        "- In columns.synonyms, include up to 5 concise, business-friendly synonyms; omit duplicates.\n\n"
-    )
-    messages = [
-        {"role": "system", "content": "You write precise, unambiguous business glossaries."},
-        {"role": "user", "content": prompt + yaml.dump(parsed, sort_keys=False)},
-    ]
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=messages,
-        temperature=0.2,
-    )
-    ai_text = response.choices[0].message.content or ""
-    try:
-        return json.loads(ai_text)
-    except Exception:
-        return {"text": ai_text}
+SEARCH_KINDS = ('database', 'schema', 'table', 'view', 'column')
+_SEARCH_TOKEN_RE = re.compile(r'[A-Z0-9]+')
+_SEARCH_TYPE_RE = re.compile(r'[A-Z_]+')
+# Match tiers, best first, with the score each contributes per query term.
+_SEARCH_TIERS = (('name', 4), ('token', 3), ('prefix', 2), ('substring', 1))
 
 
-def generate_lineage_dot(
-    openai_api_key: str,
-    lineage_rows: List[dict],
-    code_blobs: List[Dict[str, str]],
-    additional_instructions: str = "",
-    target: Optional[str] = None,
-    max_hops: int = 2,
-    theme: str = "vibrant",
-    detail_level: str = "high",
-    include_sql_snippets: bool = False,
-    snippet_max_chars: int = 180,
-    show_edge_labels: bool = True,
-    show_node_tooltips: bool = True,
-    include_ctes: bool = True,
-    include_column_lineage: bool = True,
-    include_file_and_stage_sources: bool = True,
-) -> str:
-    client = _get_client(openai_api_key)
-
-    csv_section = ""
-    if lineage_rows:
-        preview_rows = lineage_rows[:200]
-        csv_headers = list(preview_rows[0].keys()) if preview_rows else []
-        csv_lines = ",\n".join([str(r) for r in preview_rows])
-        csv_section = (
-            f"CSV headers: {csv_headers}\n"
-            f"Sample rows (up to 200):\n{csv_lines}\n"
-        )
+class SearchIndex:
+    """In-memory inverted index over database, schema, object and column names.
 
-    code_section = ""
-    if code_blobs:
-        parts = []
-        for b in code_blobs:
-            name = b.get("name", "unknown")
-            content = b.get("content", "")
-            lang = ""
-            lname = name.lower()
-            if lname.endswith(".sql"):
-                lang = "SQL"
-            elif lname.endswith(".py"):
-                lang = "Python"
-            elif lname.endswith(".java"):
-                lang = "Java"
-            elif lname.endswith(".scala"):
-                lang = "Scala"
-            header = f"FILE: {name} (language: {lang})\n"
-            parts.append(header + content)
-        code_section = "\n\n".join(parts)
-
-    theme = (theme or "vibrant").lower()
-    if theme == "monochrome":
-        palette = {
-            "graph_bg": "white",
-            "edge": "#555555",
-            "node_border": "#333333",
-            "source_fill": "#DDDDDD",
-            "transform_fill": "#BBBBBB",
-            "table_fill": "#EEEEEE",
-            "view_fill": "#CCCCCC",
-            "stage_fill": "#F5F5F5",
-            "target_border": "#111111",
-            "target_fill": "#FFFFFF",
-        }
-    elif theme == "muted":
-        palette = {
-            "graph_bg": "white",
-            "edge": "#8E8E8E",
-            "node_border": "#6D6D6D",
-            "source_fill": "#CFE8FF",
-            "transform_fill": "#FFE9C6",
-            "table_fill": "#E6F0FA",
-            "view_fill": "#E8DDF0",
-            "stage_fill": "#F2F4F7",
-            "target_border": "#C62828",
-            "target_fill": "#FFEBEE",
-        }
-    else:
-        palette = {
-            "graph_bg": "white",
-            "edge": "#7A7A7A",
-            "node_border": "#333333",
-            "source_fill": "#A7E3FF",
-            "transform_fill": "#FFD59E",
-            "table_fill": "#BBDEFB",
-            "view_fill": "#D1C4E9",
-            "stage_fill": "#ECEFF1",
-            "target_border": "#E53935",
-            "target_fill": "#FFCDD2",
-        }
+    Names are split into tokens at non-alphanumeric characters; a query term
+    matches a whole name, a token, a token prefix or (via trigrams over the
+    vocabulary) a substring of a token, scored in that order. Documents are
+    added and replaced per ``(database, schema)`` scope, and each scope is
+    mirrored to a SQLite file so the index loads without touching Snowflake.
+    """
 
-    focus_clause = (
-        f"Focus on the target node named '{target}'. Include only nodes within {max_hops} hops "
-        f"upstream and {max_hops} hops downstream of the target. Highlight the target with penwidth=3, "
-        f"color=\"{palette['target_border']}\", fillcolor=\"{palette['target_fill']}\".\n"
-        if target else ""
-    )
+    def __init__(self, path=None, scope=('', '')):
+        self._lock = threading.RLock()
+        self._scope = tuple(scope)
+        self._store = PersistentCache(path, namespace='search', max_entries=64, max_disk_entries=1000000) if path else None
+        self._reset()
+        if self._store is not None:
+            self._load()
 
-    style_parts = [
-        "Style requirements (mandatory):",
-        f"- graph [bgcolor=\"{palette['graph_bg']}\", rankdir=LR]; edge [color=\"{palette['edge']}\", arrowsize=0.7, penwidth=1];",
-        f"- node [style=filled, color=\"{palette['node_border']}\", fontname=\"Helvetica\", fontsize=10];",
-        f"- sources/external nodes: shape=cylinder, fillcolor=\"{palette['source_fill']}\";",
-        f"- transformation nodes (SQL/Python jobs): shape=box3d, fillcolor=\"{palette['transform_fill']}\";",
-        f"- tables: shape=box, fillcolor=\"{palette['table_fill']}\"; views: shape=component, fillcolor=\"{palette['view_fill']}\";",
-        f"- staging/temp artifacts: shape=folder, fillcolor=\"{palette['stage_fill']}\";",
-        "- cluster by system/schema using subgraph cluster_* with readable labels;",
-    ]
-    if show_edge_labels:
-        style_parts.append("- include edge labels describing operation (e.g., JOIN on id, GROUP BY, FILTER).")
-    if show_node_tooltips:
-        style_parts.append("- include node tooltips summarizing key transformations/aggregations.")
-    style_parts.append("- keep result under 200 nodes; prune minor nodes if needed.\n")
-    style_clause = "\n".join(style_parts) + "\n"
-
-    detail_parts = [
-        "Details to extract from code and CSV (prioritize accuracy):",
-        "- Joins: type (INNER/LEFT/RIGHT/FULL), keys/conditions.",
-        "- Aggregations: functions (SUM, COUNT, AVG, MIN, MAX), group-by columns.",
-        "- Projections/renames: key selected columns and aliases.",
-        "- Filters: WHERE predicates.",
-        "- Windows: partition/order and functions.",
-        "- Materializations: table/view names; note temp/stage objects.",
-    ]
-    if include_ctes:
-        detail_parts.append("- Common Table Expressions (CTEs): treat named CTEs as transformation nodes; show edges from their inputs.")
-    if include_file_and_stage_sources:
-        detail_parts.append("- External sources: S3/GCS/Azure stages and COPY INTO; add source nodes for stages and files if referenced.")
-    if include_column_lineage:
-        detail_parts.append("- Column-level lineage: when clear, add edge labels like colA->colB for key columns.")
-    if include_sql_snippets:
-        detail_parts.append("- Include concise SQL snippet excerpts per transformation (truncated).")
-        detail_parts.append(f"- Truncate any SQL snippet to <= {snippet_max_chars} chars.")
-    if show_edge_labels:
-        detail_parts.append("- Prefer edge labels for operation types; keep them short.")
-    if show_node_tooltips:
-        detail_parts.append("- Use node 'tooltip' to hold multi-line summaries; keep UI-friendly.")
-    detail_parts.append(f"- Level of detail: {detail_level}.")
-    detail_clause = "\n".join(detail_parts) + "\n"
-
-    system_msg = {
-        "role": "system",
-        "content": (
-            "You are an expert data engineer. Given lineage CSV and pipeline code, "
-            "produce a styled Graphviz DOT diagram describing end-to-end lineage. Use rankdir=LR, "
-            "distinct nodes for sources, transformations, tables, views; edges show data flow. "
-            "Output ONLY valid DOT text (no markdown fences, no commentary)."
-        ),
-    }
-    user_msg = {
-        "role": "user",
-        "content": (
-            "Create a lineage diagram in Graphviz DOT format.\n\n"
-            + focus_clause
-            + style_clause
-            + detail_clause
-            + ("LINEAGE CSV:\n" + csv_section + "\n\n" if csv_section else "")
-            + ("PIPELINE CODE SNIPPETS:\n" + code_section + "\n\n" if code_section else "")
-            + ("ADDITIONAL INSTRUCTIONS:\n" + additional_instructions + "\n" if additional_instructions else "")
-            + (
-                "Constraints:\n"
-                "- Return ONLY raw DOT starting with 'digraph' and ending with '}'.\n"
-                "- Use rankdir=LR; cluster by system or schema if clear.\n"
-                "- Use readable labels; keep graph under 200 nodes if necessary.\n"
-            )
-        ),
-    }
+    def _reset(self):
+        self.paths = []
+        self.kinds = array('b')
+        self.types = array('i')
+        self.type_names = []
+        self.stamps = {}
+        self._type_ids = {}
+        self._names = {}
+        self._postings = {}
+        self._type_postings = {}
+        self._trigrams = {}
+        self._vocab = None
+        self._scopes = {}
+        self._databases = {}
+        self._non_columns = set()
+        self._deleted = set()
 
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[system_msg, user_msg],
-        temperature=0.1,
-    )
-    dot_text = response.choices[0].message.content or ""
-    dot_text = re.sub(r"^```[a-zA-Z]*\n|\n```$", "", dot_text.strip())
-    return dot_text
+    def __len__(self):
+        return len(self.paths) - len(self._deleted)
+
+    def _add_doc(self, path, kind, data_type=None):
+        doc = len(self.paths)
+        self.paths.append(path)
+        self.kinds.append(SEARCH_KINDS.index(kind))
+        if kind != 'column':
+            self._non_columns.add(doc)
+        type_id = -1
+        if data_type:
+            type_id = self._type_ids.get(data_type)
+            if type_id is None:
+                type_id = self._type_ids[data_type] = len(self.type_names)
+                self.type_names.append(data_type)
+            base = _SEARCH_TYPE_RE.match(data_type.upper())
+            if base:
+                self._type_postings.setdefault(base.group(), array('i')).append(doc)
+        self.types.append(type_id)
+        name = path[-1].upper()
+        self._names.setdefault(name, array('i')).append(doc)
+        for token in set(_SEARCH_TOKEN_RE.findall(name)):
+            postings = self._postings.get(token)
+            if postings is None:
+                postings = self._postings[token] = array('i')
+                self._vocab = None
+                for i in range(len(token) - 2):
+                    self._trigrams.setdefault(token[i:i + 3], set()).add(token)
+            postings.append(doc)
+        return doc
 
+    def replace_scope(self, database, schema, objects, columns=None, stamp=None, persist=True):
+        """Replace everything indexed under ``database.schema``.
 
+        ``objects`` maps object names to ``'table'`` or ``'view'`` and
+        ``columns`` maps object names to ``(column, data_type)`` pairs.
+        """
+        columns = columns or {}
+        with self._lock:
+            self._drop_scope(database, schema)
+            if database not in self._databases:
+                self._databases[database] = self._add_doc((database,), 'database')
+            docs = [self._add_doc((database, schema), 'schema')]
+            for name in sorted(set(objects) | set(columns)):
+                docs.append(self._add_doc((database, schema, name), objects.get(name, 'table')))
+                for column, data_type in columns.get(name, ()):
+                    docs.append(self._add_doc((database, schema, name, column), 'column', data_type))
+            self._scopes[(database, schema)] = docs
+            self.stamps[(database, schema)] = stamp
+            if persist and self._store is not None:
+                self._store.set(self._scope + ('scope', database, schema), {
+                    'stamp': stamp,
+                    'objects': objects,
+                    'columns': {name: [list(c) for c in cols] for name, cols in columns.items()},
+                })
+                self._save_manifest()
+            self._maybe_compact()
+
+    def remove_scope(self, database, schema=None):
+        """Drop one schema, or a whole database when ``schema`` is None."""
+        with self._lock:
+            schemas = [schema] if schema is not None else [s for d, s in self._scopes if d == database]
+            for name in schemas:
+                self._drop_scope(database, name)
+                if self._store is not None:
+                    self._store.invalidate(self._scope + ('scope', database, name))
+            if schema is None and database in self._databases:
+                self._deleted.add(self._databases.pop(database))
+            if self._store is not None:
+                self._save_manifest()
+            self._maybe_compact()
+
+    def _drop_scope(self, database, schema):
+        self._deleted.update(self._scopes.pop((database, schema), ()))
+        self.stamps.pop((database, schema), None)
+
+    def _save_manifest(self):
+        self._store.set(self._scope + ('manifest',), [[d, s, self.stamps.get((d, s))] for d, s in self._scopes])
+
+    def _load(self):
+        for database, schema, _ in self._store.get(self._scope + ('manifest',)) or []:
+            entry = self._store.get(self._scope + ('scope', database, schema))
+            if entry is not None:
+                columns = {name: [tuple(c) for c in cols] for name, cols in entry['columns'].items()}
+                self.replace_scope(database, schema, entry['objects'], columns, entry['stamp'], persist=False)
+
+    def _maybe_compact(self):
+        # Replaced scopes leave tombstones; rebuild once they outnumber live documents.
+        if len(self._deleted) <= max(1000, len(self.paths) // 2):
+            return
+        docs = [
+            (self.paths[d], SEARCH_KINDS[self.kinds[d]], self.type_names[self.types[d]] if self.types[d] >= 0 else None)
+            for d in range(len(self.paths)) if d not in self._deleted
+        ]
+        scopes = {key: [self.paths[d] for d in ids] for key, ids in self._scopes.items()}
+        stamps = self.stamps
+        self._reset()
+        ids = {}
+        for path, kind, data_type in docs:
+            ids[path] = self._add_doc(path, kind, data_type)
+            if kind == 'database':
+                self._databases[path[0]] = ids[path]
+        self._scopes = {key: [ids[p] for p in paths] for key, paths in scopes.items()}
+        self.stamps = stamps
+
+    def _token_docs(self, token):
+        """Return the documents with ``token`` itself, with a longer token it
+        prefixes and with a token containing it, as three disjoint sets."""
+        if self._vocab is None:
+            self._vocab = sorted(self._postings)
+        prefixed = []
+        for i in range(bisect.bisect_left(self._vocab, token), len(self._vocab)):
+            if not self._vocab[i].startswith(token):
+                break
+            if self._vocab[i] != token:
+                prefixed.append(self._vocab[i])
+        containing = []
+        if len(token) >= 3:
+            candidates = None
+            for i in range(len(token) - 2):
+                found = self._trigrams.get(token[i:i + 3], set())
+                candidates = found if candidates is None else candidates & found
+                if not candidates:
+                    break
+            containing = [t for t in candidates or () if token in t and not t.startswith(token)]
+        exact = set(self._postings.get(token, ()))
+        prefix = set().union(*(self._postings[t] for t in prefixed)) - exact
+        substring = set().union(*(self._postings[t] for t in containing)) - exact - prefix
+        return exact, prefix, substring
+
+    def _term_tiers(self, term):
+        """Return ``{tier: docs}`` for one query term; each document is only in its best tier.
+
+        A term with several tokens (``order_id``) needs every token to match
+        and is ranked by its weakest token.
+        """
+        tiers = {'name': set(self._names.get(term, ()))}
+        token_sets = [self._token_docs(token) for token in _SEARCH_TOKEN_RE.findall(term)]
+        if not token_sets:
+            tiers.update(token=set(), prefix=set(), substring=set())
+            return tiers
+        seen = set(tiers['name'])
+        for depth, tier in enumerate(('token', 'prefix', 'substring')):
+            docs = None
+            for sets in token_sets:
+                found = set().union(*sets[:depth + 1])
+                docs = found if docs is None else docs & found
+            docs -= seen
+            seen |= docs
+            tiers[tier] = docs
+        return tiers
+
+    def _kind_filter(self, candidates, kinds):
+        codes = {SEARCH_KINDS.index(k) for k in kinds if k in SEARCH_KINDS}
+        allowed = {d for d in self._non_columns if self.kinds[d] in codes}
+        if SEARCH_KINDS.index('column') in codes:
+            return candidates - (self._non_columns - allowed)
+        return candidates & allowed
+
+    def search(self, query, limit=50, kinds=None):
+        """Return ``(total, results)`` for ``query``.
+
+        Space-separated terms must all match. ``kind:table`` and
+        ``type:varchar`` restrict the kind and column data type, and a dotted
+        term such as ``orders.cust`` also requires the parent names to start
+        with the leading parts. Results are dicts with ``path``, ``kind``,
+        ``data_type`` and ``score``, best first.
+        """
+        kinds = set(kinds or ())
+        type_filter = None
+        terms = []
+        for raw in (query or '').upper().split():
+            if raw.startswith('KIND:'):
+                kinds.add(raw[5:].lower())
+            elif raw.startswith('TYPE:'):
+                type_filter = raw[5:]
+            elif raw.strip('.'):
+                terms.append([p for p in raw.split('.') if p])
+        if not terms and type_filter is None and not kinds:
+            return 0, []
+        with self._lock:
+            term_tiers = [self._term_tiers(parts[-1]) for parts in terms]
+            candidates = None
+            for tiers in sorted(term_tiers, key=lambda t: sum(len(d) for d in t.values())):
+                union = set().union(*tiers.values())
+                candidates = union if candidates is None else candidates & union
+            if type_filter is not None:
+                typed = set()
+                for base, docs in self._type_postings.items():
+                    if base.startswith(type_filter):
+                        typed.update(docs)
+                candidates = typed if candidates is None else candidates & typed
+            if candidates is None:
+                candidates = set(self._non_columns) if 'column' not in kinds else set(range(len(self.paths)))
+            candidates -= self._deleted
+            if kinds:
+                candidates = self._kind_filter(candidates, kinds)
+            for parts in terms:
+                if len(parts) > 1:
+                    parents = {}
+                    for d in list(candidates):
+                        parent = self.paths[d][:-1]
+                        keep = parents.get(parent)
+                        if keep is None:
+                            keep = parents[parent] = self._parents_match(parent, parts[:-1])
+                        if not keep:
+                            candidates.discard(d)
+
+            # Each candidate is in exactly one tier per term: sum the tier
+            # scores and keep the best ``limit``, objects before columns.
+            scores = dict.fromkeys(candidates, 0)
+            for tiers in term_tiers:
+                for tier, points in _SEARCH_TIERS:
+                    docs = tiers[tier]
+                    for d in docs & candidates:
+                        scores[d] += points
+            non_columns, doc_kinds = self._non_columns, self.kinds
+            best = heapq.nsmallest(
+                limit, scores,
+                key=lambda d: (-scores[d], 0, doc_kinds[d], d) if d in non_columns else (-scores[d], 1, 0, d),
+            )
+            results = [(d, scores[d]) for d in best]
+            return len(candidates), [
+                {
+                    'path': '.'.join(self.paths[d]),
+                    'kind': SEARCH_KINDS[self.kinds[d]],
+                    'data_type': self.type_names[self.types[d]] if self.types[d] >= 0 else None,
+                    'score': score,
+                }
+                for d, score in results
+            ]
+
+    @staticmethod
+    def _parents_match(path, parents):
+        names = [p.upper() for p in path]
+        if len(parents) > len(names):
+            return False
+        return all(name.startswith(part) for name, part in zip(names[-len(parents):], parents))
+
+    def stats(self):
+        with self._lock:
+            columns = len(self.paths) - len(self._non_columns) - len(self._deleted - self._non_columns)
+            return {
+                'documents': len(self),
+                'columns': columns,
+                'schemas': len(self._scopes),
+                'tokens': len(self._postings),
+            }
+
+
+@traced()
+def refresh_search_index(conn, index, cache=None, databases=None, force=False, max_workers=8):
+    """Bring ``index`` up to date with the account catalog.
+
+    Schemas whose ``LAST_ALTERED`` is newer than the stamp they were indexed
+    with are re-harvested with one column query per database; unchanged
+    schemas are kept and dropped schemas are removed. Returns refresh stats.
+    """
+    started = time.perf_counter()
+    try:
+        catalog = list_data_objects(conn, cache=cache)
+        names = [db for db in catalog if databases is None or db in databases]
+
+        def refresh_database(database):
+            try:
+                stamps = _schema_last_altered(conn, database)
+            except Exception:
+                stamps, force_database = {}, True
+            else:
+                force_database = force
+            # Schemas without tables have no LAST_ALTERED and only need indexing once.
+            stale = [
+                schema for schema in catalog[database]
+                if force_database or (database, schema) not in index.stamps
+                or (index.stamps[(database, schema)] or 0) < stamps.get(schema, 0)
+            ]
+            return database, stamps, stale, harvest_columns(conn, database, stale) if stale else None
+
+        refreshed = 0
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(names) or 1))) as pool:
+            for database, stamps, stale, columns in pool.map(_propagate(refresh_database), names):
+                by_schema = {}
+                for schema, name, _ in columns.objects() if columns is not None else ():
+                    by_schema.setdefault(schema, {})[name] = columns.name_types(schema, name)
+                for schema in stale:
+                    objects = {name: 'table' for name in catalog[database][schema].get('tables', [])}
+                    objects.update({name: 'view' for name in catalog[database][schema].get('views', [])})
+                    index.replace_scope(database, schema, objects, by_schema.get(schema, {}), stamps.get(schema))
+                    refreshed += 1
+                for db, schema in list(index.stamps):
+                    if db == database and schema not in catalog[database]:
+                        index.remove_scope(database, schema)
+        if databases is None:
+            for db in {d for d, _ in index.stamps} - set(catalog):
+                index.remove_scope(db)
+    except Exception as e:
+        raise Exception(f"Error refreshing search index: {e}")
+    return {
+        'databases': len(names),
+        'schemas_refreshed': refreshed,
+        'documents': len(index),
+        'wall_time_s': round(time.perf_counter() - started, 3),
+    }
+
+
+_search_indexes = {}
+_search_index_lock = threading.Lock()
+
+
+def get_search_index(conn, path=None):
+    """Return the persisted search index for the connection's account and role."""
+    scope = (getattr(conn, 'account', None) or '', getattr(conn, 'role', None) or '')
+    with _search_index_lock:
+        if scope not in _search_indexes:
+            _search_indexes[scope] = SearchIndex(path or os.path.join(_DEFAULT_CACHE_DIR, 'search.sqlite'), scope)
+        return _search_indexes[scope]
+
+
+@traced()
+def list_stages(conn, database):
+    try:
+        with _borrow(conn) as conn:
+            cur = conn.cursor()
+            _execute(cur, f"SHOW STAGES IN DATABASE {database}")
+            stages = [(row[3], row[1]) for row in cur.fetchall()]  # (schema_name, stage_name)
+            cur.close()
+        return stages
+    except Exception as e:
+        raise Exception(f"Error fetching stages: {e}")
+
+
+StageFile = namedtuple('StageFile', ['name', 'size', 'md5', 'last_modified'])
+
+
+def _qualify_stage_name(stage_full_name, database=None):
+    stage_full_name = stage_full_name.lstrip('@')
+    if not database or stage_full_name.startswith('~'):
+        return stage_full_name
+    parts = len(re.findall(r'"[^"]*"|[^.]+', stage_full_name.split('/', 1)[0]))
+    if parts == 2:
+        return f"{database}.{stage_full_name}"
+    if parts == 1:
+        return f"{database}.PUBLIC.{stage_full_name}"
+    return stage_full_name
+
+
+@traced()
+def iter_stage_files(conn, stage_full_name, database=None, pattern=None, batch_size=10000):
+    """Yield ``StageFile`` records from ``LIST`` without buffering the listing.
+
+    ``pattern`` is pushed down as ``LIST ... PATTERN``. With ``database``,
+    a ``schema.stage`` name is qualified with it and a bare ``stage`` name
+    resolves to ``database.PUBLIC.stage``, instead of switching the session
+    database.
+    """
+    stage = _qualify_stage_name(stage_full_name, database)
+    try:
+        with _borrow(conn) as conn:
+            cur = conn.cursor()
+            try:
+                if pattern:
+                    _execute(cur, f"LIST @{stage} PATTERN = %s", (pattern,))
+                else:
+                    _execute(cur, f"LIST @{stage}")
+                while True:
+                    rows = cur.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    for row in rows:
+                        yield StageFile(row[0], row[1], row[2], row[3])
+            finally:
+                cur.close()
+    except Exception as e:
+        raise Exception(f"Error listing files in stage {stage_full_name}: {e}")
+
+
+@traced()
+def list_files_in_stage(conn, stage_full_name, database=None, pattern=None):
+    return [f.name for f in iter_stage_files(conn, stage_full_name, database=database, pattern=pattern)]
+
+
+def iter_changed_stage_files(conn, stage_full_name, cache, database=None, pattern=None):
+    """Yield only files added or changed (by size or md5) since the snapshot
+    stored in ``cache``; the snapshot is replaced once the listing has been
+    fully consumed."""
+    stage = _qualify_stage_name(stage_full_name, database)
+    path = (stage, pattern or '')
+    previous = cache.get(conn, 'stage_listing', path) or {}
+    current = {}
+    for f in iter_stage_files(conn, stage, pattern=pattern):
+        fingerprint = f"{f.size}:{f.md5}"
+        current[f.name] = fingerprint
+        if previous.get(f.name) != fingerprint:
+            yield f
+    cache.set(conn, 'stage_listing', path, current)
+
+
+@traced()
+def get_presigned_url(conn, stage_full_name, file_name):
+    try:
+        with _borrow(conn) as conn:
+            cur = conn.cursor()
+            _execute(cur, "SELECT GET_PRESIGNED_URL(%s, %s)", (f"@{stage_full_name}", file_name))
+            url = cur.fetchone()[0]
+            cur.close()
+        return url
+    except Exception as e:
+        raise Exception(f"Error generating presigned URL for {file_name} in stage {stage_full_name}: {e}")
+
+
+@traced()
+def get_presigned_urls(conn, stage_full_name, file_names, expiration_seconds=3600, batch_size=500):
+    urls = {}
+    file_names = list(dict.fromkeys(file_names))
+    try:
+        with _borrow(conn) as conn:
+            cur = conn.cursor()
+            for start in range(0, len(file_names), batch_size):
+                batch = file_names[start:start + batch_size]
+                values = ", ".join(["(%s)"] * len(batch))
+                _execute(
+                    cur,
+                    f"SELECT column1, GET_PRESIGNED_URL(%s, column1, %s) FROM VALUES {values}",
+                    (f"@{stage_full_name}", expiration_seconds, *batch),
+                )
+                urls.update((row[0], row[1]) for row in cur.fetchall())
+            cur.close()
+        return urls
+    except Exception as e:
+        raise Exception(f"Error generating presigned URLs in stage {stage_full_name}: {e}")
+
+
+_http_session = None
+_http_session_lock = threading.Lock()
+
+
+def get_http_session(pool_maxsize=32, retries=3):
+    """Return the process-wide ``requests.Session`` used for presigned URLs.
+
+    The session keeps up to ``pool_maxsize`` keep-alive connections per host
+    and retries idempotent requests on connection errors and 5xx responses.
+    """
+    global _http_session
+    with _http_session_lock:
+        if _http_session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=pool_maxsize,
+                pool_maxsize=pool_maxsize,
+                max_retries=Retry(total=retries, backoff_factor=0.3, status_forcelist=(500, 502, 503, 504)),
+            )
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _http_session = session
+        return _http_session
+
+
+def iter_url_chunks(url, chunk_size=1 << 20, byte_range=None, session=None, timeout=60):
+    """Yield the body of ``url`` in chunks of at most ``chunk_size`` bytes.
+
+    ``byte_range`` is an inclusive ``(start, end)`` pair (``end`` may be
+    ``None``); servers that ignore the ``Range`` header are handled by
+    skipping and truncating the streamed body locally.
+    """
+    session = session or get_http_session()
+    headers = {}
+    if byte_range is not None:
+        start, end = byte_range
+        headers['Range'] = f"bytes={start}-{'' if end is None else end}"
+    # The span is not made current: the caller runs between the chunks.
+    with get_tracer().span('http.get', current=False, url=url.split('?', 1)[0]) as span, \
+            session.get(url, headers=headers, stream=True, timeout=timeout) as resp:
+        resp.raise_for_status()
+        skip, remaining = 0, None
+        if byte_range is not None and resp.status_code != 206:
+            skip = byte_range[0]
+            remaining = None if byte_range[1] is None else byte_range[1] - byte_range[0] + 1
+        for chunk in resp.iter_content(chunk_size=chunk_size):
+            if skip:
+                if len(chunk) <= skip:
+                    skip -= len(chunk)
+                    continue
+                chunk, skip = chunk[skip:], 0
+            if remaining is not None:
+                chunk = chunk[:remaining]
+                remaining -= len(chunk)
+            if chunk:
+                if span:
+                    span['bytes'] = span.get('bytes', 0) + len(chunk)
+                yield chunk
+            if remaining == 0:
+                break
+
+
+@traced()
+def fetch_file_from_url(url, session=None, max_bytes=None, encoding='utf-8'):
+    try:
+        decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+        byte_range = (0, max_bytes - 1) if max_bytes else None
+        parts = [decoder.decode(chunk) for chunk in iter_url_chunks(url, byte_range=byte_range, session=session)]
+        parts.append(decoder.decode(b'', final=True))
+        return ''.join(parts)
+    except Exception as e:
+        raise Exception(f"Error fetching file from presigned URL: {e}")
+
+
+@traced()
+def read_file_from_stage(conn, stage_full_name, file_name, session=None, max_bytes=None):
+    try:
+        url = get_presigned_url(conn, stage_full_name, file_name)
+        return fetch_file_from_url(url, session=session, max_bytes=max_bytes)
+    except Exception as e:
+        raise Exception(f"Error reading file {file_name} from stage {stage_full_name}: {e}")
+
+
+def stream_file_from_stage(conn, stage_full_name, file_name, chunk_size=1 << 20, byte_range=None, session=None):
+    url = get_presigned_url(conn, stage_full_name, file_name)
+    return iter_url_chunks(url, chunk_size=chunk_size, byte_range=byte_range, session=session)
+
+
+@traced()
+def read_files_from_stage(conn, stage_full_name, file_names, max_workers=8, session=None, max_bytes=None):
+    """Read many staged files as text: one batched presigned-URL query, then
+    up to ``max_workers`` concurrent downloads over a pooled HTTP session."""
+    try:
+        urls = get_presigned_urls(conn, stage_full_name, file_names)
+        session = session or get_http_session()
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(urls) or 1))) as pool:
+            futures = {
+                name: pool.submit(_propagate(fetch_file_from_url), url, session, max_bytes)
+                for name, url in urls.items()
+            }
+            return {name: future.result() for name, future in futures.items()}
+    except Exception as e:
+        raise Exception(f"Error reading files from stage {stage_full_name}: {e}")
+
+
+@traced()
+def download_files_from_stage(conn, stage_full_name, file_names, dest_dir, max_workers=8, chunk_size=1 << 20, session=None):
+    """Stream staged files to ``dest_dir`` concurrently; returns ``{file_name: local_path}``."""
+    def download(name, url):
+        path = os.path.join(dest_dir, *[p for p in name.split('/') if p not in ('', '.', '..')])
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            for chunk in iter_url_chunks(url, chunk_size=chunk_size, session=session):
+                f.write(chunk)
+        return path
+
+    try:
+        urls = get_presigned_urls(conn, stage_full_name, file_names)
+        session = session or get_http_session()
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(urls) or 1))) as pool:
+            futures = {name: pool.submit(_propagate(download), name, url) for name, url in urls.items()}
+            return {name: future.result() for name, future in futures.items()}
+    except Exception as e:
+        raise Exception(f"Error downloading files from stage {stage_full_name}: {e}")
+
+
+# Strings, $$ bodies and comments carry no statement content or object references.
+_SQL_NOISE_RE = re.compile(r"'(?:[^'\\]|\\.)*'|\$\$.*?\$\$|--[^\n]*|//[^\n]*|/\*.*?\*/", re.S)
+_SQL_SPLIT_TOKEN_RE = re.compile(r"--|//|/\*|'|\"|\$\$|;")
+_SQL_SPLIT_STRING_END_RE = re.compile(r"(?:[^'\\]|\\.)*'", re.S)
+_SQL_SPLIT_CLOSERS = {'--': '\n', '//': '\n', '/*': '*/', '"': '"', '$$': '$$'}
+
+
+def _read_sql_chunks(source, chunk_size):
+    if isinstance(source, str):
+        yield source
+        return
+    while True:
+        chunk = source.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+
+def iter_sql_statements(source, chunk_size=1 << 16):
+    """Lazily split SQL text or a text file object into statements.
+
+    Semicolons inside strings, quoted identifiers, ``--``/``//``/``/* */``
+    comments and ``$$``-quoted bodies do not end a statement. Statements
+    keep their leading comments and trailing semicolon, like
+    ``sqlparse.split``; comment-only fragments are dropped.
+    """
+    chunks = _read_sql_chunks(source, chunk_size)
+    buf = ''
+    start = pos = 0
+    eof = False
+    while True:
+        match = _SQL_SPLIT_TOKEN_RE.search(buf, pos)
+        end = None
+        if match is not None:
+            token = match.group()
+            if token == ';':
+                end = match.end()
+                statement = buf[start:end].strip()
+                if _SQL_NOISE_RE.sub('', statement).strip(' \t\r\n;'):
+                    yield statement
+                start = pos = end
+                continue
+            if token == "'":
+                closed = _SQL_SPLIT_STRING_END_RE.match(buf, match.end())
+                end = closed.end() if closed else None
+            else:
+                closer = _SQL_SPLIT_CLOSERS[token]
+                found = buf.find(closer, match.end())
+                end = found + len(closer) if found >= 0 else None
+            if end is not None:
+                pos = end
+                continue
+            if eof:
+                break
+        elif eof:
+            break
+        # Need more input: drop consumed text and rescan from the last
+        # unfinished token (or the last unmatched position).
+        resume = match.start() if match is not None else max(pos, len(buf) - 1)
+        buf, resume = buf[start:], resume - start
+        start = 0
+        chunk = next(chunks, None)
+        if chunk is None:
+            eof = True
+        else:
+            buf += chunk
+        pos = resume
+    statement = buf[start:].strip()
+    if _SQL_NOISE_RE.sub('', statement).strip(' \t\r\n;'):
+        yield statement
+
+
+def split_sql_statements(sql_text):
+    return list(iter_sql_statements(sql_text))
+
+
+_SQL_IDENT = r'(?:"[^"]+"|[A-Za-z_][\w$]*)'
+_SQL_NAME = rf'{_SQL_IDENT}(?:\s*\.\s*{_SQL_IDENT}){{0,2}}'
+_SQL_NAME_RE = re.compile(_SQL_NAME)
+_SQL_OBJECT_TYPE = (
+    r'(?:DATABASE\s+ROLE|DATABASE|SCHEMA|TABLE|VIEW|FUNCTION|PROCEDURE|STAGE|FILE\s+FORMAT|SEQUENCE|TASK|'
+    r'STREAM|PIPE|WAREHOUSE|ROLE|USER|(?:MASKING|ROW\s+ACCESS|AGGREGATION|PROJECTION)\s+POLICY|TAG|ALERT|'
+    r'(?:STORAGE|API|NOTIFICATION|SECURITY|EXTERNAL\s+ACCESS)\s+INTEGRATION|NETWORK\s+RULE|SECRET|'
+    r'CORTEX\s+SEARCH\s+SERVICE|SEMANTIC\s+VIEW|NOTEBOOK|STREAMLIT)'
+)
+_SQL_WRITE_RES = [
+    re.compile(
+        r'^CREATE\s+(?:OR\s+REPLACE\s+)?(?:(?:LOCAL|GLOBAL|TEMP|TEMPORARY|VOLATILE|TRANSIENT|SECURE|RECURSIVE|'
+        r'EXTERNAL|DYNAMIC|MATERIALIZED|HYBRID|ICEBERG|EVENT)\s+)*(' + _SQL_OBJECT_TYPE + r')\s+'
+        r'(?:IF\s+NOT\s+EXISTS\s+)?(' + _SQL_NAME + ')', re.I),
+    re.compile(r'^(?:ALTER|DROP|UNDROP)\s+(?:(?:EXTERNAL|DYNAMIC|MATERIALIZED)\s+)?(' + _SQL_OBJECT_TYPE + r')\s+'
+               r'(?:IF\s+EXISTS\s+)?(' + _SQL_NAME + ')', re.I),
+    re.compile(r'^COMMENT\s+(?:IF\s+EXISTS\s+)?ON\s+(' + _SQL_OBJECT_TYPE + r'|COLUMN)\s+(' + _SQL_NAME + ')', re.I),
+    re.compile(r'^(?:INSERT\s+(?:OVERWRITE\s+)?(?:ALL\s+|FIRST\s+)?INTO|COPY\s+INTO|MERGE\s+INTO|UPDATE|DELETE\s+FROM|'
+               r'TRUNCATE\s+(?:TABLE\s+)?(?:IF\s+EXISTS\s+)?)()\s*@?(' + _SQL_NAME + ')', re.I),
+    re.compile(r'^(?:GRANT|REVOKE)\s+OWNERSHIP\s+ON\s+(' + _SQL_OBJECT_TYPE + r')\s+(' + _SQL_NAME + ')', re.I),
+]
+_SQL_READ_ONLY_RE = re.compile(r'^(?:SELECT|WITH|SHOW|DESCRIBE|DESC|LIST|LS)\b', re.I)
+_SQL_GRANT_RE = re.compile(r'^(?:GRANT|REVOKE)\b', re.I)
+_SQL_GRANT_ALL_IN_RE = re.compile(r'\bON\s+ALL\b', re.I)
+_SQL_USE_RE = re.compile(r'^USE\s+(?:(DATABASE|SCHEMA)\s+)?(' + _SQL_NAME + ')', re.I)
+
+
+def _normalize_sql_name(name):
+    parts = []
+    for part in re.findall(r'"[^"]+"|[^.\s]+', name):
+        parts.append(part[1:-1] if part.startswith('"') else part.upper())
+    return tuple(parts)
+
+
+def _qualify_sql_name(parts, object_type, database, schema):
+    object_type = ' '.join(object_type.upper().split())
+    if object_type in ('DATABASE', 'WAREHOUSE', 'ROLE', 'USER') or object_type.endswith('INTEGRATION'):
+        return parts
+    if object_type in ('SCHEMA', 'DATABASE ROLE'):
+        return parts if len(parts) >= 2 else (database or '?',) + parts
+    if len(parts) == 1:
+        return (database or '?', schema or '?') + parts
+    if len(parts) == 2:
+        return (database or '?',) + parts
+    return parts
+
+
+def plan_sql_statements(statements):
+    """Return one node per statement with the names it writes and reads and
+    the indexes of the earlier statements it must wait for.
+
+    Session-context statements (USE, ALTER SESSION, SET, transactions,
+    CREATE WAREHOUSE), CALLs, schema/database DDL, ``GRANT ... ON ALL`` and anything
+    unrecognised act as barriers: they wait for every earlier statement and
+    every later one waits for them. Other grants run in parallel with each
+    other but are ordered before later writes to the granted object or its
+    children, so future grants apply.
+    """
+    nodes = []
+    known = set()
+    last_writer = {}
+    readers = {}
+    grants = {}
+    by_suffix = {}
+    last_barrier = None
+    since_barrier = []
+    database = schema = None
+    for index, statement in enumerate(statements):
+        text = _SQL_NOISE_RE.sub(' ', statement).strip().rstrip(';').strip()
+        writes = set()
+        barrier = False
+        grant = False
+        use = _SQL_USE_RE.match(text)
+        if use:
+            barrier = True
+            kind = (use.group(1) or '').upper()
+            parts = _normalize_sql_name(use.group(2))
+            if kind == 'DATABASE':
+                database, schema = parts[-1], 'PUBLIC'
+            elif kind == 'SCHEMA' or (not kind and len(parts) == 2):
+                if len(parts) >= 2:
+                    database, schema = parts[-2], parts[-1]
+                else:
+                    schema = parts[0]
+            elif not kind and len(parts) == 1 and not re.match(r'^USE\s+(ROLE|WAREHOUSE|SECONDARY)\b', text, re.I):
+                database, schema = parts[0], 'PUBLIC'
+        else:
+            for pattern in _SQL_WRITE_RES:
+                match = pattern.match(text)
+                if match:
+                    object_type = match.group(1) or 'TABLE'
+                    object_type = ' '.join(object_type.upper().split())
+                    if object_type == 'COLUMN':
+                        break
+                    name = _qualify_sql_name(_normalize_sql_name(match.group(2)), object_type, database, schema)
+                    writes.add(name)
+                    if object_type in ('SCHEMA', 'DATABASE'):
+                        barrier = True
+                        if text[:6].upper() == 'CREATE':
+                            # CREATE DATABASE/SCHEMA also switches the session to the new container.
+                            database, schema = (name[0], 'PUBLIC') if object_type == 'DATABASE' else name[-2:]
+                    elif object_type == 'WAREHOUSE' and text[:6].upper() == 'CREATE':
+                        # CREATE WAREHOUSE makes the new warehouse the session's current one.
+                        barrier = True
+                    break
+            else:
+                if _SQL_GRANT_RE.match(text):
+                    grant = True
+                    barrier = bool(_SQL_GRANT_ALL_IN_RE.search(text))
+                elif not _SQL_READ_ONLY_RE.match(text):
+                    barrier = True
+
+        reads = set()
+        # Objects can be named inside string literals, e.g. FORMAT_NAME = 'db.s.ff'.
+        quoted = [
+            m.group()[1:-1].strip().lstrip('@').split('/', 1)[0]
+            for m in _SQL_NOISE_RE.finditer(statement) if m.group().startswith("'")
+        ]
+        quoted = [q for q in quoted if _SQL_NAME_RE.fullmatch(q)]
+        for token in _SQL_NAME_RE.findall(text) + quoted:
+            parts = _normalize_sql_name(token)
+            candidates = [parts]
+            if len(parts) < 3 and database:
+                candidates.append((database,) + parts)
+                if len(parts) == 1 and schema:
+                    candidates.append((database, schema) + parts)
+            elif len(parts) < 3:
+                # Unknown session context: match any known object with this suffix.
+                candidates.extend(by_suffix.get(parts, ()))
+            for candidate in candidates:
+                if candidate in known:
+                    reads.add(candidate)
+        granted = set(reads) if grant else ()
+        for name in list(writes) + list(reads):
+            for n in range(1, len(name)):
+                if name[:n] in known:
+                    reads.add(name[:n])
+
+        if barrier:
+            depends_on = set(since_barrier)
+            if last_barrier is not None:
+                depends_on.add(last_barrier)
+        else:
+            depends_on = {last_barrier} if last_barrier is not None else set()
+            for name in reads:
+                if name in last_writer:
+                    depends_on.add(last_writer[name])
+            for name in writes:
+                if name in last_writer:
+                    depends_on.add(last_writer[name])
+                depends_on.update(readers.get(name, ()))
+                for n in range(1, len(name) + 1):
+                    depends_on.update(grants.get(name[:n], ()))
+        depends_on.discard(index)
+
+        if barrier:
+            last_barrier, since_barrier = index, []
+        else:
+            since_barrier.append(index)
+        for name in reads:
+            readers.setdefault(name, []).append(index)
+        for name in granted:
+            grants.setdefault(name, []).append(index)
+        for name in writes:
+            known.add(name)
+            for n in range(1, min(len(name), 3)):
+                by_suffix.setdefault(name[-n:], set()).add(name)
+            last_writer[name] = index
+            readers[name] = []
+        nodes.append({
+            'index': index,
+            'statement': statement,
+            'writes': sorted('.'.join(n) for n in writes),
+            'reads': sorted('.'.join(n) for n in reads),
+            'barrier': barrier,
+            # USE, container DDL, ALTER SESSION, CALL, ... may leave the session changed.
+            'changes_session': barrier and not grant,
+            'depends_on': sorted(depends_on),
+        })
+    return nodes
+
+
+def _run_sql_statement(cursors, conn, node):
+    try:
+        cur = cursors.get_nowait()
+    except queue.Empty:
+        cur = conn.cursor()
+    stmt = node['statement']
+    started = time.perf_counter()
+    try:
+        _execute(cur, stmt)
+        try:
+            rows = cur.rowcount if cur.rowcount and cur.rowcount > 0 else 0
+        except Exception:
+            rows = 0
+        result = {'statement': stmt[:2000], 'success': True, 'rows_affected': rows, 'error': ''}
+    except Exception as e:
+        result = {'statement': stmt[:2000], 'success': False, 'rows_affected': 0, 'error': str(e)}
+    finally:
+        # Read the query id before another worker can pick the cursor up.
+        query_id = getattr(cur, 'sfqid', None)
+        cursors.put(cur)
+    result.update({
+        'index': node['index'],
+        'query_id': query_id,
+        'elapsed_s': round(time.perf_counter() - started, 3),
+    })
+    return result
+
+
+@traced()
+def iter_sql_script_results(conn, sql_text, max_workers=4, stop_on_error=False):
+    """Execute a script along its dependency DAG and yield each statement's
+    result (with ``index``, ``query_id`` and ``elapsed_s``) as it finishes.
+
+    Independent statements run concurrently on a pool of cursors that share
+    one session, so USE context and temporary objects stay visible to every
+    statement. With ``stop_on_error`` no further statements are started
+    after the first failure. A pooled session that ran a session-changing
+    statement is closed afterwards instead of being returned to the pool.
+    """
+    nodes = plan_sql_statements(split_sql_statements(sql_text))
+    waiting = [len(node['depends_on']) for node in nodes]
+    dependents = [[] for _ in nodes]
+    for node in nodes:
+        for dep in node['depends_on']:
+            dependents[dep].append(node['index'])
+    ready = [node['index'] for node in nodes if not node['depends_on']]
+    heapq.heapify(ready)
+    connection_pool = conn if isinstance(conn, SnowflakeConnectionPool) else None
+    if connection_pool is not None:
+        conn = connection_pool.acquire()
+    cursors = queue.LifoQueue()
+    session_changed = False
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+            running = {}
+            stopped = False
+            while running or (ready and not stopped):
+                while ready and not stopped and len(running) < max_workers:
+                    index = heapq.heappop(ready)
+                    session_changed = session_changed or nodes[index]['changes_session']
+                    running[pool.submit(_propagate(_run_sql_statement), cursors, conn, nodes[index])] = index
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in sorted(done, key=running.get):
+                    index = running.pop(future)
+                    result = future.result()
+                    if stop_on_error and not result['success']:
+                        stopped = True
+                    for dependent in dependents[index]:
+                        waiting[dependent] -= 1
+                        if waiting[dependent] == 0:
+                            heapq.heappush(ready, dependent)
+                    yield result
+    finally:
+        while not cursors.empty():
+            cursors.get_nowait().close()
+        if connection_pool is not None:
+            # A session switched by USE, CREATE DATABASE, ALTER SESSION, ... must
+            # not be handed to the next borrower, who expects the pool's context.
+            connection_pool.release(conn, discard=session_changed)
+
+
+@traced()
+def execute_sql_script(conn, sql_text, max_workers=4, stop_on_error=False):
+    results = list(iter_sql_script_results(conn, sql_text, max_workers=max_workers, stop_on_error=stop_on_error))
+    return sorted(results, key=lambda r: r['index'])
+
+
+@traced()
+def execute_sql_file(conn, file_path, max_workers=4, stop_on_error=False):
+    try:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            return execute_sql_script(conn, f, max_workers=max_workers, stop_on_error=stop_on_error)
+    except Exception as e:
+        raise Exception(f"Error executing SQL file {file_path}: {e}")
+
+
+LineageEdge = namedtuple('LineageEdge', ['source', 'target', 'operation', 'detail', 'file'])
+
+# Node kinds, strongest first: a name seen both as a bare reference and as
+# the target of CREATE VIEW ends up as a view.
+LINEAGE_NODE_KINDS = ('summary', 'view', 'table', 'temp', 'cte', 'procedure', 'task', 'stage', 'file', 'source')
+
+_LINEAGE_CREATE_RE = re.compile(
+    r'^CREATE\s+(?:OR\s+REPLACE\s+)?(?:(?:LOCAL|GLOBAL|SECURE|RECURSIVE|TRANSIENT|DYNAMIC|MATERIALIZED|EXTERNAL|'
+    r'(?P<temp>TEMP|TEMPORARY|VOLATILE))\s+)*(?P<kind>TABLE|VIEW|TASK|STREAM|STAGE)\s+(?:IF\s+NOT\s+EXISTS\s+)?'
+    r'(?P<name>' + _SQL_NAME + ')', re.I)
+_LINEAGE_WRITE_RE = re.compile(
+    r'^(?P<op>INSERT\s+(?:OVERWRITE\s+)?INTO|MERGE\s+INTO|COPY\s+INTO|UPDATE|DELETE\s+FROM)\s+'
+    r'(?P<stage>@)?(?P<name>' + _SQL_NAME + ')', re.I)
+_LINEAGE_ROUTINE_RE = re.compile(
+    r'^CREATE\s+(?:OR\s+REPLACE\s+)?(?:SECURE\s+)?(?P<kind>PROCEDURE|FUNCTION)\s+(?:IF\s+NOT\s+EXISTS\s+)?'
+    r'(?P<name>' + _SQL_NAME + r')[\s\S]*?\bAS\s*\$\$(?P<body>[\s\S]*)\$\$', re.I)
+_LINEAGE_CONTAINER_RE = re.compile(
+    r'^CREATE\s+(?:OR\s+REPLACE\s+)?(?:TRANSIENT\s+)?(DATABASE|SCHEMA)\s+(?:IF\s+NOT\s+EXISTS\s+)?(' + _SQL_NAME + ')', re.I)
+# Cheap filter for statements that can carry lineage or change the USE context.
+_LINEAGE_STATEMENT_RE = re.compile(r'^(?:BEGIN\s+|DECLARE\s+)?(?:CREATE|INSERT|MERGE|COPY|UPDATE|DELETE|USE)\b', re.I)
+_LINEAGE_BLOCK_START_RE = re.compile(r'^(?:BEGIN|DECLARE)\b\s*', re.I)
+_LINEAGE_SOURCE_RE = re.compile(
+    r'\b(?P<clause>FROM|USING|CLONE|(?:(?:NATURAL\s+)?(?:LEFT|RIGHT|FULL)(?:\s+OUTER)?\s+|INNER\s+|CROSS\s+)?JOIN)'
+    r'\s+(?P<stage>@)?(?P<name>' + _SQL_NAME + ')', re.I)
+_LINEAGE_COMMA_SOURCE_RE = re.compile(
+    r'\s*(?:(?:AS\s+)?(?!(?:WHERE|GROUP|ORDER|HAVING|QUALIFY|LIMIT|UNION|ON|JOIN|LEFT|RIGHT|FULL|INNER|CROSS)\b)'
+    r'[A-Za-z_][\w$]*)?\s*,\s*(?P<name>' + _SQL_NAME + ')', re.I)
+_LINEAGE_ON_RE = re.compile(
+    r'\s*(?:AS\s+)?(?:[A-Za-z_][\w$]*\s+)?ON\s+(?P<cond>.+?)(?=\b(?:WHERE|GROUP|ORDER|HAVING|QUALIFY|LIMIT|UNION|'
+    r'LEFT|RIGHT|FULL|INNER|CROSS|NATURAL|JOIN)\b|\)|$)', re.I | re.S)
+_LINEAGE_CTE_RE = re.compile(r'(?:\bWITH\s+(?:RECURSIVE\s+)?|,\s*)(?P<name>[A-Za-z_][\w$]*)\s*(?:\([^()]*\)\s*)?AS\s*\(', re.I)
+_LINEAGE_AGG_RE = re.compile(
+    r'\b(SUM|COUNT|AVG|MIN|MAX|MEDIAN|STDDEV\w*|VARIANCE\w*|ARRAY_AGG|LISTAGG|OBJECT_AGG|APPROX_COUNT_DISTINCT)\s*\(', re.I)
+_LINEAGE_FROM_FUNCTION_RE = re.compile(r'\b(?:EXTRACT|TRIM|SUBSTRING|SUBSTR|POSITION|OVERLAY|DATE_PART)\s*\([^()]*$', re.I)
+_LINEAGE_NOT_OBJECTS = {'SELECT', 'LATERAL', 'TABLE', 'VALUES', 'DUAL'}
+_LINEAGE_PY_STRING_RE = re.compile(r'"""([\s\S]*?)"""|\'\'\'([\s\S]*?)\'\'\'|"((?:[^"\\\n]|\\.)*)"|\'((?:[^\'\\\n]|\\.)*)\'')
+_LINEAGE_SQL_HINT_RE = re.compile(r'\b(SELECT|INSERT|MERGE|COPY\s+INTO|CREATE)\b', re.I)
+
+
+class LineageGraph:
+    """Typed lineage graph: ``nodes`` maps a name to its kind, notes and
+    source files; ``edges`` holds ``LineageEdge`` tuples without duplicates."""
+
+    def __init__(self):
+        self.nodes = {}
+        self.edges = []
+        self._edge_keys = set()
+
+    def add_node(self, name, kind='source', note=None, file=None):
+        node = self.nodes.get(name)
+        if node is None:
+            node = self.nodes[name] = {'kind': kind, 'notes': [], 'files': []}
+        elif LINEAGE_NODE_KINDS.index(kind) < LINEAGE_NODE_KINDS.index(node['kind']):
+            node['kind'] = kind
+        if note and note not in node['notes']:
+            node['notes'].append(note)
+        if file and file not in node['files']:
+            node['files'].append(file)
+        return node
+
+    def add_edge(self, source, target, operation, detail='', file=''):
+        if source == target:
+            return
+        key = (source, target, operation, detail)
+        if key in self._edge_keys:
+            return
+        self._edge_keys.add(key)
+        self.add_node(source)
+        self.add_node(target)
+        self.edges.append(LineageEdge(source, target, operation, detail, file))
+
+    def merge(self, other):
+        for name, node in other.nodes.items():
+            merged = self.add_node(name, node['kind'])
+            for note in node['notes']:
+                if note not in merged['notes']:
+                    merged['notes'].append(note)
+            for f in node['files']:
+                if f not in merged['files']:
+                    merged['files'].append(f)
+        for edge in other.edges:
+            self.add_edge(*edge)
+        return self
+
+    def find(self, name):
+        if not name:
+            return None
+        wanted = _normalize_sql_name(name.strip().lstrip('@'))
+        exact = '.'.join(wanted)
+        if exact in self.nodes:
+            return exact
+        matches = sorted(n for n in self.nodes if tuple(n.split('.'))[-len(wanted):] == wanted)
+        return matches[0] if matches else None
+
+    def to_dict(self):
+        nodes = {name: {'kind': n['kind'], 'notes': list(n['notes']), 'files': list(n['files'])} for name, n in self.nodes.items()}
+        return {'nodes': nodes, 'edges': [list(edge) for edge in self.edges]}
+
+    @classmethod
+    def from_dict(cls, data):
+        graph = cls()
+        for name, node in data.get('nodes', {}).items():
+            graph.nodes[name] = {'kind': node['kind'], 'notes': list(node['notes']), 'files': list(node['files'])}
+        for edge in data.get('edges', []):
+            graph.add_edge(*edge)
+        return graph
+
+    def copy_node(self, other, name):
+        node = other.nodes[name]
+        self.nodes[name] = {'kind': node['kind'], 'notes': list(node['notes']), 'files': list(node['files'])}
+
+    def collapse(self, kinds):
+        """Drop nodes of the given kinds, reconnecting their inputs to their outputs."""
+        drop = {n for n, node in self.nodes.items() if node['kind'] in kinds}
+        if not drop:
+            return self
+        inputs = {}
+        for edge in self.edges:
+            inputs.setdefault(edge.target, []).append(edge)
+
+        def resolve(name, seen):
+            if name not in drop:
+                return [name]
+            result = []
+            for edge in inputs.get(name, ()):
+                if edge.source not in seen:
+                    result.extend(resolve(edge.source, seen | {edge.source}))
+            return result
+
+        collapsed = LineageGraph()
+        for name in self.nodes:
+            if name not in drop:
+                collapsed.copy_node(self, name)
+        for edge in self.edges:
+            if edge.target not in drop:
+                for source in resolve(edge.source, {edge.source}):
+                    collapsed.add_edge(source, edge.target, edge.operation, edge.detail, edge.file)
+        return collapsed
+
+    def summarize(self, level, expand=()):
+        """Collapse objects into one summary node per schema (``level=2``) or
+        database (``level=1``); objects under an ``expand`` prefix stay as is."""
+        expand = tuple(p + '.' for p in expand)
+
+        def owner(name):
+            parts = name.split('::')[0].split('.')
+            if len(parts) <= level or name.startswith(expand) or self.nodes[name]['kind'] == 'stage':
+                return name
+            return '.'.join(parts[:level])
+
+        owners = {name: owner(name) for name in self.nodes}
+        members = Counter(owners[name] for name in self.nodes if owners[name] != name)
+        summary = LineageGraph()
+        for name, group in owners.items():
+            if group == name:
+                summary.copy_node(self, name)
+            elif group not in summary.nodes:
+                summary.add_node(group, 'summary', note=f'Objects: {members[group]}')
+        counts, first = Counter(), {}
+        for edge in self.edges:
+            key = (owners[edge.source], owners[edge.target])
+            if key[0] != key[1]:
+                counts[key] += 1
+                first.setdefault(key, edge)
+        for key, edge in first.items():
+            if counts[key] == 1:
+                summary.add_edge(key[0], key[1], edge.operation, edge.detail, edge.file)
+            else:
+                summary.add_edge(key[0], key[1], f'{counts[key]} edges', '', '')
+        return summary
+
+    def index(self):
+        index = LineageIndex()
+        for edge in self.edges:
+            index.add_edge(edge.source, edge.target, edge.operation)
+        for name in self.nodes:
+            index.intern(name)
+        return index
+
+    def subgraph(self, target, max_hops):
+        index = self.index()
+        found = index.neighborhood(target, max_hops)
+        if found is None:
+            return self
+        start, edge_ids = found
+        sub = LineageGraph()
+        sub.copy_node(self, index.names[start])
+        for e in sorted(edge_ids):
+            edge = self.edges[e]
+            for name in (edge.source, edge.target):
+                if name not in sub.nodes:
+                    sub.copy_node(self, name)
+            sub.add_edge(*edge)
+        return sub
+
+
+class LineageIndex:
+    """Compact edge index for large lineage graphs.
+
+    Node names and operations are interned to integer ids and edges are kept
+    in ``array`` columns; adjacency in both directions is built lazily in CSR
+    form so hop-bounded queries only touch the edges they walk.
+    """
+
+    def __init__(self):
+        self.ids = {}
+        self.names = []
+        self.operations = []
+        self._operation_ids = {}
+        self._raw_ids = {}
+        self._src = array('i')
+        self._dst = array('i')
+        self._op = array('i')
+        self._adjacency = None
+
+    def __len__(self):
+        return len(self._src)
+
+    def intern(self, name):
+        node_id = self.ids.get(name)
+        if node_id is None:
+            node_id = self.ids[name] = len(self.names)
+            self.names.append(name)
+        return node_id
+
+    def intern_raw(self, raw_name):
+        # Raw CSV cells repeat heavily; normalize each distinct spelling once.
+        node_id = self._raw_ids.get(raw_name)
+        if node_id is None:
+            if _LINEAGE_PLAIN_NAME_RE.fullmatch(raw_name):
+                name = raw_name.upper()
+            else:
+                name = '.'.join(_normalize_sql_name(raw_name))
+            node_id = self._raw_ids[raw_name] = self.intern(name)
+        return node_id
+
+    def add_edge(self, source, target, operation=''):
+        self.add_edges([(source, target, operation)], raw=False)
+
+    def add_edges(self, edges, raw=True):
+        """Append ``(source, target, operation)`` triples; raw names are normalized like SQL identifiers."""
+        intern = self.intern_raw if raw else self.intern
+        known = self._raw_ids if raw else self.ids
+        operation_ids = self._operation_ids
+        src, dst, op = self._src.append, self._dst.append, self._op.append
+        for source, target, operation in edges:
+            source_id = known.get(source)
+            src(intern(source) if source_id is None else source_id)
+            target_id = known.get(target)
+            dst(intern(target) if target_id is None else target_id)
+            op_id = operation_ids.get(operation)
+            if op_id is None:
+                op_id = operation_ids[operation] = len(self.operations)
+                self.operations.append(operation)
+            op(op_id)
+        self._adjacency = None
+
+    def edge(self, edge_id):
+        return self.names[self._src[edge_id]], self.names[self._dst[edge_id]], self.operations[self._op[edge_id]]
+
+    def find(self, name):
+        if not name:
+            return None
+        wanted = _normalize_sql_name(name.strip().lstrip('@'))
+        node_id = self.ids.get('.'.join(wanted))
+        if node_id is not None:
+            return node_id
+        suffix = '.' + '.'.join(wanted)
+        matches = sorted(n for n in self.names if n.endswith(suffix))
+        return self.ids[matches[0]] if matches else None
+
+    def _csr(self, keys):
+        offsets = array('i', [0])
+        counts = Counter(keys)
+        total = 0
+        for node_id in range(len(self.names)):
+            total += counts.get(node_id, 0)
+            offsets.append(total)
+        order = array('i', sorted(range(len(keys)), key=keys.__getitem__))
+        return offsets, order
+
+    def adjacency(self):
+        """Upstream and downstream ``(offsets, order, ends)`` CSR views, built once."""
+        if self._adjacency is None:
+            self._adjacency = (self._csr(self._dst) + (self._src,), self._csr(self._src) + (self._dst,))
+        return self._adjacency
+
+    def neighborhood(self, target, max_hops):
+        """Return ``(node_id, edge_ids)`` for edges within ``max_hops`` upstream
+        and downstream of ``target``, or None when the target is unknown."""
+        found = lineage_neighborhood([self], target, max_hops)
+        if found is None:
+            return None
+        return self.ids[found[0]], found[1][0]
+
+
+class EdgeTable(LineageIndex):
+    """Lineage CSV rows held as columns.
+
+    Sources, targets and operations are interned ``LineageIndex`` id
+    columns; every other CSV column becomes an ``array`` of ids into its own
+    list of distinct values. Rows are streamed from ``from_csv`` and never
+    kept as dicts.
+    """
+
+    def __init__(self, attribute_names=()):
+        super().__init__()
+        self.attribute_names = list(attribute_names)
+        self.attribute_values = [[] for _ in self.attribute_names]
+        self._attribute_ids = [{} for _ in self.attribute_names]
+        self._attributes = [array('i') for _ in self.attribute_names]
+        self.rows_read = 0
+        self.rows_skipped = 0
+        self._stats = None
+
+    @classmethod
+    def from_csv(cls, lines):
+        """Build a table from an iterable of CSV lines (a text file object works).
+
+        Columns are recognized like lineage CSV uploads; rows without a source
+        or target, or pointing at themselves, are counted as skipped.
+        """
+        reader = csv.reader(lines)
+        headers = next(reader, None) or []
+        source_key, target_key, operation_key = _lineage_csv_columns(headers)
+        if source_key is None:
+            return cls()
+        s, t = headers.index(source_key), headers.index(target_key)
+        o = headers.index(operation_key) if operation_key else None
+        extra = [i for i, h in enumerate(headers) if h and i not in (s, t, o)]
+        table = cls([headers[i] for i in extra])
+        width = max([s, t] + ([o] if o is not None else []))
+        known, intern = table._raw_ids, table.intern_raw
+        operation_ids = table._operation_ids
+        src, dst, op = table._src.append, table._dst.append, table._op.append
+        columns = list(zip(extra, table._attribute_ids, table.attribute_values, table._attributes))
+        read = skipped = 0
+        for row in reader:
+            read += 1
+            if len(row) <= width:
+                row = row + [''] * (width + 1 - len(row))
+            source, target = row[s].strip(), row[t].strip()
+            if not source or not target or source == target:
+                skipped += 1
+                continue
+            source_id = known.get(source)
+            src(intern(source) if source_id is None else source_id)
+            target_id = known.get(target)
+            dst(intern(target) if target_id is None else target_id)
+            operation = (row[o] or 'CSV') if o is not None else 'CSV'
+            op_id = operation_ids.get(operation)
+            if op_id is None:
+                op_id = operation_ids[operation] = len(table.operations)
+                table.operations.append(operation)
+            op(op_id)
+            for i, ids, values, column in columns:
+                value = row[i] if i < len(row) else ''
+                value_id = ids.get(value)
+                if value_id is None:
+                    value_id = ids[value] = len(values)
+                    values.append(value)
+                column.append(value_id)
+        table.rows_read, table.rows_skipped = read, skipped
+        return table
+
+    def iter_edges(self):
+        names, operations = self.names, self.operations
+        for source_id, target_id, op_id in zip(self._src, self._dst, self._op):
+            yield names[source_id], names[target_id], operations[op_id]
+
+    def attributes(self, edge_id):
+        return {name: values[column[edge_id]]
+                for name, values, column in zip(self.attribute_names, self.attribute_values, self._attributes)}
+
+    def sample(self, limit=1000):
+        """The first ``limit`` edges as dicts, for previews."""
+        rows = []
+        for edge_id in range(min(limit, len(self))):
+            source, target, operation = self.edge(edge_id)
+            rows.append({'source': source, 'target': target, 'operation': operation, **self.attributes(edge_id)})
+        return rows
+
+    def stats(self, top=10):
+        """Row, node and operation counts; computed once, as the table does
+        not change after ``from_csv``."""
+        if self._stats is not None and self._stats[0] == (len(self), top):
+            return self._stats[1]
+        operations = Counter(self._op)
+        stats = {
+            'rows': self.rows_read,
+            'edges': len(self),
+            'skipped': self.rows_skipped,
+            'nodes': len(self.names),
+            'sources': len(set(self._src)),
+            'targets': len(set(self._dst)),
+            'operations': [(self.operations[op_id], n) for op_id, n in operations.most_common(top)],
+            'bytes': sum(a.itemsize * len(a) for a in [self._src, self._dst, self._op] + self._attributes),
+        }
+        self._stats = ((len(self), top), stats)
+        return stats
+
+
+def lineage_neighborhood(indexes, target, max_hops):
+    """Walk ``max_hops`` upstream and downstream of ``target`` across several
+    ``LineageIndex`` objects joined by node name.
+
+    Returns ``(start_name, [edge_ids per index])``, or None when no index
+    knows the target.
+    """
+    start = None
+    for index in indexes:
+        node_id = index.find(target)
+        if node_id is not None:
+            start = index.names[node_id]
+            break
+    if start is None:
+        return None
+    edge_ids = [set() for _ in indexes]
+    for direction in (0, 1):
+        views = [(index.ids, index.names, index.adjacency()[direction], found) for index, found in zip(indexes, edge_ids)]
+        seen = {start}
+        frontier = [start]
+        for _ in range(max_hops):
+            next_frontier = []
+            for name in frontier:
+                for ids, names, (offsets, order, ends), found in views:
+                    node_id = ids.get(name)
+                    if node_id is None:
+                        continue
+                    for i in range(offsets[node_id], offsets[node_id + 1]):
+                        edge_id = order[i]
+                        found.add(edge_id)
+                        other = names[ends[edge_id]]
+                        if other not in seen:
+                            seen.add(other)
+                            next_frontier.append(other)
+            if not next_frontier:
+                break
+            frontier = next_frontier
+    return start, edge_ids
+
+
+def _lineage_name(name, database, schema):
+    parts = _normalize_sql_name(name)
+    if len(parts) == 1 and database and schema:
+        parts = (database, schema) + parts
+    elif len(parts) == 2 and database:
+        parts = (database,) + parts
+    return '.'.join(parts)
+
+
+def _split_ctes(text):
+    ctes = []
+    blanked = list(text)
+    pos = 0
+    while True:
+        match = _LINEAGE_CTE_RE.search(text, pos)
+        if match is None or (match.group().lstrip()[:1] == ',' and not ctes):
+            break
+        if ctes and text[ctes[-1][2]:match.start()].strip():
+            break
+        depth, i = 1, match.end()
+        while i < len(text) and depth:
+            depth += {'(': 1, ')': -1}.get(text[i], 0)
+            i += 1
+        ctes.append((match.group('name').upper(), text[match.end():i - 1], i))
+        for j in range(match.end(), i - 1):
+            blanked[j] = ' '
+        pos = i
+    return ctes, ''.join(blanked)
+
+
+def _resolve_cte(source, cte_names, database, schema):
+    # Sources were qualified with the USE context before CTEs were known.
+    short = source.split('.')[-1]
+    if short in cte_names and source in (short, f"{database}.{schema}.{short}"):
+        return cte_names[short]
+    return source
+
+
+def _lineage_sources(text, database, schema):
+    sources = []
+    for match in _LINEAGE_SOURCE_RE.finditer(text):
+        if match.group('clause').upper() == 'FROM' and _LINEAGE_FROM_FUNCTION_RE.search(text[max(0, match.start() - 120):match.start()]):
+            continue
+        names = [(match.group('name'), match.end())]
+        if match.group('clause').upper() == 'FROM':
+            pos = match.end()
+            while True:
+                more = _LINEAGE_COMMA_SOURCE_RE.match(text, pos)
+                if more is None:
+                    break
+                names.append((more.group('name'), more.end()))
+                pos = more.end()
+        clause = ' '.join(match.group('clause').upper().split())
+        for raw, end in names:
+            if raw.upper() in _LINEAGE_NOT_OBJECTS or text[end:end + 1] == '(' or text[end:].lstrip()[:1] == '(':
+                continue
+            detail = ''
+            if clause.endswith('JOIN'):
+                on = _LINEAGE_ON_RE.match(text, end)
+                detail = clause + (' ON ' + ' '.join(on.group('cond').split()) if on else '')
+            sources.append((_lineage_name(raw, database, schema), bool(match.group('stage')), clause, detail))
+    return sources
+
+
+def _statement_notes(text):
+    notes = []
+    aggregates = sorted({m.upper() for m in _LINEAGE_AGG_RE.findall(text)})
+    if aggregates:
+        notes.append('Aggregations: ' + ', '.join(aggregates))
+    if re.search(r'\bGROUP\s+BY\b', text, re.I):
+        notes.append('GROUP BY')
+    if re.search(r'\bOVER\s*\(', text, re.I):
+        notes.append('Window functions')
+    if re.search(r'\bWHERE\b', text, re.I):
+        notes.append('Filtered (WHERE)')
+    return notes
+
+
+def _extract_statement_lineage(graph, statement, file_name, context, via=None):
+    routine = _LINEAGE_ROUTINE_RE.match(statement.strip())
+    if routine:
+        name = _lineage_name(routine.group('name').split('(')[0], *context)
+        if routine.group('kind').upper() == 'PROCEDURE':
+            graph.add_node(name, 'procedure', file=file_name)
+        inner = list(context)
+        for body_statement in iter_sql_statements(routine.group('body')):
+            _extract_statement_lineage(graph, body_statement, file_name, inner, via=name)
+        return
+    text = _SQL_NOISE_RE.sub(lambda m: "''" if m.group()[:1] == "'" else ' ', statement).strip().rstrip(';')
+    if not _LINEAGE_STATEMENT_RE.match(text):
+        return
+    text = _LINEAGE_BLOCK_START_RE.sub('', text).strip()
+    database, schema = context
+    use = _SQL_USE_RE.match(text)
+    if use:
+        kind = (use.group(1) or '').upper()
+        parts = _normalize_sql_name(use.group(2))
+        if not kind and re.match(r'^USE\s+(?:WAREHOUSE|ROLE|SECONDARY)\b', text, re.I):
+            return
+        if kind == 'DATABASE' or (not kind and len(parts) == 1):
+            context[:] = [parts[-1], 'PUBLIC']
+        elif kind == 'SCHEMA' or len(parts) == 2:
+            context[:] = [parts[-2], parts[-1]] if len(parts) >= 2 else [database, parts[0]]
+        return
+    container = _LINEAGE_CONTAINER_RE.match(text)
+    if container:
+        parts = _normalize_sql_name(container.group(2))
+        if container.group(1).upper() == 'DATABASE':
+            context[:] = [parts[-1], 'PUBLIC']
+        else:
+            context[:] = [parts[-2] if len(parts) > 1 else database, parts[-1]]
+        return
+
+    target = operation = None
+    kind = 'table'
+    create = _LINEAGE_CREATE_RE.match(text)
+    write = _LINEAGE_WRITE_RE.match(text)
+    if create:
+        target = _lineage_name(create.group('name'), database, schema)
+        created = create.group('kind').upper()
+        kind = {'VIEW': 'view', 'TASK': 'task', 'STAGE': 'stage'}.get(created, 'temp' if create.group('temp') else 'table')
+        body = text[create.end():]
+        if created == 'VIEW':
+            operation = 'VIEW'
+        elif re.search(r'\bCLONE\b', body, re.I):
+            operation = 'CLONE'
+        elif re.search(r'\bAS\b', body, re.I):
+            operation = 'CALL' if created == 'TASK' else 'CTAS'
+        graph.add_node(target, kind, file=file_name)
+        if operation is None:
+            return
+        if created == 'TASK':
+            called = re.search(r'\bCALL\s+(' + _SQL_NAME + ')', body, re.I)
+            if called:
+                graph.add_edge(_lineage_name(called.group(1), database, schema), target, 'CALL', '', file_name)
+            return
+    elif write:
+        operation = ' '.join(write.group('op').upper().split())
+        operation = {'INSERT OVERWRITE INTO': 'INSERT OVERWRITE', 'INSERT INTO': 'INSERT', 'MERGE INTO': 'MERGE',
+                     'DELETE FROM': 'DELETE'}.get(operation, operation)
+        target = _lineage_name(write.group('name'), database, schema)
+        if write.group('stage'):
+            graph.add_node(target, 'stage', file=file_name)
+        else:
+            graph.add_node(target, 'table', file=file_name)
+        if operation == 'DELETE':
+            return
+    else:
+        return
+
+    body = text[(create or write).end():]
+    ctes, body_without_ctes = _split_ctes(body)
+    cte_names = {}
+    for cte_name, cte_body, _ in ctes:
+        node = f"{target}::{cte_name}"
+        cte_names[cte_name] = node
+        graph.add_node(node, 'cte', file=file_name)
+        for note in _statement_notes(cte_body):
+            graph.add_node(node, 'cte', note=note)
+    for cte_name, cte_body, _ in ctes:
+        for source, is_stage, clause, detail in _lineage_sources(cte_body, database, schema):
+            source = _resolve_cte(source, cte_names, database, schema)
+            if source not in cte_names.values():
+                graph.add_node(source, 'stage' if is_stage else 'source')
+            graph.add_edge(source, cte_names[cte_name], 'CTE', detail, file_name)
+    for note in _statement_notes(body_without_ctes):
+        graph.add_node(target, kind, note=note)
+    if via:
+        graph.add_node(target, kind, note=f"Written by {via}")
+    label = operation if not via else f"{operation} ({via.split('.')[-1]})"
+    for source, is_stage, clause, detail in _lineage_sources(body_without_ctes, database, schema):
+        source = _resolve_cte(source, cte_names, database, schema)
+        if source not in cte_names.values():
+            graph.add_node(source, 'stage' if is_stage else 'source')
+        graph.add_edge(source, target, label, detail, file_name)
+
+
+def extract_sql_lineage(sql_text, file_name=''):
+    """Parse SQL text into a ``LineageGraph`` without calling a model.
+
+    Handles CTAS, CREATE VIEW, CLONE, INSERT/MERGE/UPDATE, COPY INTO (load
+    and unload), tasks that CALL procedures, CTEs and SQL procedure bodies;
+    joins become edge details and aggregations, windows and filters become
+    node notes. Unqualified names are resolved against USE context.
+    """
+    graph = LineageGraph()
+    context = [None, None]
+    for statement in iter_sql_statements(sql_text):
+        _extract_statement_lineage(graph, statement, file_name, context)
+    return graph
+
+
+def extract_code_lineage(name, content):
+    if name.lower().endswith('.sql'):
+        return extract_sql_lineage(content, name)
+    # Other languages: analyse string literals that look like SQL.
+    graph = LineageGraph()
+    for match in _LINEAGE_PY_STRING_RE.finditer(content):
+        literal = next(g for g in match.groups() if g is not None)
+        if _LINEAGE_SQL_HINT_RE.search(literal):
+            graph.merge(extract_sql_lineage(literal, name))
+    return graph
+
+
+# Bump when extraction changes so fragments stored by older code are not reused.
+LINEAGE_FRAGMENT_VERSION = 2
+
+_lineage_fragment_store = None
+_lineage_fragment_store_lock = threading.Lock()
+
+
+def get_lineage_fragment_store(path=None):
+    global _lineage_fragment_store
+    with _lineage_fragment_store_lock:
+        if _lineage_fragment_store is None:
+            _lineage_fragment_store = PersistentCache(
+                path or os.path.join(_DEFAULT_CACHE_DIR, 'lineage_fragments.sqlite'),
+                namespace='lineage_fragments',
+                max_entries=4096,
+                max_disk_entries=200000,
+                max_bytes=128 * 1024 * 1024,
+            )
+        return _lineage_fragment_store
+
+
+def extract_lineage_fragments(code_blobs, store=None):
+    """Return one ``LineageGraph`` per code blob, reusing fragments stored
+    under a hash of the file name and content.
+
+    Only new or changed files are parsed; their fragments are saved for the
+    next run. The current span counts ``fragments_reused`` and
+    ``fragments_extracted``.
+    """
+    store = store if store is not None else get_lineage_fragment_store()
+    fragments = []
+    reused = extracted = 0
+    for blob in code_blobs or []:
+        name, content = blob.get('name', 'unknown'), blob.get('content', '')
+        key = (LINEAGE_FRAGMENT_VERSION, hashlib.sha256(content.encode('utf-8')).hexdigest(), name)
+        stored = store.get(key)
+        if stored is not None:
+            fragments.append(LineageGraph.from_dict(stored))
+            reused += 1
+            continue
+        fragment = extract_code_lineage(name, content)
+        store.set(key, fragment.to_dict())
+        fragments.append(fragment)
+        extracted += 1
+    _annotate(fragments_reused=reused, fragments_extracted=extracted)
+    return fragments
+
+
+_LINEAGE_PLAIN_NAME_RE = re.compile(r'[A-Za-z0-9_$]+(?:\.[A-Za-z0-9_$]+)*')
+_LINEAGE_CSV_SOURCE_KEYS = ('source', 'source_object', 'source_table', 'src', 'from', 'upstream', 'parent')
+_LINEAGE_CSV_TARGET_KEYS = ('target', 'target_object', 'target_table', 'tgt', 'to', 'downstream', 'child')
+_LINEAGE_CSV_OPERATION_KEYS = ('operation', 'transformation', 'relationship', 'relation', 'type')
+
+
+def _lineage_csv_columns(headers):
+    lowered = {h.strip().lower(): h for h in headers if h}
+    source = next((lowered[k] for k in _LINEAGE_CSV_SOURCE_KEYS if k in lowered), None)
+    target = next((lowered[k] for k in _LINEAGE_CSV_TARGET_KEYS if k in lowered), None)
+    if source is None or target is None:
+        if len(headers) < 2:
+            return None, None, None
+        source, target = headers[0], headers[1]
+    operation = next((lowered[k] for k in _LINEAGE_CSV_OPERATION_KEYS if k in lowered), None)
+    return source, target, operation
+
+
+def _iter_lineage_csv_edges(lineage_rows):
+    if not lineage_rows:
+        return
+    source_key, target_key, operation_key = _lineage_csv_columns(list(lineage_rows[0].keys()))
+    if source_key is None:
+        return
+    for row in lineage_rows:
+        source, target = (row.get(source_key) or '').strip(), (row.get(target_key) or '').strip()
+        if source and target and source != target:
+            yield source, target, (row.get(operation_key) or 'CSV') if operation_key else 'CSV'
+
+
+@traced()
+def build_lineage_graph(code_blobs=None, lineage_rows=None, target=None, max_hops=2, collapse=(), fragment_store=None):
+    """Merge code-derived lineage with CSV relationships into a ``LineageGraph``.
+
+    Code is parsed per file and unchanged files reuse their stored fragments
+    (see ``extract_lineage_fragments``). ``lineage_rows`` is an ``EdgeTable``
+    or a list of CSV row dicts. Code nodes whose kind is in ``collapse`` are
+    folded into their edges. With a ``target`` only the edges within
+    ``max_hops`` of it are materialized; an ``EdgeTable`` keeps its adjacency
+    between calls.
+    """
+    graph = LineageGraph()
+    for fragment in extract_lineage_fragments(code_blobs, fragment_store):
+        graph.merge(fragment)
+    graph = graph.collapse(collapse)
+    table = lineage_rows if isinstance(lineage_rows, LineageIndex) else None
+    if not target:
+        if table is not None:
+            edges = table.iter_edges()
+        else:
+            edges = (
+                ('.'.join(_normalize_sql_name(source)), '.'.join(_normalize_sql_name(dest)), operation)
+                for source, dest, operation in _iter_lineage_csv_edges(lineage_rows)
+            )
+        for source, dest, operation in edges:
+            graph.add_edge(source, dest, operation, '', 'lineage.csv')
+        return graph
+
+    if table is None:
+        table = LineageIndex()
+        table.add_edges(_iter_lineage_csv_edges(lineage_rows))
+    index = graph.index()
+    found = lineage_neighborhood([index, table], target, max_hops)
+    if found is None:
+        # Unknown target: show everything, as without a focus.
+        for e in range(len(table)):
+            graph.add_edge(*table.edge(e), '', 'lineage.csv')
+        return graph
+    start, (code_ids, csv_ids) = found
+    sub = LineageGraph()
+    names = [start] + [n for e in code_ids for n in index.edge(e)[:2]] + [n for e in csv_ids for n in table.edge(e)[:2]]
+    for name in names:
+        if name not in sub.nodes:
+            if name in graph.nodes:
+                sub.copy_node(graph, name)
+            else:
+                sub.add_node(name)
+    for e in sorted(code_ids):
+        sub.add_edge(*graph.edges[e])
+    for e in sorted(csv_ids):
+        sub.add_edge(*table.edge(e), '', 'lineage.csv')
+    return sub
+
+
+_request_throttle: Optional[Callable[[], None]] = None
+
+
+def set_request_throttle(throttle: Optional[Callable[[], None]]) -> None:
+    """Install a blocking callable run before every OpenAI request this process
+    sends (cache hits excluded), e.g. a rate limiter shared by batch workers."""
+    global _request_throttle
+    _request_throttle = throttle
+
+
+def _get_client(openai_api_key: Optional[str]):
+    if not openai_api_key:
+        raise OpenAIClientNotConfigured("OpenAI API key is required")
+    if OpenAI is None:
+        raise OpenAIClientNotConfigured("openai package not installed")
+    return OpenAI(api_key=openai_api_key)
+
+
+def _get_async_client(openai_api_key: Optional[str]):
+    if not openai_api_key:
+        raise OpenAIClientNotConfigured("OpenAI API key is required")
+    if AsyncOpenAI is None:
+        raise OpenAIClientNotConfigured("openai package not installed")
+    return AsyncOpenAI(api_key=openai_api_key)
+
+
+# Bump a template's version whenever its prompt text changes so cached
+# responses produced by the old wording are no longer served.
+PROMPT_TEMPLATE_VERSIONS = {
+    "business_glossary": 2,
+    "lineage_enrichment": 2,
+}
+
+_llm_cache = None
+_llm_cache_lock = threading.Lock()
+
+
+def get_llm_response_cache(path: Optional[str] = None, **kwargs) -> PersistentCache:
+    global _llm_cache
+    with _llm_cache_lock:
+        if _llm_cache is None:
+            options = {
+                "namespace": "openai",
+                "max_entries": 256,
+                "max_bytes": 32 * 1024 * 1024,
+                "max_disk_bytes": 256 * 1024 * 1024,
+                "default_ttl": 7 * 24 * 3600,
+            }
+            options.update(kwargs)
+            _llm_cache = PersistentCache(path or os.path.join(_DEFAULT_CACHE_DIR, "llm_responses.sqlite"), **options)
+        return _llm_cache
+
+
+def _llm_cache_key(template: str, messages: List[Dict[str, str]], model: str, temperature: float, options: Dict[str, Any]) -> tuple:
+    payload = {
+        "model": model,
+        "temperature": temperature,
+        "messages": messages,
+        "template": template,
+        "version": PROMPT_TEMPLATE_VERSIONS.get(template, 0),
+        "options": options,
+    }
+    return (template, hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest())
+
+
+def _cached_chat_completion(
+    openai_api_key: Optional[str],
+    template: str,
+    messages: List[Dict[str, str]],
+    model: str = "gpt-4o-mini",
+    temperature: float = 0.2,
+    use_cache: bool = True,
+    is_valid: Optional[Callable[[str], bool]] = None,
+    **options: Any,
+) -> str:
+    """Return the completion text for ``messages``, served from the response
+    cache when the same model, temperature, messages and template version
+    were seen before. Responses rejected by ``is_valid`` are not cached."""
+    with get_tracer().span("openai.chat", template=template, model=model) as span:
+        cache = get_llm_response_cache() if use_cache else None
+        key = _llm_cache_key(template, messages, model, temperature, options)
+        if cache is not None:
+            cached = cache.get(key)
+            if cached is not None:
+                return cached
+        client = _get_client(openai_api_key)
+        if _request_throttle is not None:
+            _request_throttle()
+        response = client.chat.completions.create(model=model, messages=messages, temperature=temperature, **options)
+        _annotate_usage(span, getattr(response, "usage", None))
+        text = response.choices[0].message.content or ""
+        if cache is not None and text and (is_valid is None or is_valid(text)):
+            cache.set(key, text)
+        return text
+
+
+def _annotate_usage(span: Dict[str, Any], usage: Any) -> None:
+    if span and usage is not None:
+        span["prompt_tokens"] = span.get("prompt_tokens", 0) + (getattr(usage, "prompt_tokens", 0) or 0)
+        span["completion_tokens"] = span.get("completion_tokens", 0) + (getattr(usage, "completion_tokens", 0) or 0)
+
+
+def _is_json(text: str) -> bool:
+    try:
+        json.loads(text)
+        return True
+    except Exception:
+        return False
+
+
+# Keys of a semantic-model table whose list entries each describe one column.
+GLOSSARY_COLUMN_KEYS = ("dimensions", "time_dimensions", "measures", "facts", "metrics", "columns")
+
+_GLOSSARY_PROMPT = (
+    "You are a data governance expert. Given the following semantic YAML, produce a business glossary.\n"
+    "Requirements:\n"
+    "- Return JSON only (no prose).\n"
+    "- Include a per-column glossary with definitions and synonyms.\n"
+    "- JSON keys: columns (array of {table, column, definition, synonyms}), terms (optional array of {term, definition, related_columns, tables, dq_notes}).\n"
+    "- In columns.synonyms, include up to 5 concise, business-friendly synonyms; omit duplicates.\n\n"
+)
+
+
+def split_semantic_model(parsed: Any, max_columns: int = 40) -> List[Any]:
+    """Split a parsed semantic model into one chunk per table, further split
+    into slices of at most ``max_columns`` column entries. Each chunk keeps
+    the model-level keys (name, description) for context."""
+    if not isinstance(parsed, dict) or not isinstance(parsed.get("tables"), list):
+        return [parsed]
+    shared = {k: v for k, v in parsed.items() if k not in ("tables", "relationships", "verified_queries")}
+    chunks: List[Any] = []
+    for table in parsed["tables"]:
+        if not isinstance(table, dict):
+            continue
+        entries = [(k, item) for k in GLOSSARY_COLUMN_KEYS if isinstance(table.get(k), list) for item in table[k]]
+        if len(entries) <= max_columns:
+            chunks.append({**shared, "tables": [table]})
+            continue
+        base = {k: v for k, v in table.items() if k not in GLOSSARY_COLUMN_KEYS}
+        for start in range(0, len(entries), max_columns):
+            part = dict(base)
+            for k, item in entries[start:start + max_columns]:
+                part.setdefault(k, []).append(item)
+            chunks.append({**shared, "tables": [part]})
+    return chunks or [parsed]
+
+
+_PLAIN_IDENTIFIER_RE = re.compile(r'^\s*"?([A-Za-z_][A-Za-z0-9_$]*)"?\s*$')
+
+
+def annotate_semantic_model(conn, parsed: Any, cache: Optional[MetadataCache] = None) -> int:
+    """Fill in ``data_type`` and missing descriptions of semantic-model columns
+    from the column catalog of each table's ``base_table``.
+
+    Columns are matched by ``expr`` (when it is a plain column name) or
+    ``name``; one catalog query is made per schema. Returns the number of
+    annotated columns.
+    """
+    if not isinstance(parsed, dict) or not isinstance(parsed.get("tables"), list):
+        return 0
+    catalogs: Dict[tuple, Optional[ColumnCatalog]] = {}
+    annotated = 0
+    for table in parsed["tables"]:
+        base = table.get("base_table") if isinstance(table, dict) else None
+        if not isinstance(base, dict) or not all(base.get(k) for k in ("database", "schema", "table")):
+            continue
+        database, schema, name = (str(base[k]).upper() for k in ("database", "schema", "table"))
+        if (database, schema) not in catalogs:
+            try:
+                catalogs[(database, schema)] = get_column_catalog(conn, database, schema, cache)
+            except Exception:
+                # The glossary can still be written from the YAML alone.
+                catalogs[(database, schema)] = None
+        catalog = catalogs[(database, schema)]
+        columns = catalog.lookup(schema, name) if catalog is not None else None
+        if not columns:
+            continue
+        by_name = {str(c["name"]).upper(): c for c in columns}
+        for key in GLOSSARY_COLUMN_KEYS:
+            for item in table.get(key) or []:
+                if not isinstance(item, dict):
+                    continue
+                match = _PLAIN_IDENTIFIER_RE.match(str(item.get("expr") or item.get("name") or ""))
+                column = by_name.get(match.group(1).upper()) if match else None
+                if column is None:
+                    continue
+                item.setdefault("data_type", column["type"])
+                if column.get("comment") and not item.get("description"):
+                    item["description"] = column["comment"]
+                annotated += 1
+    return annotated
+
+
+def _glossary_messages(chunk: Any) -> List[Dict[str, str]]:
+    return [
+        {"role": "system", "content": "You write precise, unambiguous business glossaries."},
+        {"role": "user", "content": _GLOSSARY_PROMPT + yaml.dump(chunk, sort_keys=False)},
+    ]
+
+
+class JSONArrayItemParser:
+    """Incremental JSON parser that returns each object inside arrays named
+    in ``keys`` (at any depth) as soon as the object's closing brace arrives."""
+
+    def __init__(self, keys=("columns", "terms")):
+        self.keys = set(keys)
+        self.text = ""
+        self._pos = 0
+        self._stack: List[tuple] = []
+        self._in_string = False
+        self._escape = False
+        self._string_start = 0
+        self._last_string: Optional[str] = None
+        self._pending_key: Optional[str] = None
+        self._item_start: Optional[int] = None
+        self._item_depth = 0
+
+    def feed(self, delta: str) -> List[tuple]:
+        """Consume more text; return ``(key, object)`` pairs completed by it."""
+        self.text += delta
+        text = self.text
+        items = []
+        for pos in range(self._pos, len(text)):
+            ch = text[pos]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    self._last_string = text[self._string_start + 1:pos]
+            elif ch == '"':
+                self._in_string = True
+                self._string_start = pos
+            elif ch == ":":
+                self._pending_key = self._last_string
+            elif ch == ",":
+                self._pending_key = None
+            elif ch in "{[":
+                parent = self._stack[-1] if self._stack else None
+                in_array = parent is not None and parent[0] == "["
+                if ch == "{" and self._item_start is None and in_array and parent[1] in self.keys:
+                    self._item_start, self._item_depth = pos, len(self._stack)
+                self._stack.append((ch, parent[1] if in_array else self._pending_key))
+                self._pending_key = None
+            elif ch in "}]" and self._stack:
+                self._stack.pop()
+                if self._item_start is not None and len(self._stack) == self._item_depth:
+                    try:
+                        items.append((self._stack[-1][1], json.loads(text[self._item_start:pos + 1])))
+                    except Exception:
+                        pass
+                    self._item_start = None
+        self._pos = len(text)
+        return items
+
+
+_GLOSSARY_ITEM_KINDS = {"columns": "column", "terms": "term"}
+
+
+def _glossary_items(result: Any):
+    if not isinstance(result, dict):
+        return
+    columns = result.get("columns")
+    if columns is None and isinstance(result.get("business_glossary"), dict):
+        columns = result["business_glossary"].get("columns")
+    for item in columns or []:
+        if isinstance(item, dict):
+            yield "column", item
+    for item in result.get("terms") or []:
+        if isinstance(item, dict):
+            yield "term", item
+
+
+def _glossary_item_key(kind: str, item: Dict[str, Any]) -> tuple:
+    if kind == "column":
+        return kind, str(item.get("table") or "").lower(), str(item.get("column") or "").lower()
+    return kind, str(item.get("term") or item.get("name") or "").lower()
+
+
+def _is_retryable_llm_error(error: BaseException) -> bool:
+    """True for failures worth retrying: rate limits, timeouts, 5xx responses,
+    dropped connections and truncated JSON. Auth and request errors are final."""
+    status = getattr(error, "status_code", None)
+    if isinstance(status, int):
+        return status in (408, 409, 429) or status >= 500
+    if APIConnectionError is not None and isinstance(error, APIConnectionError):
+        return True
+    return isinstance(error, (asyncio.TimeoutError, ConnectionError, json.JSONDecodeError))
+
+
+async def _stream_glossary_chunks(
+    openai_api_key: str,
+    chunks: List[Any],
+    max_concurrency: int,
+    max_retries: int,
+    use_cache: bool,
+    emit: Callable[[str, int, Any], None],
+) -> None:
+    """Stream every chunk through the async client, calling ``emit(kind, chunk_index, payload)``
+    for each completed column or term, then ``done`` with the full result or ``error``."""
+    cache = get_llm_response_cache() if use_cache else None
+    client = None
+    semaphore = asyncio.Semaphore(max_concurrency)
+    options = {"response_format": {"type": "json_object"}}
+
+    async def run(index, chunk):
+        with get_tracer().span("openai.stream", template="business_glossary", chunk=index) as span:
+            await generate(index, chunk, span)
+
+    async def generate(index, chunk, span):
+        nonlocal client
+        messages = _glossary_messages(chunk)
+        key = _llm_cache_key("business_glossary", messages, "gpt-4o-mini", 0.2, options)
+        seen = set()
+
+        def publish(kind, item):
+            # A retried stream repeats rows that were already shown.
+            ident = _glossary_item_key(kind, item)
+            if ident not in seen:
+                seen.add(ident)
+                emit(kind, index, item)
+
+        if cache is not None:
+            cached = cache.get(key)
+            if cached is not None:
+                result = json.loads(cached)
+                for kind, item in _glossary_items(result):
+                    publish(kind, item)
+                emit("done", index, result)
+                return
+        if client is None:
+            client = _get_async_client(openai_api_key)
+        error = None
+        for attempt in range(max_retries + 1):
+            if attempt:
+                # Back off without holding a slot so other chunks keep running.
+                await asyncio.sleep(min(2 ** (attempt - 1), 30))
+            parser = JSONArrayItemParser(_GLOSSARY_ITEM_KINDS)
+            try:
+                async with semaphore:
+                    if _request_throttle is not None:
+                        await asyncio.to_thread(_request_throttle)
+                    stream = await client.chat.completions.create(
+                        model="gpt-4o-mini", messages=messages, temperature=0.2, stream=True,
+                        stream_options={"include_usage": True}, **options,
+                    )
+                    async for event in stream:
+                        _annotate_usage(span, getattr(event, "usage", None))
+                        delta = event.choices[0].delta.content if event.choices else None
+                        if delta:
+                            for array_key, item in parser.feed(delta):
+                                publish(_GLOSSARY_ITEM_KINDS[array_key], item)
+                result = json.loads(parser.text)
+                if cache is not None:
+                    cache.set(key, parser.text)
+                emit("done", index, result)
+                return
+            except Exception as e:
+                error = e
+                if not _is_retryable_llm_error(e):
+                    break
+        if span:
+            span["status"], span["error"] = "error", str(error)[:500]
+        emit("error", index, f"Error generating glossary chunk: {error}")
+
+    try:
+        await asyncio.gather(*(run(i, chunk) for i, chunk in enumerate(chunks)))
+    finally:
+        if client is not None:
+            await client.close()
+
+
+def merge_glossaries(results: List[Any]) -> Dict[str, Any]:
+    """Merge per-chunk glossary JSON into one ``{columns, terms}`` result;
+    terms with the same name are combined."""
+    columns: List[Any] = []
+    terms: Dict[str, Dict[str, Any]] = {}
+    for result in results:
+        if not isinstance(result, dict):
+            continue
+        chunk_columns = result.get("columns")
+        if chunk_columns is None and isinstance(result.get("business_glossary"), dict):
+            chunk_columns = result["business_glossary"].get("columns")
+        columns.extend(c for c in chunk_columns or [] if isinstance(c, dict))
+        for term in result.get("terms") or []:
+            if not isinstance(term, dict):
+                continue
+            name = str(term.get("term") or term.get("name") or "").strip().lower()
+            if name not in terms:
+                terms[name] = dict(term)
+                continue
+            merged = terms[name]
+            for key in ("related_columns", "tables"):
+                values = term.get(key)
+                if isinstance(values, list):
+                    existing = merged.get(key) if isinstance(merged.get(key), list) else []
+                    merged[key] = existing + [v for v in values if v not in existing]
+    return {"columns": columns, "terms": list(terms.values())}
+
+
+class GlossaryStore:
+    """Persistent per-table glossary entries keyed by a fingerprint of each
+    table's YAML definition, so unchanged tables never go back to the model."""
+
+    def __init__(self, path: Optional[str] = None):
+        self._cache = PersistentCache(path, namespace="glossary", max_entries=4096, max_disk_entries=200000)
+
+    @staticmethod
+    def fingerprint(table: Dict[str, Any]) -> str:
+        payload = json.dumps([PROMPT_TEMPLATE_VERSIONS["business_glossary"], table], sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, model: str, table: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        return self._cache.get(("entry", model, str(table.get("name", "")), self.fingerprint(table)))
+
+    def put(self, model: str, table: Dict[str, Any], glossary: Dict[str, Any]) -> None:
+        name = str(table.get("name", ""))
+        fingerprint = self.fingerprint(table)
+        self._cache.set(("entry", model, name, fingerprint), glossary)
+        self._cache.set(("latest", model, name), fingerprint)
+
+    def diff(self, parsed: Any) -> Dict[str, List[str]]:
+        """Classify the tables of a parsed semantic model as new, changed or unchanged."""
+        result: Dict[str, List[str]] = {"new": [], "changed": [], "unchanged": []}
+        if not isinstance(parsed, dict) or not isinstance(parsed.get("tables"), list):
+            return result
+        model = str(parsed.get("name", ""))
+        for table in parsed["tables"]:
+            if not isinstance(table, dict):
+                continue
+            name = str(table.get("name", ""))
+            if self.get(model, table) is not None:
+                result["unchanged"].append(name)
+            elif self._cache.get(("latest", model, name)) is not None:
+                result["changed"].append(name)
+            else:
+                result["new"].append(name)
+        return result
+
+    def clear(self) -> None:
+        self._cache.invalidate()
+
+
+_glossary_store = None
+_glossary_store_lock = threading.Lock()
+
+
+def get_glossary_store(path: Optional[str] = None) -> GlossaryStore:
+    global _glossary_store
+    with _glossary_store_lock:
+        if _glossary_store is None:
+            _glossary_store = GlossaryStore(path or os.path.join(_DEFAULT_CACHE_DIR, "glossary.sqlite"))
+        return _glossary_store
+
+
+@traced()
+def iter_business_glossary_events(
+    openai_api_key: str,
+    yaml_content: str,
+    use_cache: bool = True,
+    max_columns_per_chunk: int = 40,
+    max_concurrency: int = 4,
+    max_retries: int = 2,
+    incremental: bool = True,
+    store: Optional[GlossaryStore] = None,
+    conn=None,
+    metadata_cache: Optional[MetadataCache] = None,
+):
+    """Yield ``(kind, position, payload)`` glossary events as they become available.
+
+    ``column`` and ``term`` events carry one glossary row each; rows of tables
+    reused from the glossary store come first, then rows parsed out of the
+    streamed responses. ``error`` reports a chunk that failed after
+    ``max_retries`` (rows it already streamed are kept) and a final
+    ``summary`` lists reused and generated tables. ``position`` orders rows
+    by table and chunk.
+    """
+    parsed = yaml.safe_load(yaml_content)
+    if conn is not None:
+        annotate_semantic_model(conn, parsed, metadata_cache)
+    tables = parsed.get("tables") if isinstance(parsed, dict) else None
+    if isinstance(tables, list):
+        tables = [t for t in tables if isinstance(t, dict)]
+        units = [{**parsed, "tables": [t]} for t in tables]
+    else:
+        # Not a table-based semantic model: send it as is, without the store.
+        tables, units, incremental = [{}], [parsed], False
+    store = (store or get_glossary_store()) if incremental else None
+    model = str(parsed.get("name", "")) if isinstance(parsed, dict) else ""
+    pending = []
+    reused = []
+    for i, table in enumerate(tables):
+        entry = store.get(model, table) if store is not None else None
+        if entry is None:
+            pending.append(i)
+            continue
+        reused.append(str(table.get("name", "")))
+        for kind, item in _glossary_items(entry):
+            yield kind, (i, 0), item
+
+    errors: List[str] = []
+    generated = []
+    if pending:
+        chunks, owners = [], []
+        for i in pending:
+            table_chunks = split_semantic_model(units[i], max_columns_per_chunk)
+            chunks.extend(table_chunks)
+            owners.extend([i] * len(table_chunks))
+        events: "queue.Queue" = queue.Queue()
+
+        def work():
+            try:
+                asyncio.run(_stream_glossary_chunks(
+                    openai_api_key, chunks, max_concurrency, max_retries, use_cache,
+                    lambda kind, index, payload: events.put((kind, index, payload)),
+                ))
+            except Exception as e:
+                events.put(("fatal", None, e))
+            finally:
+                events.put(None)
+
+        # Run in a copy of this context so the streaming spans nest under the caller's.
+        threading.Thread(target=contextvars.copy_context().run, args=(work,), daemon=True).start()
+        expected = Counter(owners)
+        done: Dict[int, List[Any]] = {}
+        while True:
+            event = events.get()
+            if event is None:
+                break
+            kind, index, payload = event
+            if kind == "fatal":
+                raise payload
+            owner = owners[index]
+            if kind == "done":
+                done.setdefault(owner, []).append(payload)
+                if len(done[owner]) == expected[owner]:
+                    generated.append(str(tables[owner].get("name", "")))
+                    if store is not None:
+                        store.put(model, tables[owner], merge_glossaries(done[owner]))
+                continue
+            if kind == "error":
+                errors.append(payload)
+            yield kind, (owner, index), payload
+
+    yield "summary", None, {"reused_tables": reused, "generated_tables": generated, "errors": errors}
+
+
+@traced()
+def generate_business_glossary_from_yaml(
+    openai_api_key: str,
+    yaml_content: str,
+    use_cache: bool = True,
+    max_columns_per_chunk: int = 40,
+    max_concurrency: int = 4,
+    max_retries: int = 2,
+    incremental: bool = True,
+    store: Optional[GlossaryStore] = None,
+    on_event: Optional[Callable[[str, Any], None]] = None,
+    conn=None,
+    metadata_cache: Optional[MetadataCache] = None,
+) -> Dict[str, Any]:
+    """Generate a column glossary, one concurrent request per table (or per
+    slice of ``max_columns_per_chunk`` columns), merged into ``{columns, terms}``.
+
+    With ``incremental`` set, tables whose definition is unchanged since the
+    last run are taken from the glossary store and only new or changed tables
+    are sent. ``reused_tables`` and ``generated_tables`` report the split;
+    chunks that still fail after ``max_retries`` are listed under ``errors``.
+    ``on_event(kind, payload)`` sees every streamed event as it arrives.
+    With ``conn``, column data types and comments are first taken from
+    Snowflake (see ``annotate_semantic_model``).
+    """
+    rows: Dict[str, List[tuple]] = {"column": [], "term": []}
+    summary: Dict[str, Any] = {}
+    for kind, position, payload in iter_business_glossary_events(
+        openai_api_key, yaml_content, use_cache, max_columns_per_chunk, max_concurrency, max_retries, incremental, store,
+        conn, metadata_cache,
+    ):
+        if on_event is not None:
+            on_event(kind, payload)
+        if kind in rows:
+            rows[kind].append((position, len(rows[kind]), payload))
+        elif kind == "summary":
+            summary = payload
+    if not rows["column"] and not rows["term"] and summary.get("errors"):
+        raise Exception(summary["errors"][0])
+    merged = merge_glossaries([{
+        "columns": [item for _, _, item in sorted(rows["column"], key=lambda r: r[:2])],
+        "terms": [item for _, _, item in sorted(rows["term"], key=lambda r: r[:2])],
+    }])
+    merged["reused_tables"] = summary.get("reused_tables", [])
+    merged["generated_tables"] = summary.get("generated_tables", [])
+    if summary.get("errors"):
+        merged["errors"] = summary["errors"]
+    return merged
+
+
+LINEAGE_THEMES = {
+    "vibrant": {
+        "graph_bg": "white",
+        "edge": "#7A7A7A",
+        "node_border": "#333333",
+        "source_fill": "#A7E3FF",
+        "transform_fill": "#FFD59E",
+        "table_fill": "#BBDEFB",
+        "view_fill": "#D1C4E9",
+        "stage_fill": "#ECEFF1",
+        "target_border": "#E53935",
+        "target_fill": "#FFCDD2",
+    },
+    "muted": {
+        "graph_bg": "white",
+        "edge": "#8E8E8E",
+        "node_border": "#6D6D6D",
+        "source_fill": "#CFE8FF",
+        "transform_fill": "#FFE9C6",
+        "table_fill": "#E6F0FA",
+        "view_fill": "#E8DDF0",
+        "stage_fill": "#F2F4F7",
+        "target_border": "#C62828",
+        "target_fill": "#FFEBEE",
+    },
+    "monochrome": {
+        "graph_bg": "white",
+        "edge": "#555555",
+        "node_border": "#333333",
+        "source_fill": "#DDDDDD",
+        "transform_fill": "#BBBBBB",
+        "table_fill": "#EEEEEE",
+        "view_fill": "#CCCCCC",
+        "stage_fill": "#F5F5F5",
+        "target_border": "#111111",
+        "target_fill": "#FFFFFF",
+    },
+}
+
+# node kind -> (shape, palette fill key)
+_LINEAGE_NODE_STYLES = {
+    "source": ("cylinder", "source_fill"),
+    "stage": ("cylinder", "source_fill"),
+    "file": ("cylinder", "source_fill"),
+    "cte": ("box3d", "transform_fill"),
+    "procedure": ("box3d", "transform_fill"),
+    "task": ("box3d", "transform_fill"),
+    "table": ("box", "table_fill"),
+    "view": ("component", "view_fill"),
+    "temp": ("folder", "stage_fill"),
+    "summary": ("tab", "table_fill"),
+}
+
+# level of detail -> number of name parts kept when summarizing
+LINEAGE_DETAIL_LEVELS = {"object": None, "schema": 2, "database": 1}
+
+
+def _dot_quote(text: str) -> str:
+    return '"' + str(text).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+
+
+def render_lineage_dot(
+    graph: LineageGraph,
+    target: Optional[str] = None,
+    theme: str = "vibrant",
+    detail_level: str = "high",
+    show_edge_labels: bool = True,
+    show_node_tooltips: bool = True,
+    labels: Optional[Dict[str, str]] = None,
+    tooltips: Optional[Dict[str, str]] = None,
+    edge_labels: Optional[Dict[tuple, str]] = None,
+) -> str:
+    """Render a ``LineageGraph`` as styled Graphviz DOT, clustered by database.schema."""
+    palette = LINEAGE_THEMES.get((theme or "vibrant").lower(), LINEAGE_THEMES["vibrant"])
+    labels, tooltips, edge_labels = labels or {}, tooltips or {}, edge_labels or {}
+    detail = (detail_level or "high").lower()
+    target_name = graph.find(target) if target else None
+
+    lines = [
+        "digraph lineage {",
+        f"  graph [bgcolor=\"{palette['graph_bg']}\", rankdir=LR];",
+        f"  edge [color=\"{palette['edge']}\", arrowsize=0.7, penwidth=1];",
+        f"  node [style=filled, color=\"{palette['node_border']}\", fontname=\"Helvetica\", fontsize=10];",
+    ]
+    clusters: Dict[str, List[str]] = {}
+    for name in sorted(graph.nodes):
+        node = graph.nodes[name]
+        shape, fill = _LINEAGE_NODE_STYLES.get(node["kind"], ("box", "table_fill"))
+        object_name = name.split("::")[0]
+        parts = object_name.split(".")
+        if name in labels:
+            label = labels[name]
+        elif node["kind"] == "cte":
+            label = name.split("::")[-1]
+        elif detail == "low":
+            label = parts[-1]
+        else:
+            label = name
+        if detail == "high" and node["notes"] and name not in labels:
+            label += "\n" + "\n".join(node["notes"][:3])
+        attrs = [f"label={_dot_quote(label)}", f"shape={shape}", f"fillcolor=\"{palette[fill]}\""]
+        if name == target_name:
+            attrs = [f"label={_dot_quote(label)}", f"shape={shape}", "penwidth=3",
+                     f"color=\"{palette['target_border']}\"", f"fillcolor=\"{palette['target_fill']}\""]
+        if show_node_tooltips:
+            tooltip = tooltips.get(name) or "\n".join([f"{node['kind']}: {name}"] + node["notes"] + [f"file: {f}" for f in node["files"]])
+            attrs.append(f"tooltip={_dot_quote(tooltip)}")
+        if node["kind"] == "summary":
+            cluster = parts[0] if len(parts) == 2 else ""
+        else:
+            cluster = ".".join(parts[:2]) if len(parts) == 3 and node["kind"] not in ("stage", "file") else ""
+        clusters.setdefault(cluster, []).append(f"{_dot_quote(name)} [{', '.join(attrs)}];")
+
+    for i, (cluster, statements) in enumerate(sorted(clusters.items())):
+        if cluster:
+            lines.append(f"  subgraph cluster_{i} {{")
+            lines.append(f"    label={_dot_quote(cluster)}; style=rounded; color=\"{palette['node_border']}\";")
+            lines.extend("    " + s for s in statements)
+            lines.append("  }")
+        else:
+            lines.extend("  " + s for s in statements)
+
+    for edge in graph.edges:
+        attrs = []
+        if show_edge_labels:
+            label = edge_labels.get((edge.source, edge.target))
+            if label is None:
+                label = edge.operation
+                if edge.detail and detail != "low":
+                    label += "\n" + edge.detail
+            attrs.append(f"label={_dot_quote(label)}")
+        if show_node_tooltips and edge.file:
+            attrs.append(f"tooltip={_dot_quote(edge.file)}")
+        suffix = f" [{', '.join(attrs)}]" if attrs else ""
+        lines.append(f"  {_dot_quote(edge.source)} -> {_dot_quote(edge.target)}{suffix};")
+    lines.append("}")
+    return "\n".join(lines)
+
+
+def apply_lineage_level_of_detail(
+    graph: LineageGraph,
+    level_of_detail: str = "auto",
+    max_nodes: int = 300,
+    expand: Optional[List[str]] = None,
+) -> LineageGraph:
+    """Collapse a graph to schema or database summary nodes.
+
+    ``auto`` picks the finest level that fits in ``max_nodes``; prefixes in
+    ``expand`` (e.g. the target's schema) are never collapsed.
+    """
+    expand = tuple(expand or ())
+    if level_of_detail == "auto":
+        candidate = graph
+        for level in (2, 1):
+            if len(candidate.nodes) <= max_nodes:
+                break
+            candidate = graph.summarize(level, expand)
+        return candidate
+    level = LINEAGE_DETAIL_LEVELS.get(level_of_detail)
+    return graph if level is None else graph.summarize(level, expand)
+
+
+_lineage_svg_cache = None
+_lineage_svg_cache_lock = threading.Lock()
+
+
+def get_lineage_svg_cache(path: Optional[str] = None) -> PersistentCache:
+    global _lineage_svg_cache
+    with _lineage_svg_cache_lock:
+        if _lineage_svg_cache is None:
+            _lineage_svg_cache = PersistentCache(
+                path or os.path.join(_DEFAULT_CACHE_DIR, "lineage_svg.sqlite"),
+                namespace="lineage_svg",
+                max_entries=16,
+                max_disk_entries=256,
+            )
+        return _lineage_svg_cache
+
+
+@traced()
+def layout_lineage_svg(dot_text: str, engine: str = "dot", cache: Optional[PersistentCache] = None) -> Optional[str]:
+    """Lay out DOT to SVG server-side, cached by a hash of the DOT text.
+
+    Returns None when the Graphviz binaries are not installed so callers can
+    fall back to rendering the DOT in the browser.
+    """
+    if graphviz is None:
+        return None
+    cache = cache if cache is not None else get_lineage_svg_cache()
+    key = (engine, hashlib.sha256(dot_text.encode("utf-8")).hexdigest())
+    svg = cache.get(key)
+    if svg is not None:
+        return svg
+    try:
+        svg = graphviz.Source(dot_text, engine=engine).pipe(format="svg", encoding="utf-8")
+    except graphviz.ExecutableNotFound:
+        return None
+    except Exception as e:
+        raise Exception(f"Error laying out lineage diagram: {e}")
+    cache.set(key, svg)
+    return svg
+
+
+LINEAGE_ENRICH_MAX_NODES = 200
+
+# Parsed uploads are kept per process so Streamlit reruns skip decoding and
+# parsing. Entries are charged at their upload size times a rough in-memory
+# expansion factor (an edge table is about as large as its CSV text).
+UPLOAD_CACHE_MAX_BYTES = 512 * 1024 * 1024
+UPLOAD_PREVIEW_CHARS = 200_000
+UPLOAD_PREVIEW_ROWS = 1000
+_UPLOAD_EXPANSION = {"yaml": 6, "edge_table": 1, "code": 2, "code_units": 2}
+
+_upload_cache = None
+_upload_cache_lock = threading.Lock()
+
+
+def get_upload_cache(max_bytes: Optional[int] = None) -> PersistentCache:
+    global _upload_cache
+    with _upload_cache_lock:
+        if _upload_cache is None:
+            _upload_cache = PersistentCache(
+                None, namespace="uploads", max_entries=256, max_bytes=max_bytes or UPLOAD_CACHE_MAX_BYTES
+            )
+        return _upload_cache
+
+
+def _memoize_upload(kind: str, data: bytes, parse: Callable[[], Any], cache: Optional[PersistentCache] = None, extra: str = "") -> Any:
+    """Return ``parse()`` for ``data``, computed once per content hash."""
+    cache = cache if cache is not None else get_upload_cache()
+    key = (kind, hashlib.sha256(data).hexdigest(), extra)
+    value = cache.get(key, default=_MISSING)
+    if value is _MISSING:
+        value = parse()
+        cache.set(key, value, size=len(data) * _UPLOAD_EXPANSION.get(kind, 4))
+    return value
+
+
+def parse_yaml_upload(data: bytes, cache: Optional[PersistentCache] = None) -> Dict[str, Any]:
+    """Decode and parse an uploaded YAML file into ``{content, parsed, preview, truncated}``.
+
+    The preview is the re-dumped YAML cut to ``UPLOAD_PREVIEW_CHARS``.
+    Results are shared, so callers must not modify them.
+    """
+    def parse():
+        content = data.decode("utf-8")
+        # libyaml's loader and dumper are several times faster when available.
+        parsed = yaml.load(content, Loader=getattr(yaml, "CSafeLoader", yaml.SafeLoader))
+        preview = yaml.dump(parsed, Dumper=getattr(yaml, "CSafeDumper", yaml.SafeDumper), sort_keys=False)
+        return {
+            "content": content,
+            "parsed": parsed,
+            "preview": preview[:UPLOAD_PREVIEW_CHARS],
+            "truncated": len(preview) > UPLOAD_PREVIEW_CHARS,
+        }
+
+    return _memoize_upload("yaml", data, parse, cache)
+
+
+def parse_lineage_csv_upload(data: bytes, cache: Optional[PersistentCache] = None) -> "EdgeTable":
+    """Stream an uploaded lineage CSV into an ``EdgeTable``. The table is
+    shared between reruns, so callers must not add edges to it."""
+    return _memoize_upload("edge_table", data, lambda: EdgeTable.from_csv(io.TextIOWrapper(io.BytesIO(data), encoding="utf-8", newline="")), cache)
+
+
+def decode_code_upload(name: str, data: bytes, cache: Optional[PersistentCache] = None) -> Dict[str, str]:
+    """Decode an uploaded code file into a ``{name, content}`` blob."""
+    return _memoize_upload("code", data, lambda: {"name": name, "content": data.decode("utf-8", errors="replace")}, cache, name)
+
+
+_PY_NOISE_RE = re.compile(r'"""[\s\S]*?"""|\'\'\'[\s\S]*?\'\'\'|"(?:[^"\\\n]|\\.)*"|\'(?:[^\'\\\n]|\\.)*\'|#[^\n]*')
+_C_LIKE_NOISE_RE = re.compile(r'"(?:[^"\\\n]|\\.)*"|//[^\n]*|/\*[\s\S]*?\*/')
+_token_encoding = None
+
+
+def count_tokens(text: str) -> int:
+    """Token count for gpt-4o-mini via tiktoken, or a 4-characters-per-token estimate without it."""
+    global _token_encoding
+    if tiktoken is not None:
+        try:
+            if _token_encoding is None:
+                _token_encoding = tiktoken.get_encoding("o200k_base")
+            return len(_token_encoding.encode(text, disallowed_special=()))
+        except Exception:
+            pass
+    return (len(text) + 3) // 4
+
+
+def _compact_sql(statement: str) -> str:
+    parts = []
+    pos = 0
+    for match in _SQL_NOISE_RE.finditer(statement):
+        parts.append(" ".join(statement[pos:match.start()].split()))
+        token = match.group()
+        if token.startswith("'"):
+            parts.append(token)
+        elif token.startswith("$$"):
+            # Procedure bodies may be JavaScript or Python; only drop whole-line SQL comments and blank lines.
+            body = [line.rstrip() for line in token[2:-2].splitlines() if line.strip() and not line.strip().startswith("--")]
+            parts.append("$$\n" + "\n".join(body) + "\n$$")
+        pos = match.end()
+    parts.append(" ".join(statement[pos:].split()))
+    return " ".join(p for p in parts if p).strip()
+
+
+def _compact_code_units(name: str, content: str) -> List[str]:
+    lname = name.lower()
+    if lname.endswith(".sql"):
+        return [unit for unit in (_compact_sql(st) for st in iter_sql_statements(content)) if unit]
+    noise = _PY_NOISE_RE if lname.endswith(".py") else _C_LIKE_NOISE_RE
+    stripped = noise.sub(lambda m: "" if m.group()[:1] in "#/" else m.group(), content)
+    lines = [line.rstrip() for line in stripped.splitlines() if line.strip()]
+    return ["\n".join(lines)] if lines else []
+
+
+def _count_code_units(name: str, content: str) -> tuple:
+    units = []
+    for unit in _compact_code_units(name, content):
+        digest = hashlib.sha256(" ".join(unit.split()).lower().encode("utf-8")).hexdigest()
+        units.append((unit, digest, count_tokens(unit)))
+    return count_tokens(content), units
+
+
+def build_code_context(
+    code_blobs: List[Dict[str, str]],
+    token_budget: int = 8000,
+    graph: Optional[LineageGraph] = None,
+    target: Optional[str] = None,
+) -> tuple:
+    """Compact code blobs into a prompt section that fits ``token_budget``.
+
+    Comments and redundant whitespace are removed, SQL is split into
+    statements and duplicate files or statements are dropped. Units are
+    ranked by how many objects of ``graph`` they mention (the ``target``
+    counts most) and added until the budget is spent. Returns the text and a
+    report of tokens used and what was left out.
+    """
+    units = []
+    seen = set()
+    duplicates = 0
+    tokens_before = 0
+    for blob in code_blobs or []:
+        name = blob.get("name", "unknown")
+        content = blob.get("content", "")
+        total, file_units = _memoize_upload("code_units", content.encode("utf-8"), lambda: _count_code_units(name, content), extra=name)
+        tokens_before += total
+        for unit, digest, tokens in file_units:
+            if digest in seen:
+                duplicates += 1
+                continue
+            seen.add(digest)
+            units.append({"file": name, "order": len(units), "text": unit, "tokens": tokens})
+
+    weights: Dict[str, int] = {}
+    for node in (graph.nodes if graph is not None else ()):
+        short = node.split("::")[0].split(".")[-1]
+        if len(short) > 2:
+            weights[short.upper()] = 1
+    if target:
+        weights[target.split(".")[-1].strip('"').upper()] = 5
+    if weights:
+        names_re = re.compile(r"\b(" + "|".join(re.escape(w) for w in sorted(weights, key=len, reverse=True)) + r")\b", re.I)
+        for unit in units:
+            unit["score"] = sum(weights[w.upper()] for w in set(m.upper() for m in names_re.findall(unit["text"])))
+    else:
+        for unit in units:
+            unit["score"] = 0
+
+    used = 0
+    included, omitted = [], []
+    for unit in sorted(units, key=lambda u: (-u["score"], u["order"])):
+        if used + unit["tokens"] <= token_budget:
+            used += unit["tokens"]
+            included.append(unit)
+        else:
+            omitted.append({"file": unit["file"], "tokens": unit["tokens"], "score": unit["score"], "preview": unit["text"][:80]})
+
+    sections: Dict[str, List[str]] = {}
+    for unit in sorted(included, key=lambda u: u["order"]):
+        sections.setdefault(unit["file"], []).append(unit["text"])
+    text = "\n\n".join(f"FILE: {name}\n" + "\n".join(parts) for name, parts in sections.items())
+    report = {
+        "token_budget": token_budget,
+        "tokens_before": tokens_before,
+        "tokens_used": used,
+        "units_included": len(included),
+        "duplicates_dropped": duplicates,
+        "omitted": omitted,
+        "tokenizer": "tiktoken" if tiktoken is not None else "estimate",
+    }
+    return text, report
+
+
+def _lineage_enrichment(
+    openai_api_key: Optional[str],
+    graph: LineageGraph,
+    code_blobs: List[Dict[str, str]],
+    additional_instructions: str,
+    include_column_lineage: bool,
+    include_sql_snippets: bool,
+    snippet_max_chars: int,
+    use_cache: bool = True,
+    target: Optional[str] = None,
+    code_token_budget: int = 8000,
+    on_prompt_report: Optional[Callable[[Dict[str, Any]], None]] = None,
+) -> Dict[str, Any]:
+    # Only the best-connected nodes are worth labelling; the rest keep their local labels.
+    degree = Counter(n for e in graph.edges for n in (e.source, e.target))
+    names = set(heapq.nlargest(LINEAGE_ENRICH_MAX_NODES, graph.nodes, key=lambda n: degree.get(n, 0)))
+    graph_json = {
+        "nodes": [{"name": n, "kind": v["kind"], "notes": v["notes"]} for n, v in graph.nodes.items() if n in names],
+        "edges": [
+            {"source": e.source, "target": e.target, "operation": e.operation, "detail": e.detail}
+            for e in graph.edges if e.source in names and e.target in names
+        ],
+    }
+    code_section, report = build_code_context(code_blobs, code_token_budget, graph, target)
+    if on_prompt_report is not None:
+        on_prompt_report(report)
+    asks = ["- Short, readable business labels for nodes (max 40 chars).", "- Node tooltips summarizing key transformations."]
+    if include_column_lineage:
+        asks.append("- Edge labels with key column mappings (colA->colB) when clear.")
+    if include_sql_snippets:
+        asks.append(f"- Include concise SQL excerpts in tooltips, each <= {snippet_max_chars} chars.")
+    prompt = (
+        "The lineage graph below was extracted from the pipeline code. Do not add or remove nodes or edges. "
+        "Return JSON with keys 'nodes' (list of {name, label, tooltip}) and 'edges' (list of {source, target, label}).\n"
+        + "\n".join(asks) + "\n\n"
+        + "GRAPH:\n" + json.dumps(graph_json) + "\n\n"
+        + ("PIPELINE CODE:\n" + code_section + "\n\n" if code_section else "")
+        + ("ADDITIONAL INSTRUCTIONS:\n" + additional_instructions + "\n" if additional_instructions else "")
+    )
+    messages = [
+        {"role": "system", "content": "You are an expert data engineer. Output only JSON."},
+        {"role": "user", "content": prompt},
+    ]
+    ai_text = _cached_chat_completion(
+        openai_api_key, "lineage_enrichment", messages, temperature=0.1, use_cache=use_cache,
+        is_valid=_is_json, response_format={"type": "json_object"},
+    )
+    return json.loads(ai_text or "{}")
+
+
+@traced()
+def generate_lineage_dot(
+    openai_api_key: Optional[str],
+    lineage_rows: Union[List[dict], "EdgeTable", None],
+    code_blobs: List[Dict[str, str]],
+    additional_instructions: str = "",
+    target: Optional[str] = None,
+    max_hops: int = 2,
+    theme: str = "vibrant",
+    detail_level: str = "high",
+    include_sql_snippets: bool = False,
+    snippet_max_chars: int = 180,
+    show_edge_labels: bool = True,
+    show_node_tooltips: bool = True,
+    include_ctes: bool = True,
+    include_column_lineage: bool = True,
+    include_file_and_stage_sources: bool = True,
+    use_llm: bool = False,
+    level_of_detail: str = "auto",
+    max_nodes: int = 300,
+    expand: Optional[List[str]] = None,
+    use_cache: bool = True,
+    code_token_budget: int = 8000,
+    on_prompt_report: Optional[Callable[[Dict[str, Any]], None]] = None,
+    on_warning: Optional[Callable[[str], None]] = None,
+    on_graph: Optional[Callable[["LineageGraph"], None]] = None,
+) -> str:
+    """Build the lineage graph locally and render it as DOT.
+
+    The model is only consulted when ``use_llm`` is set, and then only to
+    enrich labels and tooltips of the locally extracted graph. Large graphs
+    are collapsed to schema or database summaries per ``level_of_detail``.
+    Failed enrichment calls raise; a response that is not valid JSON is
+    reported through ``on_warning`` and the diagram is returned unlabeled.
+    ``on_graph`` receives the graph exactly as rendered.
+    """
+    collapse = ([] if include_ctes else ["cte"]) + ([] if include_file_and_stage_sources else ["stage", "file"])
+    graph = build_lineage_graph(code_blobs, lineage_rows, target=target, max_hops=max_hops, collapse=collapse)
+    expand = list(expand or [])
+    target_name = graph.find(target) if target else None
+    if target_name:
+        expand.append(".".join(target_name.split("::")[0].split(".")[:2]))
+    graph = apply_lineage_level_of_detail(graph, level_of_detail, max_nodes, expand)
+    if on_graph is not None:
+        on_graph(graph)
+
+    labels: Dict[str, str] = {}
+    tooltips: Dict[str, str] = {}
+    edge_labels: Dict[tuple, str] = {}
+    if use_llm and graph.nodes:
+        if not openai_api_key:
+            raise OpenAIClientNotConfigured("OpenAI API key is required")
+        try:
+            enrichment = _lineage_enrichment(
+                openai_api_key, graph, code_blobs, additional_instructions,
+                include_column_lineage, include_sql_snippets, snippet_max_chars, use_cache,
+                target, code_token_budget, on_prompt_report,
+            )
+        except json.JSONDecodeError as e:
+            # The diagram is still valid without labels; tell the caller why they are missing.
+            enrichment = {}
+            if on_warning is not None:
+                on_warning(f"OpenAI returned invalid JSON, so labels and tooltips were not added: {e}")
+        except OpenAIClientNotConfigured:
+            raise
+        except Exception as e:
+            raise Exception(f"Error enriching lineage diagram: {e}")
+        if not isinstance(enrichment, dict):
+            enrichment = {}
+        for item in enrichment.get("nodes") or []:
+            if isinstance(item, dict) and item.get("name") in graph.nodes:
+                if item.get("label"):
+                    labels[item["name"]] = str(item["label"])
+                if item.get("tooltip"):
+                    tooltips[item["name"]] = str(item["tooltip"])
+        for item in enrichment.get("edges") or []:
+            if isinstance(item, dict) and item.get("label"):
+                edge_labels[(item.get("source"), item.get("target"))] = str(item["label"])
+
+    return render_lineage_dot(
+        graph,
+        target=target,
+        theme=theme,
+        detail_level=detail_level,
+        show_edge_labels=show_edge_labels,
+        show_node_tooltips=show_node_tooltips,
+        labels=labels,
+        tooltips=tooltips,
+        edge_labels=edge_labels,
+    )
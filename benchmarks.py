@@ -0,0 +1,564 @@
+import argparse
+import io
+import json
+import os
+import random
+import re
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import quote, unquote, urlparse
+
+# Keep benchmark caches away from the user's cache directory.
+os.environ.setdefault("SNFL_CACHE_DIR", tempfile.mkdtemp(prefix="snfl_bench_"))
+
+import backend  # noqa: E402
+from backend import iter_sql_statements, split_sql_statements  # noqa: E402
+
+try:
+    import sqlparse
+except Exception:  # pragma: no cover
+    sqlparse = None  # type: ignore
+
+
+SETUP_SQL = "setup.sql"
+
+_COMMENT_RE = re.compile(r"'(?:[^'\\]|\\.)*'|\$\$.*?\$\$|--[^\n]*|/\*.*?\*/", re.S)
+
+
+def _normalize_statement(stmt):
+    # Comments are dropped and whitespace collapsed so both splitters can be
+    # compared regardless of where they attach surrounding comments.
+    text = _COMMENT_RE.sub(lambda m: m.group() if m.group()[0] in "'$" else " ", stmt)
+    return " ".join(text.split()).rstrip(";").strip()
+
+
+def _normalized(statements):
+    return [n for n in (_normalize_statement(s) for s in statements) if n]
+
+
+def synthetic_sql_script(target_bytes, seed=7):
+    rng = random.Random(seed)
+    parts = []
+    size = 0
+    n = 0
+    while size < target_bytes:
+        n += 1
+        kind = rng.randrange(5)
+        if kind == 0:
+            stmt = (
+                f"-- table {n}; with a semicolon in the comment\n"
+                f"CREATE OR REPLACE TABLE db.sch.t{n} (id NUMBER, note VARCHAR DEFAULT 'a;b''c');\n"
+            )
+        elif kind == 1:
+            stmt = (
+                f"/* view {n};\n   multi-line comment */\n"
+                f"CREATE OR REPLACE VIEW db.sch.v{n} AS SELECT \"odd;col\", id FROM db.sch.t{max(1, n - 1)} "
+                f"WHERE note <> 'x;y';\n"
+            )
+        elif kind == 2:
+            body = "\n".join(f"    INSERT INTO db.sch.t{n} SELECT {i};" for i in range(rng.randrange(2, 8)))
+            stmt = (
+                f"CREATE OR REPLACE PROCEDURE db.sch.sp_build_{n}()\nRETURNS STRING\nLANGUAGE SQL\nAS $$\nBEGIN\n"
+                f"{body}\n    RETURN 'done; ok';\nEND;\n$$;\n"
+            )
+        elif kind == 3:
+            stmt = f"COPY INTO db.sch.t{n} FROM @db.sch.stage/path/{n}/;\n"
+        else:
+            stmt = f"GRANT SELECT ON TABLE db.sch.t{n} TO ROLE analyst;\n"
+        parts.append(stmt)
+        size += len(stmt)
+    return "".join(parts)
+
+
+def check_sql_splitter(sql_text, label):
+    streamed = list(iter_sql_statements(io.StringIO(sql_text), chunk_size=4096))
+    whole = split_sql_statements(sql_text)
+    if streamed != whole:
+        raise AssertionError(f"{label}: chunked and in-memory splits differ")
+    if sqlparse is None:
+        raise SystemExit("The splitter reference check needs sqlparse: pip install -r requirements-dev.txt")
+    expected = _normalized(sqlparse.split(sql_text))
+    actual = _normalized(whole)
+    if expected != actual:
+        for i, (a, b) in enumerate(zip(expected, actual)):
+            if a != b:
+                raise AssertionError(f"{label}: statement {i} differs\nsqlparse: {a[:200]}\nsplitter: {b[:200]}")
+        raise AssertionError(f"{label}: {len(expected)} statements from sqlparse, {len(actual)} from splitter")
+    print(f"{label}: {len(actual)} statements match sqlparse")
+
+
+def _measure(fn):
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def bench_sql_splitter(sizes_mb=(1,)):
+    cases = [(SETUP_SQL, open(SETUP_SQL, encoding="utf-8").read())]
+    cases += [(f"synthetic {mb} MB", synthetic_sql_script(mb * 1024 * 1024)) for mb in sizes_mb]
+    for label, text in cases:
+        check_sql_splitter(text, label)
+        count, elapsed, peak = _measure(lambda: sum(1 for _ in iter_sql_statements(io.StringIO(text))))
+        print(f"  splitter  {elapsed * 1000:9.1f} ms  peak {peak / 1e6:7.2f} MB  {count} statements")
+        count, elapsed, peak = _measure(lambda: len(sqlparse.split(text)))
+        print(f"  sqlparse  {elapsed * 1000:9.1f} ms  peak {peak / 1e6:7.2f} MB  {count} statements")
+
+
+# ---------------------------------------------------------------------------
+# Offline stand-ins: a replaying Snowflake connector, a presigned-URL file
+# server and an OpenAI-compatible chat completions stub.
+# ---------------------------------------------------------------------------
+
+_OBJECT_COLUMNS = ["created_on", "name", "database_name", "schema_name"]
+_SHOW_LIMIT = 10000
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.connection = conn
+        self.description = None
+        self.rowcount = 0
+        self.sfqid = None
+        self._rows = []
+
+    def execute(self, sql, params=None):
+        conn = self.connection
+        with conn.lock:
+            conn.queries += 1
+            self.sfqid = f"fake-{conn.queries}"
+        if conn.latency:
+            time.sleep(conn.latency)
+        columns, rows = conn.respond(sql, params)
+        self.description = [(c,) for c in columns]
+        self._rows = list(rows)
+        self.rowcount = len(self._rows)
+        return self
+
+    def fetchall(self):
+        rows, self._rows = self._rows, []
+        return rows
+
+    def fetchone(self):
+        return self._rows.pop(0) if self._rows else None
+
+    def fetchmany(self, size=1000):
+        rows, self._rows = self._rows[:size], self._rows[size:]
+        return rows
+
+    def close(self):
+        pass
+
+
+class FakeSnowflakeConnection:
+    """Connector stand-in that answers the SHOW, LIST, INFORMATION_SCHEMA and
+    GET_PRESIGNED_URL queries issued by backend.py from a synthetic account.
+
+    ``latency`` seconds are slept per query (the GIL is released, like a
+    network round trip). ``recordings`` maps exact SQL text to
+    ``{"columns": [...], "rows": [...]}`` and is replayed before the
+    synthetic answers; SHOW results are truncated at 10,000 rows like the
+    real service.
+    """
+
+    def __init__(self, databases=4, schemas=8, objects=200, files=1000, file_size=65536, latency=0.0,
+                 file_server_url="http://127.0.0.1:9", recordings=None):
+        self.account = "bench"
+        self.role = "BENCH"
+        self.databases = [f"DB{i}" for i in range(databases)]
+        self.schemas = [f"S{i}" for i in range(schemas)]
+        self.objects = objects
+        self.files = files
+        self.file_size = file_size
+        self.latency = latency
+        self.file_server_url = file_server_url.rstrip("/")
+        self.recordings = recordings or {}
+        self.queries = 0
+        self.lock = threading.Lock()
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def is_closed(self):
+        return False
+
+    def close(self):
+        pass
+
+    def _scope(self, scope):
+        # "ACCOUNT", "DATABASE DB0" or "DB0.S1" -> [(database, schema)]
+        scope = scope.strip().upper()
+        if scope == "ACCOUNT":
+            return [(d, s) for d in self.databases for s in self.schemas]
+        if scope.startswith("DATABASE "):
+            return [(scope.split()[1], s) for s in self.schemas]
+        database, schema = scope.split(".")[:2]
+        return [(database, schema)]
+
+    def _objects(self, kind, scope):
+        prefix = {"TABLES": "T", "VIEWS": "V"}.get(kind, kind[:3])
+        count = self.objects if kind in ("TABLES", "VIEWS") else max(1, self.objects // 20)
+        rows = [(0, f"{prefix}_{i}", d, s) for d, s in self._scope(scope) for i in range(count)]
+        return _OBJECT_COLUMNS, rows[:_SHOW_LIMIT]
+
+    def url(self, stage, name):
+        return f"{self.file_server_url}/{quote(stage.lstrip('@'))}/{quote(name)}?size={self.file_size}"
+
+    def respond(self, sql, params):
+        recorded = self.recordings.get(sql)
+        if recorded is not None:
+            return recorded["columns"], [tuple(r) for r in recorded["rows"]]
+        text = " ".join(sql.split())
+        upper = text.upper()
+        if upper == "SHOW DATABASES":
+            return ["created_on", "name"], [(0, d) for d in self.databases]
+        m = re.match(r"SHOW SCHEMAS IN (ACCOUNT|DATABASE \w+)$", upper)
+        if m:
+            return ["created_on", "name", "database_name"], [(0, s, d) for d, s in dict.fromkeys(self._scope(m.group(1)))]
+        m = re.match(r"SHOW STAGES IN DATABASE (\w+)$", upper)
+        if m:
+            return _OBJECT_COLUMNS, [(0, "STG", m.group(1), s) for s in self.schemas]
+        m = re.match(r"SHOW ([A-Z ]+?) IN (ACCOUNT|DATABASE \w+|\w+\.\w+)$", upper)
+        if m and m.group(1) != "COLUMNS":
+            return self._objects(m.group(1), m.group(2))
+        if upper.startswith("LIST @"):
+            return ["name", "size", "md5", "last_modified"], [
+                (f"stage/file_{i:06d}.csv", self.file_size, f"{i:032x}", "Mon, 1 Jan 2024 00:00:00 GMT")
+                for i in range(self.files)
+            ]
+        if "GET_PRESIGNED_URL" in upper:
+            if "FROM VALUES" in upper:
+                stage = params[0]
+                return ["column1", "url"], [(name, self.url(stage, name)) for name in params[2:]]
+            return ["url"], [(self.url(params[0], params[1]),)]
+        if "INFORMATION_SCHEMA.TABLES" in upper and "GROUP BY" in upper:
+            return ["table_schema", "last_altered"], [(s, 1.7e9) for s in self.schemas]
+        if "INFORMATION_SCHEMA.COLUMNS" in upper:
+            database = re.search(r"FROM (\w+)\.INFORMATION_SCHEMA", upper).group(1)
+            schemas = list(params) if params else self.schemas
+            return list(backend._COLUMN_CATALOG_FIELDS), [
+                (s, f"T_{i}", "BASE TABLE", f"C{c}", "NUMBER", "YES", None, None, None, 38, 0, None)
+                for s in schemas for i in range(self.objects) for c in range(8)
+            ] if database in self.databases else []
+        return ["status"], [("Statement executed successfully.",)]
+
+
+def load_recordings(path):
+    """Load ``{sql: {"columns": [...], "rows": [...]}}`` result sets to replay."""
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+class _QuietHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+class _FileHandler(_QuietHandler):
+    # Serves deterministic bytes of the size given in the query string, with Range support.
+    def do_GET(self):
+        url = urlparse(self.path)
+        size = int(dict(p.split("=", 1) for p in url.query.split("&") if "=" in p).get("size", 65536))
+        seed = unquote(url.path).encode("utf-8")
+        start, end = 0, size - 1
+        m = re.match(r"bytes=(\d+)-(\d*)", self.headers.get("Range", ""))
+        if m:
+            start = int(m.group(1))
+            end = min(end, int(m.group(2))) if m.group(2) else end
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        else:
+            self.send_response(200)
+        self.send_header("Content-Length", str(max(0, end - start + 1)))
+        self.end_headers()
+        line = (seed + b",0123456789,abcdefghij\n") * 1024
+        pos = start
+        while pos <= end:
+            offset = pos % len(line)
+            chunk = line[offset:offset + end - pos + 1]
+            self.wfile.write(chunk)
+            pos += len(chunk)
+
+
+class _ChatHandler(_QuietHandler):
+    """``POST /v1/chat/completions`` returning plausible JSON for the glossary
+    and lineage prompts, emitted at ``server.tokens_per_s`` (4 characters per token)."""
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        prompt = "\n".join(str(m.get("content", "")) for m in body.get("messages", []))
+        content = json.dumps(self.server.answer(prompt))
+        usage = {"prompt_tokens": len(prompt) // 4, "completion_tokens": len(content) // 4}
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        model = body.get("model", "stub")
+        tokens = [content[i:i + 4] for i in range(0, len(content), 4)]
+        delay = 1.0 / self.server.tokens_per_s if self.server.tokens_per_s else 0.0
+        time.sleep(self.server.first_token_s)
+        if not body.get("stream"):
+            time.sleep(delay * len(tokens))
+            payload = json.dumps({
+                "id": "stub", "object": "chat.completion", "created": 0, "model": model, "usage": usage,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            }).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        step = 16
+        for i in range(0, len(tokens), step):
+            time.sleep(delay * len(tokens[i:i + step]))
+            chunk = {"id": "stub", "object": "chat.completion.chunk", "created": 0, "model": model,
+                     "choices": [{"index": 0, "delta": {"content": "".join(tokens[i:i + step])}, "finish_reason": None}]}
+            self.wfile.write(b"data: " + json.dumps(chunk).encode("utf-8") + b"\n\n")
+            self.wfile.flush()
+        if (body.get("stream_options") or {}).get("include_usage"):
+            final = {"id": "stub", "object": "chat.completion.chunk", "created": 0, "model": model, "choices": [], "usage": usage}
+            self.wfile.write(b"data: " + json.dumps(final).encode("utf-8") + b"\n\n")
+        self.wfile.write(b"data: [DONE]\n\n")
+
+
+def _stub_answer(prompt):
+    if "GRAPH:" in prompt:
+        graph = json.loads(prompt.split("GRAPH:\n", 1)[1].split("\n", 1)[0])
+        return {
+            "nodes": [{"name": n["name"], "label": n["name"].split(".")[-1].title(), "tooltip": n["kind"]} for n in graph["nodes"]],
+            "edges": [{"source": e["source"], "target": e["target"], "label": e["operation"]} for e in graph["edges"]],
+        }
+    names = re.findall(r"^\s+- name: (\S+)", prompt, re.M)
+    table = (re.findall(r"^- name: (\S+)", prompt, re.M) or ["table"])[0]
+    return {
+        "columns": [{"table": table, "column": n, "definition": f"The {n} of the {table}.", "synonyms": [n.lower()]} for n in names],
+        "terms": [{"term": table.title(), "definition": f"Records of {table}.", "tables": [table]}],
+    }
+
+
+class LocalServer:
+    """Run an HTTP handler on a free localhost port in a background thread."""
+
+    def __init__(self, handler, **attrs):
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self.httpd.daemon_threads = True
+        for name, value in attrs.items():
+            setattr(self.httpd, name, value)
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def file_server():
+    return LocalServer(_FileHandler)
+
+
+def openai_stub(tokens_per_s=2000.0, first_token_s=0.05, answer=_stub_answer):
+    return LocalServer(_ChatHandler, tokens_per_s=tokens_per_s, first_token_s=first_token_s, answer=staticmethod(answer))
+
+
+# ---------------------------------------------------------------------------
+# Benchmark cases. Each returns a dict of metrics; names ending in "_ms" or
+# "_mb" are lower-is-better, "_per_s" higher-is-better, the rest must match.
+# ---------------------------------------------------------------------------
+
+
+def _timed(fn, repeats):
+    times = []
+    result = None
+    for _ in range(repeats):
+        started = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - started)
+    _, _, peak = _measure(fn)
+    return result, statistics.median(times), peak
+
+
+def _semantic_yaml(tables, columns):
+    lines = ["name: bench_model", "tables:"]
+    for t in range(tables):
+        lines.append(f"- name: table_{t}")
+        lines.append("  dimensions:")
+        lines.extend(f"  - name: column_{t}_{c}" for c in range(columns))
+    return "\n".join(lines) + "\n"
+
+
+def case_catalog(env):
+    conn = FakeSnowflakeConnection(databases=env["databases"], schemas=env["schemas"], objects=env["objects"],
+                                   latency=env["latency"], recordings=env["recordings"])
+    before = conn.queries
+    data, wall, peak = _timed(lambda: backend.list_data_objects(conn), env["repeats"])
+    objects = sum(len(o["tables"]) + len(o["views"]) for schemas in data.values() for o in schemas.values())
+    return {"wall_ms": wall * 1000, "peak_mb": peak / 1e6, "objects": objects,
+            "round_trips": (conn.queries - before) // (env["repeats"] + 1)}
+
+
+def case_schema_objects(env):
+    conn = FakeSnowflakeConnection(objects=env["objects"], latency=env["latency"], recordings=env["recordings"])
+    result, wall, peak = _timed(lambda: backend.get_schema_objects(conn, "DB0", "S0"), env["repeats"])
+    return {"wall_ms": wall * 1000, "peak_mb": peak / 1e6, "objects": sum(len(v) for v in result.values())}
+
+
+def case_sql_script(env):
+    conn = FakeSnowflakeConnection(latency=env["latency"], recordings=env["recordings"])
+    script = synthetic_sql_script(env["script_kb"] * 1024)
+    results, wall, peak = _timed(lambda: backend.execute_sql_script(conn, script, max_workers=8), env["repeats"])
+    return {"wall_ms": wall * 1000, "peak_mb": peak / 1e6, "statements": len(results),
+            "statements_per_s": len(results) / wall}
+
+
+def case_stage_read(env):
+    size = env["file_mb"] * 1024 * 1024
+    with file_server() as server:
+        conn = FakeSnowflakeConnection(file_size=size, latency=env["latency"], recordings=env["recordings"], file_server_url=server.url)
+        text, wall, peak = _timed(lambda: backend.read_file_from_stage(conn, "DB0.S0.STG", "big.csv"), env["repeats"])
+        conn.file_size = 65536
+        names = [f"part_{i}.csv" for i in range(env["files"])]
+        files, many_wall, _ = _timed(lambda: backend.read_files_from_stage(conn, "DB0.S0.STG", names), env["repeats"])
+    return {"wall_ms": wall * 1000, "peak_mb": peak / 1e6, "read_mb_per_s": len(text) / 1e6 / wall,
+            "many_files_ms": many_wall * 1000, "files": len(files)}
+
+
+def case_lineage_prompt(env):
+    sql = open(SETUP_SQL, encoding="utf-8").read()
+    blobs = [{"name": SETUP_SQL, "content": sql}]
+    graph, graph_wall, _ = _timed(lambda: backend.build_lineage_graph(blobs), env["repeats"])
+    _, context_wall, peak = _timed(lambda: backend.build_code_context(blobs, 8000, graph, "orders_v"), env["repeats"])
+    dot, dot_wall, _ = _timed(lambda: backend.generate_lineage_dot(None, [], blobs), env["repeats"])
+    with openai_stub(tokens_per_s=env["tokens_per_s"]) as stub:
+        os.environ["OPENAI_BASE_URL"] = stub.url + "/v1"
+        _, llm_wall, _ = _timed(lambda: backend.generate_lineage_dot(
+            "bench-key", [], blobs, target="orders_v", use_llm=True, use_cache=False,
+        ), 1)
+    return {"graph_ms": graph_wall * 1000, "code_context_ms": context_wall * 1000, "dot_ms": dot_wall * 1000,
+            "enriched_dot_ms": llm_wall * 1000, "peak_mb": peak / 1e6, "nodes": len(graph.nodes), "edges": len(graph.edges)}
+
+
+def case_glossary(env):
+    content = _semantic_yaml(env["tables"], 30)
+    first = []
+    with openai_stub(tokens_per_s=env["tokens_per_s"]) as stub:
+        os.environ["OPENAI_BASE_URL"] = stub.url + "/v1"
+
+        def run():
+            started = time.perf_counter()
+            first.clear()
+            result = backend.generate_business_glossary_from_yaml(
+                "bench-key", content, use_cache=False, incremental=False,
+                on_event=lambda kind, _: first.append(time.perf_counter() - started) if kind == "column" and not first else None,
+            )
+            return result
+        result, wall, peak = _timed(run, 1)
+    return {"wall_ms": wall * 1000, "first_row_ms": first[0] * 1000 if first else wall * 1000, "peak_mb": peak / 1e6,
+            "columns": len(result["columns"])}
+
+
+BENCH_CASES = {
+    "catalog": case_catalog,
+    "schema_objects": case_schema_objects,
+    "sql_script": case_sql_script,
+    "stage_read": case_stage_read,
+    "lineage_prompt": case_lineage_prompt,
+    "glossary": case_glossary,
+}
+
+
+def run_suite(cases, scale=1.0, latency_ms=20.0, repeats=3, tokens_per_s=2000.0, recordings=None):
+    env = {
+        "recordings": recordings,
+        "databases": max(1, int(4 * scale)),
+        "schemas": max(1, int(8 * scale)),
+        "objects": max(1, int(250 * scale)),
+        "latency": latency_ms / 1000.0,
+        "repeats": repeats,
+        "script_kb": max(1, int(64 * scale)),
+        "file_mb": max(1, int(8 * scale)),
+        "files": max(1, int(32 * scale)),
+        "tables": max(1, int(8 * scale)),
+        "tokens_per_s": tokens_per_s,
+    }
+    random.seed(7)
+    results = {}
+    for name in cases:
+        metrics = BENCH_CASES[name](env)
+        results[name] = {k: round(v, 3) if isinstance(v, float) else v for k, v in metrics.items()}
+        print(f"{name:15} " + "  ".join(f"{k}={v}" for k, v in results[name].items()))
+    return results
+
+
+def compare_to_baseline(results, baseline, tolerance=0.25):
+    """Return the regressions of ``results`` against ``baseline`` as messages."""
+    regressions = []
+    for case, metrics in baseline.items():
+        for metric, expected in metrics.items():
+            actual = (results.get(case) or {}).get(metric)
+            if actual is None:
+                continue
+            if metric.endswith(("_ms", "_mb")):
+                failed = actual > expected * (1 + tolerance)
+            elif metric.endswith("_per_s"):
+                failed = actual < expected * (1 - tolerance)
+            else:
+                failed = actual != expected
+            if failed:
+                regressions.append(f"{case}.{metric}: {actual} vs baseline {expected}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks and correctness checks for backend.py")
+    sub = parser.add_subparsers(dest="command", required=True)
+    splitter = sub.add_parser("splitter", help="Compare the streaming SQL splitter with sqlparse")
+    splitter.add_argument("--sizes-mb", type=int, nargs="*", default=[1])
+    suite = sub.add_parser("suite", help="Time backend entry points against local Snowflake, file and OpenAI stand-ins")
+    suite.add_argument("--cases", nargs="*", choices=sorted(BENCH_CASES), default=list(BENCH_CASES))
+    suite.add_argument("--scale", type=float, default=1.0, help="Multiplier for catalog, script, file and model sizes")
+    suite.add_argument("--latency-ms", type=float, default=20.0, help="Simulated Snowflake round-trip latency")
+    suite.add_argument("--tokens-per-s", type=float, default=2000.0, help="Simulated model output rate")
+    suite.add_argument("--repeats", type=int, default=3)
+    suite.add_argument("--replay", help="JSON of recorded result sets ({sql: {columns, rows}}) to serve first")
+    suite.add_argument("--output", help="Write the results as JSON")
+    suite.add_argument("--baseline", help="Fail when results regress past this baseline JSON")
+    suite.add_argument("--save-baseline", help="Store the results as a new baseline JSON")
+    suite.add_argument("--tolerance", type=float, default=0.25, help="Allowed relative slowdown before failing")
+    args = parser.parse_args(argv)
+    try:
+        if args.command == "splitter":
+            bench_sql_splitter(args.sizes_mb)
+        elif args.command == "suite":
+            recordings = load_recordings(args.replay) if args.replay else None
+            results = run_suite(args.cases, args.scale, args.latency_ms, args.repeats, args.tokens_per_s, recordings)
+            for path in (args.output, args.save_baseline):
+                if path:
+                    with open(path, "w", encoding="utf-8") as f:
+                        json.dump(results, f, indent=2, sort_keys=True)
+            if args.baseline:
+                with open(args.baseline, encoding="utf-8") as f:
+                    regressions = compare_to_baseline(results, json.load(f), args.tolerance)
+                if regressions:
+                    raise AssertionError("regressions past baseline:\n  " + "\n  ".join(regressions))
+                print(f"No regressions past {args.baseline} (tolerance {args.tolerance:.0%})")
+    except AssertionError as e:
+        print(f"FAILED: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,406 @@
+"""Headless batch runs of the glossary and lineage jobs.
+
+    python cli.py glossary models/ @DB.SCHEMA.STAGE/semantic/ --out build/
+    python cli.py lineage repo_a/ repo_b/ --lineage-csv edges.csv --out build/
+
+Inputs are local files or directories, or stage paths (``@db.schema.stage``
+with an optional ``/prefix``) read through presigned URLs. Jobs run in a
+process pool; finished items are recorded in ``<out>/checkpoint.jsonl`` so
+an interrupted run resumes where it stopped.
+"""
+
+import argparse
+import csv
+import hashlib
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import yaml
+
+import backend
+
+GLOSSARY_EXTENSIONS = (".yaml", ".yml")
+CODE_EXTENSIONS = (".sql", ".py", ".java", ".scala")
+GLOSSARY_FIELDS = ["Table", "Column", "Definition", "Synonyms"]
+EDGE_FIELDS = ["source", "target", "operation", "detail", "file"]
+
+
+class RateLimiter:
+    """Token bucket allowing ``per_minute`` requests per minute (``None`` = unlimited).
+
+    The bucket lives in shared memory, so one limiter passed to every worker
+    process enforces a single limit across the whole pool.
+    """
+
+    def __init__(self, per_minute=None):
+        self.per_minute = per_minute
+        # Limits below one per minute still let a request through, just less often.
+        self.capacity = max(float(per_minute or 0), 1.0)
+        # [tokens, last refill]; the array carries its own process-shared lock.
+        self._state = multiprocessing.Array("d", [self.capacity, time.monotonic()])
+
+    def acquire(self):
+        """Block until one request may be sent."""
+        if not self.per_minute:
+            return
+        capacity = self.capacity
+        while True:
+            with self._state.get_lock():
+                tokens, updated = self._state[:]
+                now = time.monotonic()
+                tokens = min(capacity, tokens + (now - updated) * self.per_minute / 60.0)
+                if tokens >= 1:
+                    self._state[:] = [tokens - 1, now]
+                    return
+                self._state[:] = [tokens, now]
+                wait_s = (1 - tokens) * 60.0 / self.per_minute
+            time.sleep(wait_s)
+
+
+def _init_worker(limiter):
+    # Every OpenAI request a worker sends, retries included, takes a token.
+    backend.set_request_throttle(limiter.acquire)
+
+
+class Checkpoint:
+    """Append-only JSON Lines record of finished items, keyed by job kind,
+    item name and a hash of the item's inputs."""
+
+    def __init__(self, path, restart=False):
+        self.path = path
+        self.done = {}
+        if restart and os.path.exists(path):
+            os.remove(path)
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # a line cut off by an interrupted run
+                    if entry.get("status") == "ok":
+                        self.done[(entry["kind"], entry["name"])] = entry
+
+    def is_done(self, kind, name, fingerprint):
+        entry = self.done.get((kind, name))
+        return (
+            entry is not None
+            and entry.get("fingerprint") == fingerprint
+            and all(os.path.exists(p) for p in entry.get("outputs", []))
+        )
+
+    def record(self, entry):
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry) + "\n")
+        if entry.get("status") == "ok":
+            self.done[(entry["kind"], entry["name"])] = entry
+
+
+def _connect_from_env():
+    missing = [v for v in ("SNOWFLAKE_ACCOUNT", "SNOWFLAKE_USER", "SNOWFLAKE_PASSWORD") if not os.environ.get(v)]
+    if missing:
+        raise SystemExit(f"Stage inputs need Snowflake credentials; set {', '.join(missing)}")
+    return backend.get_connection_pool(
+        user=os.environ["SNOWFLAKE_USER"],
+        password=os.environ["SNOWFLAKE_PASSWORD"],
+        account=os.environ["SNOWFLAKE_ACCOUNT"],
+        role=os.environ.get("SNOWFLAKE_ROLE"),
+        warehouse=os.environ.get("SNOWFLAKE_WAREHOUSE"),
+        database=os.environ.get("SNOWFLAKE_DATABASE"),
+        schema=os.environ.get("SNOWFLAKE_SCHEMA"),
+    )
+
+
+def _read_local(path, extensions):
+    if os.path.isfile(path):
+        with open(path, encoding="utf-8", errors="replace") as f:
+            return {path: f.read()}
+    files = {}
+    for root, dirs, names in os.walk(path):
+        dirs[:] = sorted(d for d in dirs if not d.startswith("."))
+        for name in sorted(names):
+            if name.lower().endswith(extensions):
+                full = os.path.join(root, name)
+                with open(full, encoding="utf-8", errors="replace") as f:
+                    files[os.path.relpath(full, path)] = f.read()
+    return files
+
+
+def _read_stage(conn, path, extensions):
+    stage, _, prefix = path.lstrip("@").partition("/")
+    names = [
+        f.name.split("/", 1)[1] if "/" in f.name else f.name
+        for f in backend.iter_stage_files(conn, stage)
+        if f.name.lower().endswith(extensions)
+    ]
+    names = [n for n in names if n.startswith(prefix)]
+    return backend.read_files_from_stage(conn, stage, names) if names else {}
+
+
+def collect_inputs(inputs, extensions):
+    """Return ``[(input, {file name: content})]`` for local paths and stage paths."""
+    conn = None
+    collected = []
+    for path in inputs:
+        if path.startswith("@"):
+            conn = conn or _connect_from_env()
+            collected.append((path, _read_stage(conn, path, extensions)))
+        elif os.path.exists(path):
+            collected.append((path, _read_local(path, extensions)))
+        else:
+            raise SystemExit(f"No such file, directory or stage path: {path}")
+    return collected
+
+
+def _fingerprint(*parts):
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(json.dumps(part, sort_keys=True, default=str).encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def _item_name(source, name):
+    return source if name == source else f"{source}::{name}"
+
+
+def _slug(name):
+    return "".join(c if c.isalnum() or c in "-_." else "_" for c in name.strip("@/")).strip("._") or "item"
+
+
+def _glossary_rows(result):
+    rows = []
+    for c in result.get("columns") or []:
+        synonyms = c.get("synonyms") or []
+        if isinstance(synonyms, list):
+            synonyms = ", ".join(str(x) for x in synonyms)
+        rows.append({
+            "Table": c.get("table") or "",
+            "Column": c.get("column") or "",
+            "Definition": c.get("definition") or c.get("description") or "",
+            "Synonyms": synonyms,
+        })
+    return rows
+
+
+def _write_csv(path, fields, rows):
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=fields, extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def run_glossary_job(job):
+    """Worker: generate one glossary and write its JSON and CSV."""
+    result = backend.generate_business_glossary_from_yaml(
+        job["api_key"],
+        job["content"],
+        use_cache=job["use_cache"],
+        max_concurrency=job["max_concurrency"],
+        incremental=job["incremental"],
+    )
+    base = os.path.join(job["out"], "glossary", job["slug"])
+    with open(base + ".json", "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+    _write_csv(base + ".csv", GLOSSARY_FIELDS, _glossary_rows(result))
+    return {"outputs": [base + ".json", base + ".csv"], "errors": result.get("errors") or []}
+
+
+_edge_tables = {}
+
+
+def _load_edge_table(path):
+    # Parsed once per worker process rather than pickled into every job.
+    if path and path not in _edge_tables:
+        with open(path, encoding="utf-8", newline="") as f:
+            _edge_tables[path] = backend.EdgeTable.from_csv(f)
+    return _edge_tables.get(path)
+
+
+def run_lineage_job(job):
+    """Worker: build one lineage graph and write its DOT, JSON and edge CSV."""
+    options = job["options"]
+    code_blobs = [{"name": name, "content": content} for name, content in job["files"].items()]
+    edge_table = _load_edge_table(job["lineage_csv"])
+    warnings = []
+    graphs = []
+    dot_text = backend.generate_lineage_dot(
+        job["api_key"], edge_table, code_blobs, target=options["target"], max_hops=options["max_hops"],
+        theme=options["theme"], use_llm=options["use_llm"], level_of_detail=options["level_of_detail"],
+        on_warning=warnings.append, on_graph=graphs.append,
+    )
+    # Serialize the graph the DOT was rendered from, after collapsing and summarizing.
+    graph = graphs[0]
+    base = os.path.join(job["out"], "lineage", job["slug"])
+    outputs = [base + ".dot", base + ".json", base + ".csv"]
+    with open(base + ".dot", "w", encoding="utf-8") as f:
+        f.write(dot_text)
+    with open(base + ".json", "w", encoding="utf-8") as f:
+        json.dump({"nodes": graph.nodes, "edges": [e._asdict() for e in graph.edges]}, f, indent=2)
+    _write_csv(base + ".csv", EDGE_FIELDS, [e._asdict() for e in graph.edges])
+    if options["svg"]:
+        svg = backend.layout_lineage_svg(dot_text)
+        if svg:
+            with open(base + ".svg", "w", encoding="utf-8") as f:
+                f.write(svg)
+            outputs.append(base + ".svg")
+    return {"outputs": outputs, "errors": warnings}
+
+
+def _glossary_jobs(args):
+    jobs = []
+    for source, files in collect_inputs(args.inputs, GLOSSARY_EXTENSIONS):
+        for name, content in sorted(files.items()):
+            item = _item_name(source, name)
+            try:
+                yaml.safe_load(content)
+            except yaml.YAMLError as e:
+                jobs.append({"name": item, "invalid": f"Invalid YAML: {e}"})
+                continue
+            jobs.append({
+                "name": item,
+                "slug": _slug(item),
+                "fingerprint": _fingerprint(content, backend.PROMPT_TEMPLATE_VERSIONS["business_glossary"]),
+                "content": content,
+                "api_key": args.api_key,
+                "use_cache": not args.no_cache,
+                "incremental": not args.no_incremental,
+                "max_concurrency": args.max_concurrency,
+                "out": args.out,
+            })
+    return run_glossary_job, jobs
+
+
+def _lineage_jobs(args):
+    lineage_csv, csv_digest = None, None
+    if args.lineage_csv:
+        lineage_csv = os.path.abspath(args.lineage_csv)
+        with open(lineage_csv, "rb") as f:
+            csv_digest = hashlib.sha256(f.read()).hexdigest()
+    options = {
+        "target": args.target, "max_hops": args.max_hops, "theme": args.theme, "use_llm": args.use_llm,
+        "level_of_detail": args.level_of_detail, "svg": args.svg,
+    }
+    jobs = []
+    for source, files in collect_inputs(args.inputs, CODE_EXTENSIONS):
+        groups = [(_item_name(source, name), {name: content}) for name, content in sorted(files.items())] if args.per_file else [(source, files)]
+        for item, group in groups:
+            jobs.append({
+                "name": item,
+                "slug": _slug(item),
+                "fingerprint": _fingerprint(sorted(group.items()), csv_digest, options),
+                "files": group,
+                "lineage_csv": lineage_csv,
+                "options": options,
+                "api_key": args.api_key,
+                "out": args.out,
+            })
+    return run_lineage_job, jobs
+
+
+def run_jobs(kind, worker, jobs, args):
+    """Run ``jobs`` in a process pool, skipping checkpointed items; returns
+    ``(finished, skipped, failed)`` lists of checkpoint entries."""
+    os.makedirs(os.path.join(args.out, kind), exist_ok=True)
+    checkpoint = Checkpoint(os.path.join(args.out, "checkpoint.jsonl"), restart=args.restart)
+    limiter = RateLimiter(args.requests_per_minute)
+    finished, skipped, failed = [], [], []
+    pending = []
+    for job in jobs:
+        if "invalid" in job:
+            entry = {"kind": kind, "name": job["name"], "status": "error", "error": job["invalid"]}
+            checkpoint.record(entry)
+            failed.append(entry)
+        elif checkpoint.is_done(kind, job["name"], job["fingerprint"]):
+            skipped.append(checkpoint.done[(kind, job["name"])])
+        else:
+            pending.append(job)
+    print(f"{kind}: {len(pending)} to run, {len(skipped)} already done", file=sys.stderr)
+
+    with ProcessPoolExecutor(max_workers=max(1, args.workers), initializer=_init_worker, initargs=(limiter,)) as pool:
+        running = {}
+        queue = list(reversed(pending))
+        while queue or running:
+            # Keep at most one job per worker in flight so elapsed_s measures run time, not queueing.
+            while queue and len(running) < max(1, args.workers):
+                job = queue.pop()
+                running[pool.submit(worker, job)] = (job, time.time())
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                job, started = running.pop(future)
+                entry = {"kind": kind, "name": job["name"], "fingerprint": job["fingerprint"],
+                         "elapsed_s": round(time.time() - started, 3)}
+                try:
+                    result = future.result()
+                    entry.update(status="ok", outputs=result["outputs"], warnings=result["errors"])
+                    finished.append(entry)
+                except Exception as e:
+                    entry.update(status="error", error=str(e))
+                    failed.append(entry)
+                checkpoint.record(entry)
+                print(f"  [{entry['status']}] {job['name']} ({entry['elapsed_s']} s)", file=sys.stderr)
+    return finished, skipped, failed
+
+
+def write_bulk_outputs(kind, entries, out):
+    """Combine the per-item CSVs of every successful item into one file."""
+    csvs = [p for entry in entries for p in entry.get("outputs", []) if p.endswith(".csv")]
+    fields = GLOSSARY_FIELDS if kind == "glossary" else EDGE_FIELDS
+    path = os.path.join(out, f"{kind}_all.csv")
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=["item"] + fields, extrasaction="ignore")
+        writer.writeheader()
+        for entry in entries:
+            for p in entry.get("outputs", []):
+                if p in csvs and os.path.exists(p):
+                    with open(p, encoding="utf-8", newline="") as part:
+                        for row in csv.DictReader(part):
+                            writer.writerow({"item": entry["name"], **row})
+    return path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Batch glossary and lineage generation")
+    sub = parser.add_subparsers(dest="command", required=True)
+    for name, help_text in (("glossary", "Generate glossaries for semantic YAML files"),
+                            ("lineage", "Build lineage diagrams for code directories")):
+        p = sub.add_parser(name, help=help_text)
+        p.add_argument("inputs", nargs="+", help="Files, directories or @db.schema.stage[/prefix] paths")
+        p.add_argument("--out", required=True, help="Output directory (also holds checkpoint.jsonl)")
+        p.add_argument("--workers", type=int, default=os.cpu_count() or 2, help="Worker processes")
+        p.add_argument("--requests-per-minute", type=float, default=None, help="Limit on OpenAI requests per minute across all workers")
+        p.add_argument("--restart", action="store_true", help="Ignore the checkpoint and rerun every item")
+        p.add_argument("--api-key", default=os.environ.get("OPENAI_API_KEY"), help="Defaults to $OPENAI_API_KEY")
+    glossary = sub.choices["glossary"]
+    glossary.add_argument("--max-concurrency", type=int, default=4, help="Concurrent requests per YAML file")
+    glossary.add_argument("--no-cache", action="store_true", help="Do not reuse cached responses")
+    glossary.add_argument("--no-incremental", action="store_true", help="Regenerate unchanged tables too")
+    lineage = sub.choices["lineage"]
+    lineage.add_argument("--lineage-csv", help="Relationship CSV merged into every graph")
+    lineage.add_argument("--per-file", action="store_true", help="One diagram per code file instead of per input")
+    lineage.add_argument("--target")
+    lineage.add_argument("--max-hops", type=int, default=2)
+    lineage.add_argument("--theme", default="vibrant", choices=sorted(backend.LINEAGE_THEMES))
+    lineage.add_argument("--level-of-detail", default="auto", choices=["auto"] + list(backend.LINEAGE_DETAIL_LEVELS))
+    lineage.add_argument("--use-llm", action="store_true", help="Enrich labels and tooltips with OpenAI")
+    lineage.add_argument("--svg", action="store_true", help="Also lay out SVG (needs the Graphviz dot binary)")
+    args = parser.parse_args(argv)
+
+    if (args.command == "glossary" or args.use_llm) and not args.api_key:
+        parser.error("an OpenAI API key is required (--api-key or $OPENAI_API_KEY)")
+    os.makedirs(args.out, exist_ok=True)
+    worker, jobs = _glossary_jobs(args) if args.command == "glossary" else _lineage_jobs(args)
+    finished, skipped, failed = run_jobs(args.command, worker, jobs, args)
+    bulk = write_bulk_outputs(args.command, skipped + finished, args.out)
+    with open(os.path.join(args.out, f"{args.command}_summary.json"), "w", encoding="utf-8") as f:
+        json.dump({"finished": finished, "skipped": skipped, "failed": failed, "combined_csv": bulk}, f, indent=2)
+    print(f"{len(finished)} finished, {len(skipped)} skipped, {len(failed)} failed; combined CSV: {bulk}", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,10 +1,13 @@
 import streamlit as st
-from backend import connect_to_snowflake, list_data_objects, get_schema_objects, get_table_or_view_columns, list_stages, list_files_in_stage, read_file_from_stage, SnowflakeConnectionError
-import yaml
+import streamlit.components.v1 as components
+from backend import get_connection_pool, list_data_objects, get_table_or_view_columns, list_stages, list_files_in_stage, read_file_from_stage, SnowflakeConnectionError
 import csv
 import io
 import re
-from backend import generate_business_glossary_from_yaml, generate_lineage_dot
+import time
+import uuid
+from backend import generate_business_glossary_from_yaml, get_tracer, set_trace_session, generate_lineage_dot, layout_lineage_svg, get_metadata_cache, get_search_index, refresh_search_index, page_schema_objects, EXPLORER_SORT_KEYS, SCHEMA_OBJECT_CATEGORIES
+from backend import parse_yaml_upload, parse_lineage_csv_upload, decode_code_upload, UPLOAD_PREVIEW_CHARS, UPLOAD_PREVIEW_ROWS
 
 # Page configuration and lightweight theming
 st.set_page_config(page_title="SNFL Data nxt | Governance & Lineage", page_icon="📊", layout="wide")
@@ -22,6 +25,12 @@ st.markdown("<p class='ey-app-subtitle'>Business glossary generation, Snowflake
 
 
 
+# Spans are recorded process-wide; tag them so each session only sees its own
+if "trace_session" not in st.session_state:
+    st.session_state["trace_session"] = uuid.uuid4().hex
+trace_session = st.session_state["trace_session"]
+set_trace_session(trace_session)
+
 st.sidebar.header("Snowflake Connection")
 st.sidebar.caption("Provide credentials to explore objects and run features")
 
@@ -39,7 +48,8 @@ if 'connected' not in st.session_state:
 
 if st.sidebar.button("Connect"):
     try:
-        conn = connect_to_snowflake(
+        # Sessions with identical credentials share one pool of validated connections
+        conn = get_connection_pool(
             user=user,
             password=pat,
             account=account,
@@ -63,65 +73,116 @@ if st.session_state.get("connected") and st.session_state.get("conn"):
     if section == "Data Object Explorer":
         st.header("Data Object Explorer")
         st.caption("Browse databases, schemas, and objects in your Snowflake account")
+        metadata_cache = get_metadata_cache(check_last_altered=True)
+        if st.button("Refresh metadata", help="Discard cached databases, schemas, objects and columns"):
+            metadata_cache.invalidate(conn)
+        search_index = get_search_index(conn)
+        with st.expander("Search objects and columns", expanded=True):
+            search_col, refresh_col = st.columns([4, 1])
+            query = search_col.text_input(
+                "Search",
+                key="explorer_search",
+                placeholder="e.g. customer id, ord*, orders_v.cust, kind:view, type:timestamp",
+                help="Terms match whole names, name parts, prefixes and substrings; all terms must match.",
+            )
+            if refresh_col.button("Refresh index", help="Re-harvest schemas that changed since they were indexed"):
+                with st.spinner("Indexing databases, schemas, objects and columns…"):
+                    try:
+                        stats = refresh_search_index(conn, search_index, cache=metadata_cache)
+                        st.success(f"Re-indexed {stats['schemas_refreshed']} schemas in {stats['wall_time_s']} s.")
+                    except Exception as e:
+                        st.error(str(e))
+            index_stats = search_index.stats()
+            if not index_stats["documents"]:
+                st.caption("The search index is empty; click “Refresh index” to build it.")
+            elif query.strip():
+                started = time.perf_counter()
+                total, hits = search_index.search(query, limit=100)
+                elapsed_ms = (time.perf_counter() - started) * 1000
+                st.caption(f"{total} matches in {elapsed_ms:.1f} ms (showing {len(hits)}) · {index_stats['documents']} names indexed")
+                if hits:
+                    st.dataframe(
+                        [{"Name": h["path"], "Kind": h["kind"].title(), "Type": h["data_type"] or ""} for h in hits],
+                        use_container_width=True,
+                        hide_index=True,
+                    )
         try:
-            data = list_data_objects(conn)
+            data = list_data_objects(conn, cache=metadata_cache)
             db_names = sorted(data.keys())
             selected_db = st.selectbox("Database", db_names, key="explorer_db") if db_names else None
             if not selected_db:
                 st.info("No databases available.")
             else:
                 schemas = sorted(data[selected_db].keys())
-                selected_schemas = st.multiselect("Schemas", schemas, default=schemas, key="explorer_schemas")
+                # Only the opened schema is listed, and only one page of it is rendered
+                selected_schema = st.selectbox(
+                    "Schema", [None] + schemas, format_func=lambda s: "Select a schema…" if s is None else s, key="explorer_schema"
+                )
+                categories = list(SCHEMA_OBJECT_CATEGORIES)
+                selected_categories = st.multiselect(
+                    "Object types",
+                    categories,
+                    default=categories,
+                    format_func=lambda c: c.replace("_", " ").title(),
+                    key="explorer_categories",
+                )
+                filter_col, sort_col, order_col, size_col = st.columns([3, 1, 1, 1])
+                filter_text = filter_col.text_input("Filter by name (* and ? wildcards)", key="explorer_filter")
+                sort_by = sort_col.selectbox("Sort by", list(EXPLORER_SORT_KEYS), format_func=str.title, key="explorer_sort")
+                descending = order_col.selectbox("Order", ["Ascending", "Descending"], key="explorer_order") == "Descending"
+                page_size = size_col.selectbox("Page size", [25, 50, 100, 250], index=1, key="explorer_page_size")
 
-                # For each selected schema, fetch objects and render top-level expanders per object
-                for schema_name in selected_schemas:
+                if selected_schema and selected_categories:
+                    # A different schema or filter starts again at the first page
+                    view_key = (selected_db, selected_schema, tuple(selected_categories), filter_text, sort_by, descending, page_size)
+                    if st.session_state.get("explorer_view") != view_key:
+                        st.session_state["explorer_view"] = view_key
+                        st.session_state["explorer_page"] = 1
                     try:
-                        schema_objects = get_schema_objects(conn, selected_db, schema_name)
+                        result = page_schema_objects(
+                            conn, selected_db, selected_schema, categories=selected_categories,
+                            filter_text=filter_text, sort_by=sort_by, descending=descending,
+                            page=st.session_state["explorer_page"], page_size=page_size, cache=metadata_cache,
+                        )
                     except Exception as e:
-                        st.error(f"Failed to load schema objects for {selected_db}.{schema_name}: {e}")
-                        continue
-
-                    counts = {k: len(v) for k, v in schema_objects.items() if isinstance(v, list)}
-                    if counts:
-                        st.caption(f"{selected_db}.{schema_name} — " + ", ".join([f"{k}: {v}" for k, v in sorted(counts.items())]))
-
-                    # Tables (one expander per table)
-                    for tbl in sorted(schema_objects.get('tables', [])):
-                        with st.expander(f"Table: {selected_db}.{schema_name}.{tbl}"):
-                            btn_key = f"tbl_btn_{selected_db}_{schema_name}_{tbl}"
-                            if st.button("Show columns", key=btn_key):
-                                try:
-                                    cols = get_table_or_view_columns(conn, selected_db, schema_name, tbl, object_type='table')
-                                    st.table(cols)
-                                except Exception as e:
-                                    st.error(str(e))
+                        st.error(f"Failed to load schema objects for {selected_db}.{selected_schema}: {e}")
+                        result = None
+
+                    if result is not None:
+                        counts = {k: v for k, v in result["counts"].items() if v}
+                        if counts:
+                            st.caption(f"{selected_db}.{selected_schema} — " + ", ".join([f"{k}: {v}" for k, v in sorted(counts.items())]))
+                        st.session_state["explorer_page"] = result["page"]
+                        prev_col, page_col, next_col = st.columns([1, 4, 1])
+                        if prev_col.button("◀ Previous", disabled=result["page"] <= 1, key="explorer_prev"):
+                            st.session_state["explorer_page"] -= 1
+                            st.rerun()
+                        page_col.caption(f"Page {result['page']} of {result['pages']} · {result['total']} matching objects")
+                        if next_col.button("Next ▶", disabled=result["page"] >= result["pages"], key="explorer_next"):
+                            st.session_state["explorer_page"] += 1
+                            st.rerun()
 
-                    # Views (one expander per view)
-                    for vw in sorted(schema_objects.get('views', [])):
-                        with st.expander(f"View: {selected_db}.{schema_name}.{vw}"):
-                            btn_key = f"vw_btn_{selected_db}_{schema_name}_{vw}"
-                            if st.button("Show columns", key=btn_key):
+                        rows = [
+                            {"Name": item["name"], "Type": item["category"].replace("_", " ").title()}
+                            for item in result["items"]
+                        ]
+                        st.dataframe(rows, use_container_width=True, hide_index=True)
+
+                        inspectable = [item["name"] for item in result["items"] if item["category"] in ("tables", "views")]
+                        if inspectable:
+                            object_types = {item["name"]: item["category"] for item in result["items"]}
+                            obj = st.selectbox("Show columns for", [None] + inspectable,
+                                               format_func=lambda o: "Select a table or view…" if o is None else o,
+                                               key="explorer_object")
+                            if obj:
                                 try:
-                                    cols = get_table_or_view_columns(conn, selected_db, schema_name, vw, object_type='view')
+                                    object_type = "table" if object_types[obj] == "tables" else "view"
+                                    cols = get_table_or_view_columns(conn, selected_db, selected_schema, obj, object_type=object_type, cache=metadata_cache)
                                     st.table(cols)
                                 except Exception as e:
                                     st.error(str(e))
-
-                    # Other object categories (each item expandable)
-                    def render_expandable_list(items, label):
-                        for name in sorted(items):
-                            with st.expander(f"{label}: {selected_db}.{schema_name}.{name}"):
-                                st.write(f"Name: `{name}`")
-
-                    render_expandable_list(schema_objects.get('stages', []), 'Stage')
-                    render_expandable_list(schema_objects.get('file_formats', []), 'File Format')
-                    render_expandable_list(schema_objects.get('sequences', []), 'Sequence')
-                    render_expandable_list(schema_objects.get('functions', []), 'Function')
-                    render_expandable_list(schema_objects.get('user_functions', []), 'User Function')
-                    render_expandable_list(schema_objects.get('procedures', []), 'Procedure')
-                    render_expandable_list(schema_objects.get('tasks', []), 'Task')
-                    render_expandable_list(schema_objects.get('streams', []), 'Stream')
-                    render_expandable_list(schema_objects.get('pipes', []), 'Pipe')
+                elif not selected_schema:
+                    st.info(f"{len(schemas)} schemas in {selected_db}. Select one to browse its objects.")
         except Exception as e:
             st.error(str(e))
 
@@ -136,15 +197,61 @@ if st.session_state.get("connected") and st.session_state.get("conn"):
         uploaded_file = st.file_uploader("Upload Semantic YAML", type=["yaml", "yml"], key="sem_yaml_upload")
         if uploaded_file is not None:
             try:
-                content = uploaded_file.read().decode("utf-8")
-                parsed_yaml = yaml.safe_load(content)
+                # Parsed once per file content; reruns reuse the cached result
+                upload = parse_yaml_upload(uploaded_file.getvalue())
+                content = upload["content"]
                 st.subheader("Uploaded YAML Preview")
-                st.code(yaml.dump(parsed_yaml, sort_keys=False), language="yaml")
+                st.code(upload["preview"], language="yaml")
+                if upload["truncated"]:
+                    st.caption(f"Preview truncated to the first {UPLOAD_PREVIEW_CHARS:,} characters.")
 
                 if openai_api_key:
+                    use_cache = st.checkbox("Reuse cached responses for identical input", value=True, key="glossary_use_cache")
+                    incremental = st.checkbox("Only regenerate new or changed tables", value=True, key="glossary_incremental")
+                    annotate = st.checkbox(
+                        "Add column data types and comments from Snowflake", value=True, key="glossary_annotate",
+                        help="Looks up each table's base_table in one column query per schema.",
+                    )
                     if st.button("Generate Business Glossary"):
+                        def to_row(c):
+                            synonyms = c.get("synonyms") or []
+                            if isinstance(synonyms, list):
+                                synonyms = ", ".join([str(x) for x in synonyms])
+                            return {
+                                "Table": c.get("table") or "",
+                                "Column": c.get("column") or "",
+                                "Definition": c.get("definition") or c.get("description") or "",
+                                "Synonyms": synonyms,
+                            }
+
+                        live_status = st.empty()
+                        live_table = st.empty()
+                        live_rows = []
+                        last_refresh = [0.0]
+
+                        def show_progress(kind, payload):
+                            # Rows stream in as each glossary object completes; redraw at most a few times a second.
+                            if kind == "column":
+                                live_rows.append(to_row(payload))
+                            if kind == "summary" or time.time() - last_refresh[0] > 0.3:
+                                last_refresh[0] = time.time()
+                                live_status.caption(f"{len(live_rows)} column definitions received")
+                                live_table.dataframe(live_rows, use_container_width=True)
+
                         try:
-                            result = generate_business_glossary_from_yaml(openai_api_key, content)
+                            result = generate_business_glossary_from_yaml(
+                                openai_api_key, content, use_cache=use_cache, incremental=incremental, on_event=show_progress,
+                                conn=conn if annotate else None, metadata_cache=get_metadata_cache(check_last_altered=True),
+                            )
+                            live_status.empty()
+                            live_table.empty()
+                            if result.get("reused_tables"):
+                                st.info(
+                                    f"Reused {len(result['reused_tables'])} unchanged table(s); "
+                                    f"generated {len(result.get('generated_tables') or [])}."
+                                )
+                            for err in result.get("errors") or []:
+                                st.warning(err)
                             if isinstance(result, dict) and "text" not in result:
                                 # Expect column-level glossary
                                 columns_glossary = result.get("columns")
@@ -153,21 +260,7 @@ if st.session_state.get("connected") and st.session_state.get("conn"):
                                 # Build rows: table, column, definition, synonyms
                                 rows = []
                                 if isinstance(columns_glossary, list):
-                                    for c in columns_glossary:
-                                        if not isinstance(c, dict):
-                                            continue
-                                        table_name = c.get("table") or ""
-                                        column_name = c.get("column") or ""
-                                        definition = c.get("definition") or c.get("description") or ""
-                                        synonyms = c.get("synonyms") or []
-                                        if isinstance(synonyms, list):
-                                            synonyms = ", ".join([str(x) for x in synonyms])
-                                        rows.append({
-                                            "Table": table_name,
-                                            "Column": column_name,
-                                            "Definition": definition,
-                                            "Synonyms": synonyms,
-                                        })
+                                    rows = [to_row(c) for c in columns_glossary if isinstance(c, dict)]
 
                                 st.subheader("Column Glossary")
                                 if rows:
@@ -215,7 +308,7 @@ if st.session_state.get("connected") and st.session_state.get("conn"):
 
     elif section == "Lineage Studio":
         st.header("Lineage Studio")
-        st.caption("Generate an interactive lineage diagram from CSV relationships and code context")
+        st.caption("Generate an interactive lineage diagram from CSV relationships and code context. Lineage is parsed locally; OpenAI is only used to enrich labels.")
 
         # OpenAI API key input (shared key name to reuse value if already set)
         with st.sidebar:
@@ -229,14 +322,25 @@ if st.session_state.get("connected") and st.session_state.get("conn"):
             key="lineage_code_upload",
         )
 
-        csv_rows = []
+        edge_table = None
         if lineage_csv is not None:
             try:
-                csv_text = lineage_csv.read().decode("utf-8")
-                reader = csv.DictReader(csv_text.splitlines())
-                csv_rows = list(reader)
+                # Streamed into a columnar edge table once per file content
+                edge_table = parse_lineage_csv_upload(lineage_csv.getvalue())
+                stats = edge_table.stats()
                 st.subheader("Lineage CSV Preview")
-                st.dataframe(csv_rows)
+                c1, c2, c3, c4 = st.columns(4)
+                c1.metric("Edges", f"{stats['edges']:,}")
+                c2.metric("Objects", f"{stats['nodes']:,}")
+                c3.metric("Sources / targets", f"{stats['sources']:,} / {stats['targets']:,}")
+                c4.metric("Rows skipped", f"{stats['skipped']:,}", help="Rows without a source or target, or pointing at themselves")
+                sample = edge_table.sample(UPLOAD_PREVIEW_ROWS)
+                st.dataframe(sample, use_container_width=True)
+                if stats["edges"] > len(sample):
+                    st.caption(f"Showing the first {len(sample):,} of {stats['edges']:,} edges.")
+                if stats["operations"]:
+                    with st.expander("Operations"):
+                        st.dataframe([{"Operation": op, "Edges": n} for op, n in stats["operations"]], hide_index=True)
             except Exception as e:
                 st.error(f"Failed to parse CSV: {e}")
 
@@ -245,9 +349,9 @@ if st.session_state.get("connected") and st.session_state.get("conn"):
             st.subheader("Uploaded Code Files")
             for f in code_files:
                 try:
-                    content = f.read().decode("utf-8", errors="replace")
-                    code_blobs.append({"name": f.name, "content": content})
-                    st.markdown(f"- `{f.name}` ({len(content)} chars)")
+                    blob = decode_code_upload(f.name, f.getvalue())
+                    code_blobs.append(blob)
+                    st.markdown(f"- `{f.name}` ({len(blob['content'])} chars)")
                 except Exception as e:
                     st.markdown(f"- `{f.name}` (error reading: {e})")
 
@@ -255,28 +359,46 @@ if st.session_state.get("connected") and st.session_state.get("conn"):
         max_hops = st.slider("Max hops from target (both directions)", min_value=1, max_value=5, value=2, key="lineage_hops")
         theme = st.selectbox("Diagram theme", options=["vibrant", "muted", "monochrome"], index=0, key="lineage_theme")
         detail_level = st.selectbox("Detail level", options=["low", "medium", "high"], index=2, key="lineage_detail")
-        include_sql_snippets = st.checkbox("Include SQL snippet excerpts", value=False, key="lineage_snippets")
+        level_of_detail = st.selectbox(
+            "Group objects",
+            options=["auto", "object", "schema", "database"],
+            index=0,
+            key="lineage_lod",
+            help="Collapse schemas or databases into summary nodes; auto keeps objects when the graph is small enough",
+        )
+        max_nodes = st.number_input("Max nodes before grouping (auto)", min_value=20, max_value=5000, value=300, step=20, key="lineage_max_nodes")
+        expand_text = st.text_input("Keep these schemas expanded (comma-separated DB.SCHEMA)", key="lineage_expand")
         show_edge_labels = st.checkbox("Show edge operation labels (joins, aggregation, filters)", value=True, key="lineage_edge_labels")
         show_node_tooltips = st.checkbox("Show node tooltips (summaries)", value=True, key="lineage_tooltips")
         include_ctes = st.checkbox("Include CTEs as nodes", value=True, key="lineage_ctes")
-        include_column_lineage = st.checkbox("Include column-level lineage hints", value=True, key="lineage_col_lineage")
         include_file_stage_sources = st.checkbox("Include file/stage sources (COPY INTO, stages)", value=True, key="lineage_file_stage")
+        use_llm = st.checkbox("Enrich labels and tooltips with OpenAI", value=False, key="lineage_use_llm")
+        use_cache = st.checkbox("Reuse cached responses for identical input", value=True, key="lineage_use_cache", disabled=not use_llm)
+        include_column_lineage = st.checkbox("Include column-level lineage hints", value=True, key="lineage_col_lineage", disabled=not use_llm)
+        include_sql_snippets = st.checkbox("Include SQL snippet excerpts", value=False, key="lineage_snippets", disabled=not use_llm)
+        code_token_budget = st.number_input(
+            "Token budget for code sent to OpenAI", min_value=500, max_value=100000, value=8000, step=500,
+            key="lineage_token_budget", disabled=not use_llm,
+            help="Code is stripped of comments and duplicates, then the statements most relevant to the graph are kept until the budget is spent.",
+        )
 
         additional_instructions = st.text_area(
-            "Optional: Additional instructions/context for diagram generation",
+            "Optional: Additional instructions/context for OpenAI enrichment",
             help="E.g., describe schema naming conventions, important transformations, or grouping rules."
         )
 
         if st.button("Generate Lineage Diagram"):
-            if not openai_api_key:
+            if use_llm and not openai_api_key:
                 st.error("Enter your OpenAI API key in the sidebar.")
             elif lineage_csv is None and not code_blobs:
                 st.error("Upload at least a lineage CSV or one code file.")
             else:
                 try:
+                    prompt_reports = []
+                    warnings = []
                     dot_text = generate_lineage_dot(
                         openai_api_key=openai_api_key,
-                        lineage_rows=csv_rows,
+                        lineage_rows=edge_table,
                         code_blobs=code_blobs,
                         additional_instructions=additional_instructions,
                         target=target.strip() if target else None,
@@ -286,21 +408,66 @@ if st.session_state.get("connected") and st.session_state.get("conn"):
                         include_sql_snippets=include_sql_snippets,
                         snippet_max_chars=180,
                         show_edge_labels=show_edge_labels,
-                            show_node_tooltips=show_node_tooltips,
-                            include_ctes=include_ctes,
-                            include_column_lineage=include_column_lineage,
-                            include_file_and_stage_sources=include_file_stage_sources,
+                        show_node_tooltips=show_node_tooltips,
+                        include_ctes=include_ctes,
+                        include_column_lineage=include_column_lineage,
+                        include_file_and_stage_sources=include_file_stage_sources,
+                        use_llm=use_llm,
+                        level_of_detail=level_of_detail,
+                        max_nodes=int(max_nodes),
+                        expand=[p.strip().upper() for p in expand_text.split(",") if p.strip()],
+                        use_cache=use_cache,
+                        code_token_budget=int(code_token_budget),
+                        on_prompt_report=prompt_reports.append,
+                        on_warning=warnings.append,
                     )
+                    for warning in warnings:
+                        st.warning(warning)
 
-                    if not dot_text.lower().startswith("digraph"):
-                        st.warning("The model did not return DOT text as expected. Showing raw output.")
-                        st.write(dot_text)
+                    st.subheader("Lineage Diagram")
+                    svg = layout_lineage_svg(dot_text)
+                    if svg:
+                        components.html(svg, height=700, scrolling=True)
+                        st.download_button("Download SVG", data=svg, file_name="lineage.svg", mime="image/svg+xml")
                     else:
-                        st.subheader("Lineage Diagram")
                         st.graphviz_chart(dot_text)
-                        st.subheader("DOT Source")
-                        st.code(dot_text, language="dot")
-                        st.download_button("Download DOT", data=dot_text, file_name="lineage.dot", mime="text/vnd.graphviz")
+                    st.subheader("DOT Source")
+                    st.code(dot_text, language="dot")
+                    st.download_button("Download DOT", data=dot_text, file_name="lineage.dot", mime="text/vnd.graphviz")
+                    if prompt_reports:
+                        report = prompt_reports[-1]
+                        with st.expander("Prompt context"):
+                            st.write(
+                                f"{report['tokens_used']} of {report['token_budget']} tokens used "
+                                f"({report['tokens_before']} before compaction, {report['tokenizer']}); "
+                                f"{report['units_included']} code units included, {report['duplicates_dropped']} duplicates dropped."
+                            )
+                            if report["omitted"]:
+                                st.dataframe(report["omitted"], use_container_width=True)
 
                 except Exception as e:
                     st.error(str(e))
+
+    # Backend call timings, query ids, rows, bytes, tokens and cache hits for this session only
+    tracer = get_tracer()
+    with st.expander("Diagnostics"):
+        spans = tracer.spans(session=trace_session)
+        if not spans:
+            st.caption("No backend calls recorded yet.")
+        else:
+            st.caption(f"{len(spans)} recorded spans: totals per call, then the 200 most recent.")
+            st.dataframe(tracer.summary(spans), use_container_width=True, hide_index=True)
+            fields = ["name", "op", "duration_ms", "status", "rows", "bytes", "prompt_tokens", "completion_tokens",
+                      "cache_hits", "cache_misses", "fragments_reused", "fragments_extracted", "query_id", "sql", "error"]
+            st.dataframe(
+                [{f: span.get(f) for f in fields} for span in reversed(spans[-200:])],
+                use_container_width=True,
+                hide_index=True,
+            )
+            export_col, clear_col = st.columns([1, 1])
+            export_col.download_button(
+                "Export spans (JSON Lines)", data=tracer.to_jsonl(spans), file_name="snfl_spans.jsonl", mime="application/x-ndjson"
+            )
+            if clear_col.button("Clear spans"):
+                tracer.clear(session=trace_session)
+                st.rerun()
@@ -0,0 +1,6 @@
+import os
+import tempfile
+
+# Keep the on-disk caches created at import time out of the user's cache directory.
+os.environ.setdefault("SNFL_CACHE_DIR", tempfile.mkdtemp(prefix="snfl_tests_"))
+os.environ.setdefault("SNFL_TRACING", "1")
@@ -0,0 +1,43 @@
+import json
+import os
+
+import cli
+
+CODE = {
+    "a.sql": "CREATE TABLE db.s.dst AS SELECT * FROM db.s.src;\nCREATE TABLE db.t.x AS SELECT * FROM db.s.dst;",
+}
+
+
+def make_job(tmp_path, **options):
+    os.makedirs(tmp_path / "lineage", exist_ok=True)
+    return {
+        "name": "repo", "slug": "repo", "files": CODE, "lineage_csv": None, "api_key": None, "out": str(tmp_path),
+        "options": dict({"target": None, "max_hops": 2, "theme": "vibrant", "use_llm": False,
+                         "level_of_detail": "auto", "svg": False}, **options),
+    }
+
+
+def test_json_output_describes_the_rendered_graph(tmp_path):
+    cli.run_lineage_job(make_job(tmp_path, level_of_detail="schema"))
+    with open(tmp_path / "lineage" / "repo.json", encoding="utf-8") as f:
+        graph = json.load(f)
+    dot = (tmp_path / "lineage" / "repo.dot").read_text(encoding="utf-8")
+    assert sorted(graph["nodes"]) == ["DB.S", "DB.T"]
+    assert all(f'"{name}" [' in dot for name in graph["nodes"])
+    assert [(e["source"], e["target"]) for e in graph["edges"]] == [("DB.S", "DB.T")]
+
+
+def test_lineage_csv_is_loaded_once_per_process(tmp_path, monkeypatch):
+    path = tmp_path / "edges.csv"
+    path.write_text("source,target,operation\nDB.S.DST,DB.R.REPORT,VIEW\n", encoding="utf-8")
+    loads = []
+    from_csv = cli.backend.EdgeTable.from_csv
+    monkeypatch.setattr(cli.backend.EdgeTable, "from_csv", lambda f: loads.append(1) or from_csv(f))
+    monkeypatch.setattr(cli, "_edge_tables", {})
+    for _ in range(2):
+        job = make_job(tmp_path)
+        job["lineage_csv"] = str(path)
+        cli.run_lineage_job(job)
+    with open(tmp_path / "lineage" / "repo.json", encoding="utf-8") as f:
+        assert "DB.R.REPORT" in json.load(f)["nodes"]
+    assert len(loads) == 1
@@ -0,0 +1,47 @@
+import multiprocessing
+import time
+
+import backend
+import cli
+
+
+def drain(limiter, count):
+    for _ in range(count):
+        limiter.acquire()
+
+
+def test_limit_is_shared_across_processes():
+    limiter = cli.RateLimiter(per_minute=120)
+    workers = [multiprocessing.Process(target=drain, args=(limiter, 60)) for _ in range(2)]
+    for p in workers:
+        p.start()
+    for p in workers:
+        p.join()
+    started = time.monotonic()
+    limiter.acquire()
+    # The workers used the whole bucket, so the next request waits for a refill.
+    assert time.monotonic() - started >= 0.4
+
+
+def test_limit_below_one_per_minute_allows_a_first_request():
+    started = time.monotonic()
+    cli.RateLimiter(per_minute=0.5).acquire()
+    assert time.monotonic() - started < 0.1
+
+
+def test_throttle_runs_per_request_not_per_cache_hit(monkeypatch):
+    calls = []
+    response = type("Response", (), {
+        "usage": None,
+        "choices": [type("Choice", (), {"message": type("Message", (), {"content": "{}"})()})()],
+    })()
+    client = type("Client", (), {})()
+    client.chat = type("Chat", (), {})()
+    client.chat.completions = type("Completions", (), {"create": staticmethod(lambda **kwargs: response)})()
+    monkeypatch.setattr(backend, "_get_client", lambda key: client)
+    monkeypatch.setattr(backend, "_request_throttle", lambda: calls.append(1))
+    messages = [{"role": "user", "content": "throttle test"}]
+    for _ in range(2):
+        backend._cached_chat_completion("key", "lineage_enrichment", messages)
+    backend._cached_chat_completion("key", "lineage_enrichment", messages, use_cache=False)
+    assert len(calls) == 2
@@ -0,0 +1,82 @@
+import json
+
+import backend
+
+
+class FakeCursor:
+    def __init__(self, columns, rows):
+        self.description = [(c,) for c in columns]
+        self._rows = rows
+        self.sfqid = "q"
+        self.rowcount = len(rows)
+
+    def execute(self, sql, params=None):
+        return self
+
+    def fetchall(self):
+        return list(self._rows)
+
+    def fetchmany(self, size=None):
+        rows, self._rows = self._rows, []
+        return rows
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, columns, rows):
+        self.columns, self.rows = columns, rows
+
+    def cursor(self):
+        return FakeCursor(self.columns, self.rows)
+
+
+def catalog_columns():
+    rows = [
+        ("S", "T", "BASE TABLE", "ID", "NUMBER", "NO", None, "Key", None, 38, 0, None),
+        ("S", "T", "BASE TABLE", "NAME", "TEXT", "YES", None, None, 100, None, None, None),
+        ("S", "T", "BASE TABLE", "AMOUNT", "FLOAT", "YES", "0", None, None, None, None, None),
+        ("S", "T", "BASE TABLE", "CREATED", "TIMESTAMP_NTZ", "YES", None, None, None, None, None, 9),
+    ]
+    return {field: [row[i] for row in rows] for i, field in enumerate(backend._COLUMN_CATALOG_FIELDS)}
+
+
+def show_columns_rows():
+    def row(name, data_type, nullable, default="", comment=""):
+        return ("T", "S", name, json.dumps(data_type), nullable, default, "COLUMN", "", comment, "", "")
+
+    columns = ["table_name", "schema_name", "column_name", "data_type", "null?", "default", "kind", "expression",
+               "comment", "database_name", "autoincrement"]
+    rows = [
+        row("ID", {"type": "FIXED", "precision": 38, "scale": 0, "nullable": False}, "false", comment="Key"),
+        row("NAME", {"type": "TEXT", "length": 100, "byteLength": 400, "nullable": True}, "true"),
+        row("AMOUNT", {"type": "REAL", "nullable": True}, "true", default="0"),
+        row("CREATED", {"type": "TIMESTAMP_NTZ", "precision": 0, "scale": 9, "nullable": True}, "true"),
+    ]
+    return columns, rows
+
+
+def test_catalog_formats_full_types():
+    columns = backend.ColumnCatalog.from_columns(catalog_columns()).lookup("S", "T")
+    assert [c["type"] for c in columns] == ["NUMBER(38,0)", "VARCHAR(100)", "FLOAT", "TIMESTAMP_NTZ(9)"]
+    assert [c["nullable"] for c in columns] == [False, True, True, True]
+    assert {c["kind"] for c in columns} == {"COLUMN"}
+
+
+def test_catalog_and_show_columns_agree():
+    from_catalog = backend.ColumnCatalog.from_columns(catalog_columns()).lookup("S", "T")
+    from_show = backend.get_table_or_view_columns(FakeConnection(*show_columns_rows()), "DB", "S", "T")
+    assert from_show == from_catalog
+    assert all(set(c) == set(backend.ColumnCatalog.FIELDS) for c in from_show)
+
+
+def test_lookup_with_schema_names_that_sort_below_the_dot():
+    objects = [("A", "T"), ("A$X", "A"), ("A$X", "T"), ("A.B", "C"), ("A", "B.C")]
+    rows = [(schema, name, "BASE TABLE", "ID", "NUMBER", "NO", None, None, None, 38, 0, None)
+            for schema, name in objects]
+    columns = {field: [row[i] for row in rows] for i, field in enumerate(backend._COLUMN_CATALOG_FIELDS)}
+    catalog = backend.ColumnCatalog.from_columns(columns)
+    for schema, name in objects:
+        assert [c["name"] for c in catalog.lookup(schema, name)] == ["ID"]
+    assert catalog.lookup("A", "X") is None
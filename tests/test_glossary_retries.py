@@ -0,0 +1,95 @@
+import asyncio
+
+import pytest
+
+import backend
+
+CHUNK = {"name": "model", "tables": [{"name": "orders", "dimensions": [{"name": "id"}]}]}
+RESULT = '{"columns": [{"table": "orders", "column": "id"}], "terms": []}'
+
+
+class StatusError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"status {status_code}")
+        self.status_code = status_code
+
+
+class Event:
+    def __init__(self, content):
+        delta = type("Delta", (), {"content": content})()
+        self.choices = [type("Choice", (), {"delta": delta})()]
+        self.usage = None
+
+
+class FakeClient:
+    def __init__(self, failures):
+        self.failures = list(failures)
+        self.calls = 0
+        self.chat = type("Chat", (), {"completions": self})()
+
+    async def create(self, **kwargs):
+        self.calls += 1
+        if self.failures:
+            raise self.failures.pop(0)
+
+        async def stream():
+            yield Event(RESULT)
+
+        return stream()
+
+    async def close(self):
+        pass
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    delays = []
+
+    async def sleep(delay):
+        delays.append(delay)
+
+    monkeypatch.setattr(backend.asyncio, "sleep", sleep)
+    return delays
+
+
+def run(monkeypatch, client, max_retries=2):
+    monkeypatch.setattr(backend, "_get_async_client", lambda key: client)
+    events = []
+    asyncio.run(backend._stream_glossary_chunks(
+        "key", [CHUNK], 1, max_retries, False, lambda *event: events.append(event),
+    ))
+    return [kind for kind, _, _ in events]
+
+
+@pytest.mark.parametrize("error", [StatusError(429), StatusError(503), asyncio.TimeoutError()])
+def test_retryable_errors_are_retried(monkeypatch, sleeps, error):
+    client = FakeClient([error])
+    assert run(monkeypatch, client) == ["column", "done"]
+    assert client.calls == 2 and sleeps == [1]
+
+
+@pytest.mark.parametrize("status", [400, 401, 404])
+def test_client_errors_are_not_retried(monkeypatch, sleeps, status):
+    client = FakeClient([StatusError(status)])
+    assert run(monkeypatch, client) == ["error"]
+    assert client.calls == 1 and sleeps == []
+
+
+def test_retries_stop_after_max_retries(monkeypatch, sleeps):
+    client = FakeClient([StatusError(500)] * 5)
+    assert run(monkeypatch, client, max_retries=2) == ["error"]
+    assert client.calls == 3 and sleeps == [1, 2]
+
+
+def test_backoff_does_not_hold_the_semaphore(monkeypatch):
+    client = FakeClient([StatusError(429)])
+    held = []
+
+    async def sleep(delay):
+        held.append(semaphore.locked())
+
+    semaphore = asyncio.Semaphore(1)
+    monkeypatch.setattr(backend.asyncio, "Semaphore", lambda n: semaphore)
+    monkeypatch.setattr(backend.asyncio, "sleep", sleep)
+    assert run(monkeypatch, client) == ["column", "done"]
+    assert held == [False]
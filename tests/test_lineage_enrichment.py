@@ -0,0 +1,36 @@
+import pytest
+
+import backend
+
+CODE = [{"name": "etl.sql", "content": "CREATE TABLE db.s.dst AS SELECT * FROM db.s.src;"}]
+
+
+def test_enrichment_labels_are_applied(monkeypatch):
+    monkeypatch.setattr(
+        backend, "_cached_chat_completion",
+        lambda *a, **k: '{"nodes": [{"name": "DB.S.DST", "label": "Destination"}], "edges": []}',
+    )
+    dot = backend.generate_lineage_dot("key", [], CODE, use_llm=True)
+    assert '"Destination"' in dot
+
+
+def test_api_failure_is_raised(monkeypatch):
+    def fail(*args, **kwargs):
+        raise RuntimeError("401 invalid api key")
+
+    monkeypatch.setattr(backend, "_cached_chat_completion", fail)
+    with pytest.raises(Exception, match="invalid api key"):
+        backend.generate_lineage_dot("key", [], CODE, use_llm=True)
+
+
+def test_invalid_json_returns_unlabeled_diagram_with_warning(monkeypatch):
+    monkeypatch.setattr(backend, "_cached_chat_completion", lambda *a, **k: "not json")
+    warnings = []
+    dot = backend.generate_lineage_dot("key", [], CODE, use_llm=True, on_warning=warnings.append)
+    assert "DB.S.DST" in dot
+    assert len(warnings) == 1 and "invalid JSON" in warnings[0]
+
+
+def test_missing_key_is_raised():
+    with pytest.raises(backend.OpenAIClientNotConfigured):
+        backend.generate_lineage_dot(None, [], CODE, use_llm=True)
@@ -0,0 +1,44 @@
+import time
+
+import backend
+
+CONN = type("Conn", (), {"account": "acct", "role": "analyst"})()
+
+
+def make_cache(monkeypatch, altered):
+    monkeypatch.setattr(backend, "_schema_last_altered", lambda conn, database: {"S": altered})
+    cache = backend.MetadataCache(ttls={"schema": -1}, check_last_altered=True)
+    cache.set(CONN, "schema", ("DB", "S", "tables"), ["T1"])
+    return cache
+
+
+def test_unchanged_schema_keeps_expired_entry_with_one_miss(monkeypatch):
+    cache = make_cache(monkeypatch, altered=0.0)
+    assert cache.get(CONN, "schema", ("DB", "S", "tables")) == ["T1"]
+    # One miss for the expired entry and one for loading LAST_ALTERED.
+    assert cache.stats()["misses"] == 2
+    assert cache.get(CONN, "schema", ("DB", "S", "tables")) == ["T1"]
+    assert (cache.stats()["hits"], cache.stats()["misses"]) == (1, 3)
+
+
+def test_changed_schema_is_a_miss(monkeypatch):
+    cache = make_cache(monkeypatch, altered=time.time() + 60)
+    assert cache.get(CONN, "schema", ("DB", "S", "tables")) is None
+    assert cache.stats()["misses"] == 2
+
+
+def test_listings_not_tracked_by_last_altered_expire_by_ttl(monkeypatch):
+    cache = make_cache(monkeypatch, altered=0.0)
+    cache.set(CONN, "schema", ("DB", "S", "stages"), ["STG"])
+    cache.set(CONN, "schema", ("DB", "S", "views"), ["V1"])
+    assert cache.get(CONN, "schema", ("DB", "S", "stages")) is None
+    assert cache.get(CONN, "schema", ("DB", "S", "views")) == ["V1"]
+
+
+def test_peek_ignores_ttl_and_counts_nothing():
+    store = backend.PersistentCache(default_ttl=-1)
+    store.set(("a",), 1)
+    age, value = store.peek(("a",))
+    assert value == 1 and age >= 0
+    assert store.peek(("b",)) is None
+    assert store.stats()["hits"] == store.stats()["misses"] == 0
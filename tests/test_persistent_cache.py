@@ -0,0 +1,26 @@
+import multiprocessing
+
+import backend
+
+
+def hammer(path, worker, rounds):
+    # No memory tier: every get reads, and touches, the row on disk.
+    cache = backend.PersistentCache(path, namespace="shared", max_entries=0)
+    for i in range(rounds):
+        cache.set(("key", worker, i), {"value": i})
+        cache.set(("shared",), worker)
+        assert cache.get(("key", worker, i)) == {"value": i}
+        cache.get(("shared",))
+
+
+def test_processes_can_share_one_cache_file(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    workers = [multiprocessing.Process(target=hammer, args=(path, w, 150)) for w in range(4)]
+    for p in workers:
+        p.start()
+    for p in workers:
+        p.join()
+    assert [p.exitcode for p in workers] == [0, 0, 0, 0]
+    cache = backend.PersistentCache(path, namespace="shared")
+    assert cache.get(("key", 3, 149)) == {"value": 149}
+    assert cache._db.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
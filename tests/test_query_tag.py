@@ -0,0 +1,31 @@
+import json
+
+import backend
+
+
+class RecordingCursor:
+    def __init__(self):
+        self.statements = []
+        self.sfqid = "q"
+        self.rowcount = 0
+
+    def execute(self, sql, params=None):
+        self.statements.append(sql)
+        return self
+
+
+def test_sessions_are_tagged_once_at_connect(monkeypatch):
+    params = {}
+    monkeypatch.setattr(backend.snowflake.connector, "connect", lambda **kwargs: params.update(kwargs) or object())
+    backend.connect_to_snowflake("user", "pat", "account")
+    assert json.loads(params["session_parameters"]["QUERY_TAG"]) == {"app": backend.QUERY_TAG_APP}
+
+
+def test_execute_adds_no_round_trips():
+    cur = RecordingCursor()
+    counter = backend._RoundTripCounter()
+    with backend.get_tracer().span("explorer"):
+        backend._execute(cur, "SHOW DATABASES", counter=counter)
+        backend._execute(cur, "SHOW SCHEMAS", counter=counter)
+    assert cur.statements == ["SHOW DATABASES", "SHOW SCHEMAS"]
+    assert counter.count == 2
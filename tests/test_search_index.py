@@ -0,0 +1,48 @@
+import time
+
+import backend
+
+
+def make_index():
+    index = backend.SearchIndex()
+    index.replace_scope(
+        "DB", "SALES",
+        {"ORDERS": "table", "ORDERS_V": "view", "CUSTOMERS": "table"},
+        {
+            "ORDERS": [("ORDER_ID", "NUMBER(38,0)"), ("CUSTOMER_ID", "NUMBER(38,0)"), ("ORDER_DATE", "DATE")],
+            "CUSTOMERS": [("CUSTOMER_ID", "NUMBER(38,0)"), ("CUSTOMER_NAME", "VARCHAR(100)")],
+        },
+        persist=False,
+    )
+    return index
+
+
+def paths(results):
+    return [r["path"] for r in results]
+
+
+def test_exact_name_ranks_before_prefix_and_objects_before_columns():
+    total, results = make_index().search("orders")
+    assert paths(results)[:2] == ["DB.SALES.ORDERS", "DB.SALES.ORDERS_V"]
+    assert [r["score"] for r in results[:2]] == [4, 3]
+    assert all(r["kind"] == "column" for r in results[2:])
+
+
+def test_all_terms_must_match():
+    total, results = make_index().search("customer name")
+    assert paths(results) == ["DB.SALES.CUSTOMERS.CUSTOMER_NAME"]
+
+
+def test_kind_type_and_parent_filters():
+    index = make_index()
+    assert paths(index.search("kind:view orders")[1]) == ["DB.SALES.ORDERS_V"]
+    assert paths(index.search("type:date")[1]) == ["DB.SALES.ORDERS.ORDER_DATE"]
+    assert paths(index.search("cust.customer_id")[1]) == ["DB.SALES.CUSTOMERS.CUSTOMER_ID"]
+
+
+def test_long_queries_do_not_blow_up():
+    index = make_index()
+    started = time.perf_counter()
+    total, results = index.search(" ".join(["order", "id", "customer", "date", "name"] * 6))
+    assert time.perf_counter() - started < 1.0
+    assert total == 0 and results == []
@@ -0,0 +1,19 @@
+import pytest
+
+from backend import extract_sql_lineage
+
+
+def kinds(sql):
+    return {name: node["kind"] for name, node in extract_sql_lineage(sql, "a.sql").nodes.items()}
+
+
+def test_unload_subquery_tables_are_sources():
+    assert kinds("COPY INTO @db.s.st/out/ FROM (SELECT * FROM db.s.tgt);") == {"DB.S.ST": "stage", "DB.S.TGT": "source"}
+
+
+@pytest.mark.parametrize("sql", [
+    "COPY INTO db.s.t FROM @db.s.st/in/;",
+    "COPY INTO db.s.t FROM (SELECT $1 FROM @db.s.st);",
+])
+def test_load_from_stage_marks_the_stage(sql):
+    assert kinds(sql) == {"DB.S.T": "table", "DB.S.ST": "stage"}
@@ -0,0 +1,105 @@
+from backend import plan_sql_statements
+
+
+def plan(*statements):
+    return {node["index"]: node for node in plan_sql_statements(list(statements))}
+
+
+def test_independent_creates_run_in_parallel():
+    nodes = plan("CREATE TABLE db.s.a (x INT)", "CREATE TABLE db.s.b (x INT)")
+    assert nodes[0]["depends_on"] == []
+    assert nodes[1]["depends_on"] == []
+    assert not nodes[0]["barrier"] and not nodes[1]["barrier"]
+
+
+def test_write_waits_for_create_of_same_object():
+    nodes = plan("CREATE TABLE db.s.t (x INT)", "INSERT INTO db.s.t VALUES (1)", "CREATE TABLE db.s.u (x INT)")
+    assert nodes[1]["depends_on"] == [0]
+    assert nodes[2]["depends_on"] == []
+
+
+def test_read_waits_for_writer_and_later_write_waits_for_readers():
+    nodes = plan(
+        "CREATE TABLE db.s.src (x INT)",
+        "CREATE TABLE db.s.dst AS SELECT * FROM db.s.src",
+        "INSERT INTO db.s.src VALUES (1)",
+    )
+    assert nodes[1]["depends_on"] == [0]
+    assert nodes[1]["reads"] == ["DB.S.SRC"]
+    assert nodes[2]["depends_on"] == [0, 1]
+
+
+def test_use_statement_is_barrier_and_sets_context():
+    nodes = plan(
+        "CREATE TABLE db.s.t (x INT)",
+        "USE SCHEMA db.s",
+        "INSERT INTO t VALUES (1)",
+    )
+    assert nodes[1]["barrier"]
+    assert nodes[1]["depends_on"] == [0]
+    assert nodes[2]["writes"] == ["DB.S.T"]
+    assert nodes[2]["reads"] == ["DB.S.T"]
+    assert nodes[2]["depends_on"] == [0, 1]
+
+
+def test_create_database_and_schema_are_barriers_and_switch_context():
+    nodes = plan("CREATE DATABASE d1", "CREATE SCHEMA s1", "CREATE TABLE t (x INT)")
+    assert nodes[0]["barrier"] and nodes[1]["barrier"]
+    assert nodes[1]["writes"] == ["D1.S1"]
+    assert nodes[2]["writes"] == ["D1.S1.T"]
+    assert nodes[2]["depends_on"] == [0, 1]
+
+
+def test_create_warehouse_is_session_barrier():
+    nodes = plan(
+        "CREATE WAREHOUSE wh_a",
+        "CREATE OR REPLACE WAREHOUSE wh_b",
+        "CREATE TABLE db.s.t (x INT)",
+        "INSERT INTO db.s.t VALUES (1)",
+    )
+    assert nodes[0]["barrier"] and nodes[1]["barrier"]
+    assert nodes[1]["depends_on"] == [0]
+    assert nodes[2]["depends_on"] == [1]
+    assert nodes[3]["depends_on"] == [1, 2]
+
+
+def test_alter_warehouse_is_not_a_barrier():
+    nodes = plan("ALTER WAREHOUSE wh SET WAREHOUSE_SIZE = 'SMALL'", "CREATE TABLE db.s.t (x INT)")
+    assert not nodes[0]["barrier"]
+    assert nodes[1]["depends_on"] == []
+
+
+def test_unrecognised_statement_is_barrier():
+    nodes = plan("CREATE TABLE db.s.a (x INT)", "CALL db.s.proc()", "CREATE TABLE db.s.b (x INT)")
+    assert nodes[1]["barrier"]
+    assert nodes[1]["depends_on"] == [0]
+    assert nodes[2]["depends_on"] == [1]
+
+
+def test_grants_run_in_parallel_but_precede_later_writes():
+    nodes = plan(
+        "CREATE TABLE db.s.t (x INT)",
+        "GRANT SELECT ON TABLE db.s.t TO ROLE r1",
+        "GRANT SELECT ON TABLE db.s.t TO ROLE r2",
+        "INSERT INTO db.s.t VALUES (1)",
+    )
+    assert nodes[1]["depends_on"] == [0]
+    assert nodes[2]["depends_on"] == [0]
+    assert {1, 2} <= set(nodes[3]["depends_on"])
+
+
+def test_grant_on_all_is_barrier():
+    nodes = plan("CREATE TABLE db.s.t (x INT)", "GRANT SELECT ON ALL TABLES IN SCHEMA db.s TO ROLE r")
+    assert nodes[1]["barrier"]
+
+
+def test_objects_named_in_string_literals_are_dependencies():
+    nodes = plan(
+        "CREATE FILE FORMAT db.s.ff TYPE = CSV",
+        "CREATE STAGE db.s.st FILE_FORMAT = (FORMAT_NAME = 'db.s.ff')",
+        "CREATE TABLE db.s.t (x INT)",
+        "COPY INTO db.s.t FROM @db.s.st FILE_FORMAT = (FORMAT_NAME = 'db.s.ff')",
+    )
+    assert nodes[1]["reads"] == ["DB.S.FF"]
+    assert nodes[1]["depends_on"] == [0]
+    assert nodes[3]["depends_on"] == [0, 1, 2]
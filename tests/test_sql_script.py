@@ -0,0 +1,92 @@
+import itertools
+import threading
+
+import pytest
+
+import backend
+
+_query_ids = itertools.count(1)
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+        self.sfqid = None
+        self.rowcount = 0
+
+    def execute(self, sql, params=None):
+        self.sfqid = f"q{next(_query_ids)}"
+        with self.conn.lock:
+            self.conn.executed.append((self.sfqid, sql))
+        return self
+
+    def fetchall(self):
+        return []
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = False
+        self.executed = []
+        self.lock = threading.Lock()
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def is_closed(self):
+        return self.closed
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    monkeypatch.setattr(backend, "connect_to_snowflake", lambda **params: FakeConnection())
+    pool = backend.SnowflakeConnectionPool({"account": "a", "user": "u", "password": "p"}, min_size=1, max_size=2)
+    yield pool
+    pool.close()
+
+
+def run(pool, script):
+    return backend.execute_sql_script(pool, script, max_workers=4)
+
+
+def test_query_ids_belong_to_their_statements(pool):
+    statements = [f"CREATE TABLE db.s.t{i} (x INT)" for i in range(40)]
+    results = run(pool, ";\n".join(statements) + ";")
+    conn = pool._idle[-1][0]
+    executed = {query_id: sql for query_id, sql in conn.executed if sql.startswith("CREATE")}
+    assert len(results) == 40
+    for result in results:
+        assert executed[result["query_id"]].strip().rstrip(";") == result["statement"].strip().rstrip(";")
+
+
+def test_plain_scripts_return_the_session_to_the_pool(pool):
+    run(pool, "CREATE TABLE db.s.t (x INT); INSERT INTO db.s.t VALUES (1);")
+    assert pool.stats()["recycled"] == 0
+    assert pool.stats()["idle"] == 1
+
+
+@pytest.mark.parametrize("statement", [
+    "USE ROLE sysadmin",
+    "USE DATABASE other",
+    "CREATE DATABASE d2",
+    "CREATE WAREHOUSE wh",
+    "ALTER SESSION SET TIMEZONE = 'UTC'",
+])
+def test_session_changing_scripts_discard_the_session(pool, statement):
+    conn = pool._idle[-1][0]
+    run(pool, f"{statement}; CREATE TABLE db.s.t (x INT);")
+    assert conn.closed
+    assert pool.stats()["recycled"] == 1
+    assert pool.stats()["size"] == 0
+
+
+@pytest.mark.parametrize("min_size, max_size", [(-1, 2), (3, 2), (0, 0)])
+def test_pool_rejects_invalid_sizes(min_size, max_size):
+    with pytest.raises(ValueError):
+        backend.SnowflakeConnectionPool({"account": "a"}, min_size=min_size, max_size=max_size)
@@ -0,0 +1,55 @@
+import io
+
+import pytest
+
+from backend import iter_sql_statements, split_sql_statements
+
+PROCEDURE = (
+    "CREATE OR REPLACE PROCEDURE db.s.p()\nRETURNS STRING\nLANGUAGE SQL\nAS $$\nBEGIN\n"
+    "    INSERT INTO db.s.t SELECT 1;\n    RETURN 'done; ok';\nEND;\n$$;"
+)
+SCRIPT = "\n".join([
+    "-- setup; not a statement",
+    "USE ROLE sysadmin;",
+    "/* block; comment */ CREATE TABLE db.s.t (\"odd;col\" INT);",
+    PROCEDURE,
+    "// slash comment; here",
+    "INSERT INTO db.s.t SELECT 'it''s; fine', 'back\\'slash;';",
+    "SELECT 1",
+])
+EXPECTED = [
+    "-- setup; not a statement\nUSE ROLE sysadmin;",
+    "/* block; comment */ CREATE TABLE db.s.t (\"odd;col\" INT);",
+    PROCEDURE,
+    "// slash comment; here\nINSERT INTO db.s.t SELECT 'it''s; fine', 'back\\'slash;';",
+    "SELECT 1",
+]
+
+
+def test_semicolons_inside_quotes_comments_and_dollar_bodies():
+    assert split_sql_statements(SCRIPT) == EXPECTED
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 5, 7, 64])
+def test_chunk_boundaries_do_not_change_the_split(chunk_size):
+    # Small chunks cut through "$$", "--", "/*", "*/" and quoted text.
+    assert list(iter_sql_statements(io.StringIO(SCRIPT), chunk_size=chunk_size)) == EXPECTED
+
+
+def test_comment_only_fragments_are_dropped():
+    assert split_sql_statements("SELECT 1; -- trailing\n/* only */ ;\n;") == ["SELECT 1;"]
+
+
+def test_unterminated_body_is_returned_as_the_last_statement():
+    text = "SELECT 1; CREATE PROCEDURE p() AS $$ BEGIN RETURN 1; END;"
+    assert split_sql_statements(text) == ["SELECT 1;", "CREATE PROCEDURE p() AS $$ BEGIN RETURN 1; END;"]
+    assert list(iter_sql_statements(io.StringIO(text), chunk_size=4)) == split_sql_statements(text)
+
+
+def test_statements_match_sqlparse_on_setup_sql():
+    sqlparse = pytest.importorskip("sqlparse")
+    with open("setup.sql", encoding="utf-8") as f:
+        text = f.read()
+    expected = [s.strip() for s in sqlparse.split(text) if s.strip()]
+    assert split_sql_statements(text) == expected
+    assert list(iter_sql_statements(io.StringIO(text), chunk_size=97)) == expected
@@ -0,0 +1,21 @@
+import pytest
+
+from backend import _qualify_stage_name
+
+
+@pytest.mark.parametrize("name, expected", [
+    ("@DB.SCH.STG", "DB.SCH.STG"),
+    ("SCH.STG/path/a.csv", "MYDB.SCH.STG/path/a.csv"),
+    ("@STG", "MYDB.PUBLIC.STG"),
+    ("STG/dir.v2/file", "MYDB.PUBLIC.STG/dir.v2/file"),
+    ('"my.schema".STG', 'MYDB."my.schema".STG'),
+    ('"odd.stage"', 'MYDB.PUBLIC."odd.stage"'),
+    ("%ORDERS", "MYDB.PUBLIC.%ORDERS"),
+    ("@~/staged", "~/staged"),
+])
+def test_names_are_qualified_with_the_given_database(name, expected):
+    assert _qualify_stage_name(name, "MYDB") == expected
+
+
+def test_names_are_unchanged_without_a_database():
+    assert _qualify_stage_name("@STG") == "STG"